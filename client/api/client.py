@@ -8,8 +8,27 @@ from typing import Optional, List, Dict, Any
 from pathlib import Path
 import hashlib
 import threading
+import time
+import uuid
 import websocket
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Nachrichtenformate, die der Server per Subprotokoll aushandelt
+JSON_SUBPROTOCOL = "multiboard.json"
+MSGPACK_SUBPROTOCOL = "multiboard.msgpack"
+
+# Antworten haben einen idempotency_key, Wiederholungen sind daher sicher
+SUBMIT_RETRIES = 3
+SUBMIT_RETRY_DELAY = 1.0  # Sekunden, wächst pro Versuch
+
+
+class RPCUnavailable(Exception):
+    """WebSocket-RPC gerade nicht möglich -> HTTP verwenden"""
+
 
 class APIClient:
     """Client für API-Kommunikation"""
@@ -29,6 +48,22 @@ class APIClient:
         self._ws_thread: Optional[threading.Thread] = None
         self._on_rooms_updated: Optional[callable] = None
         self._ws_connected = False
+        self._ws_binary = False  # True wenn MessagePack ausgehandelt wurde
+
+        # Lokale Raumliste + letzte bekannte Version pro Topic (für Deltas)
+        self._rooms: List[Dict] = []
+        self._rooms_lock = threading.Lock()
+        self._topic_versions: Dict[str, int] = {}
+        self._topic_epoch: Optional[str] = None
+
+        # WebSocket-RPC (Antworten über den bestehenden Socket statt HTTP)
+        self._ws_authenticated = False
+        self._rpc_lock = threading.Lock()
+        self._rpc_next_id = 1
+        self._rpc_pending: Dict[int, Dict] = {}
+
+        # Aktueller Raum/Rätsel dieses Boards (Presence, wird nach Reconnect erneut gemeldet)
+        self._presence: Dict[str, Optional[int]] = {"room_id": None, "puzzle_id": None}
 
     def _get_headers(self) -> Dict[str, str]:
         """Erstellt Headers mit Auth-Token"""
@@ -99,8 +134,66 @@ class APIClient:
             seen.add(rid)
             unique.append(room)
 
+        with self._rooms_lock:
+            self._rooms = list(unique)
+
         return unique
 
+    def _room_visible(self, room: Dict) -> bool:
+        """Sieht der eingeloggte User diesen Raum in seiner Liste?"""
+        role = (self.user or {}).get("role")
+        if role == "teacher":
+            return room.get("teacher_id") == self.user.get("id")
+        if role == "student":
+            return bool(room.get("is_active"))
+        return True
+
+    def _check_versions(self, versions: Dict[str, int], epoch: Optional[str] = None) -> bool:
+        """
+        Versionsnummern eines Events prüfen
+
+        Returns: True wenn lückenlos, False wenn Events fehlen
+        (dann muss komplett neu geladen werden)
+
+        Eine andere Epoche heißt: der Server zählt neu (Broker gewechselt),
+        die Nummern sind nicht vergleichbar -> immer neu laden.
+        """
+        known = [t for t in versions if t in self._topic_versions]
+        if not known:
+            return False
+
+        if epoch != self._topic_epoch:
+            self._topic_epoch = epoch
+            for topic in known:
+                self._topic_versions[topic] = versions[topic]
+            return False
+
+        in_order = all(versions[t] == self._topic_versions[t] + 1 for t in known)
+        for topic in known:
+            self._topic_versions[topic] = versions[topic]
+        return in_order
+
+    def _apply_room_delta(self, event: Dict) -> List[Dict]:
+        """Raumliste mit einem rooms_updated-Delta patchen"""
+        room_id = event.get("room_id")
+        room = event.get("room")
+
+        with self._rooms_lock:
+            rooms = list(self._rooms)
+            index = next((i for i, r in enumerate(rooms)
+                          if r.get("id") == room_id and r.get("mode") != "offline"), None)
+
+            if room is not None and self._room_visible(room):
+                if index is None:
+                    rooms.append(room)
+                else:
+                    rooms[index] = room
+            elif index is not None:
+                del rooms[index]
+
+            self._rooms = rooms
+            return list(rooms)
+
     def start_session(self, room_id: int):
         """Startet eine neue Session"""
         room = next((r for r in self.offline_rooms if r["id"] == room_id), None)
@@ -148,28 +241,73 @@ class APIClient:
             }
 
         # ONLINE
+        data = {
+            "session_id": session_id,
+            "puzzle_id": puzzle_id,
+            "answer_json": answer,
+            "time_taken_seconds": time_taken,
+            "idempotency_key": uuid.uuid4().hex
+        }
+
+        # RPC ohne Antwort -> gleiche Antwort (gleicher Schlüssel) noch einmal über HTTP
         try:
-            data = {
-                "session_id": session_id,
-                "puzzle_id": puzzle_id,
-                "answer_json": answer,
-                "time_taken_seconds": time_taken
-            }
-            response = requests.post(
-                f"{self.base_url}/api/game/submit-answer",
-                headers=self._get_headers(),
-                json=data,
-                timeout=10
-            )
-            if response.status_code == 200:
-                return response.json()
-            return None
-        except Exception as e:
-            print(f"Fehler beim Senden der Antwort: {e}")
-            return None
+            result = self._rpc_call("submit-answer", data)
+            if result is not None:
+                return result
+        except RPCUnavailable:
+            pass
+
+        return self._post_with_retry("/api/game/submit-answer", data, timeout=10)
+
+    def submit_answers(self, answers: List[Dict[str, Any]]) -> Optional[Dict]:
+        """
+        Sendet mehrere Antworten auf einmal (z. B. nach Verbindungsabbruch)
+
+        answers: Liste mit session_id, puzzle_id, answer_json, time_taken_seconds.
+                 Fehlt idempotency_key, wird einer eingetragen (bleibt im dict,
+                 damit ein späterer erneuter Versuch denselben Schlüssel sendet).
+        Returns: {"accepted", "rejected", "points_earned", "results": [...]} oder None
+        """
+        for answer in answers:
+            answer.setdefault("idempotency_key", uuid.uuid4().hex)
+
+        try:
+            result = self._rpc_call("submit-answers", {"answers": answers})
+            if result is not None:
+                return result
+        except RPCUnavailable:
+            pass
+
+        return self._post_with_retry("/api/game/submit-answers", answers, timeout=30)
+
+    def _post_with_retry(self, path: str, payload: Any, timeout: float) -> Optional[Dict]:
+        """POST mit Wiederholung bei Netzwerkfehlern und 5xx (nur für idempotente Anfragen)"""
+        for attempt in range(SUBMIT_RETRIES):
+            try:
+                response = requests.post(
+                    f"{self.base_url}{path}",
+                    headers=self._get_headers(),
+                    json=payload,
+                    timeout=timeout
+                )
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code < 500:
+                    return None  # Fehler in der Anfrage, Wiederholen hilft nicht
+            except Exception as e:
+                print(f"Fehler beim Senden ({path}, Versuch {attempt + 1}): {e}")
+
+            if attempt + 1 < SUBMIT_RETRIES:
+                time.sleep(SUBMIT_RETRY_DELAY * (attempt + 1))
+        return None
 
     def get_progress(self, session_id: int) -> Optional[Dict]:
         """Holt Fortschritt"""
+        try:
+            return self._rpc_call("progress", {"session_id": session_id})
+        except RPCUnavailable:
+            pass
+
         try:
             response = requests.get(
                 f"{self.base_url}/api/game/session/{session_id}/progress",
@@ -188,6 +326,11 @@ class APIClient:
 
     def complete_session(self, session_id: int) -> bool:
         """Markiert Session als abgeschlossen"""
+        try:
+            return self._rpc_call("complete", {"session_id": session_id}) is not None
+        except RPCUnavailable:
+            pass
+
         try:
             response = requests.post(
                 f"{self.base_url}/api/game/session/{session_id}/complete",
@@ -312,12 +455,42 @@ class APIClient:
         def on_message(ws, message):
             """Wird aufgerufen wenn Nachricht vom Server kommt"""
             try:
-                data = json.loads(message)
+                if isinstance(message, bytes):
+                    data = msgpack.unpackb(message, raw=False)
+                else:
+                    data = json.loads(message)
+
+                if data.get("type") == "ping":
+                    # Heartbeat vom Server beantworten
+                    ws.send("pong")
+                    return
+
+                if data.get("type") in ("rpc_result", "rpc_error"):
+                    self._resolve_rpc(data)
+                    return
+
+                if data.get("type") == "auth_ok":
+                    self._ws_authenticated = True
+                    if self._presence["room_id"] is not None:
+                        self._send_ws({"action": "presence", **self._presence})
+
                 print(f"📨 WebSocket Nachricht: {data}")
 
-                if data.get("type") == "rooms_updated":
-                    # Räume neu laden
+                if data.get("type") == "subscribed":
+                    # Ab hier zählen die Versionen; verpasste Änderungen einmal komplett laden
+                    self._topic_versions.update(data.get("versions", {}))
+                    self._topic_epoch = data.get("epoch")
                     rooms = self.get_available_rooms()
+                    if self._on_rooms_updated:
+                        self._on_rooms_updated(rooms)
+
+                elif data.get("type") == "rooms_updated":
+                    if self._check_versions(data.get("versions", {}), data.get("epoch")):
+                        # Delta direkt einspielen, kein HTTP-Request
+                        rooms = self._apply_room_delta(data)
+                    else:
+                        # Lücke erkannt -> Räume komplett neu laden
+                        rooms = self.get_available_rooms()
 
                     # Callback aufrufen (= GUI updaten)
                     if self._on_rooms_updated:
@@ -330,33 +503,41 @@ class APIClient:
             """Bei Fehlern"""
             print(f"❌ WebSocket Fehler: {error}")
             self._ws_connected = False
+            self._ws_authenticated = False
 
         def on_close(ws, close_status_code, close_msg):
             """Verbindung geschlossen"""
             print("🔌 WebSocket geschlossen")
             self._ws_connected = False
+            self._ws_authenticated = False
+            self._topic_versions.clear()
+            self._topic_epoch = None
+            self._fail_pending_rpcs()
 
         def on_open(ws):
             """Verbindung hergestellt"""
             print("✅ WebSocket verbunden!")
             self._ws_connected = True
+            self._ws_binary = ws.sock.getsubprotocol() == MSGPACK_SUBPROTOCOL
 
-            # Optional: Keep-Alive senden
-            def send_ping():
-                import time
-                while self._ws_connected:
-                    try:
-                        ws.send("ping")
-                        time.sleep(30)  # Alle 30 Sekunden
-                    except:
-                        break
+            # Anmelden, damit Antworten per RPC über den Socket laufen können
+            if self.token:
+                self._send_ws({"action": "auth", "token": self.token})
 
-            ping_thread = threading.Thread(target=send_ping, daemon=True)
-            ping_thread.start()
+            # Nur die Topics abonnieren, die dieses Board interessieren
+            topics = self._default_topics()
+            if topics:
+                self.subscribe(topics)
+            # Keep-Alive macht der Server (Heartbeat-Ping, wir antworten mit "pong")
 
         # WebSocket erstellen
+        subprotocols = [JSON_SUBPROTOCOL]
+        if msgpack is not None:
+            subprotocols.insert(0, MSGPACK_SUBPROTOCOL)
+
         self._ws = websocket.WebSocketApp(
             ws_url,
+            subprotocols=subprotocols,
             on_message=on_message,
             on_error=on_error,
             on_close=on_close,
@@ -370,6 +551,97 @@ class APIClient:
         self._ws_thread = threading.Thread(target=run_websocket, daemon=True)
         self._ws_thread.start()
 
+    def _default_topics(self) -> List[str]:
+        """Topics passend zur Rolle des eingeloggten Users"""
+        if not self.user:
+            return []
+
+        if self.user.get("role") == "teacher":
+            return [f"teacher:{self.user['id']}"]
+
+        return ["active-rooms"]
+
+    def _send_ws(self, payload: Dict) -> bool:
+        """Nachricht im ausgehandelten Format (MessagePack oder JSON) senden"""
+        if not self._ws or not self._ws_connected:
+            return False
+
+        try:
+            if self._ws_binary:
+                self._ws.send(msgpack.packb(payload, use_bin_type=True), opcode=websocket.ABNF.OPCODE_BINARY)
+            else:
+                self._ws.send(json.dumps(payload))
+            return True
+        except Exception as e:
+            print(f"WebSocket Senden fehlgeschlagen: {e}")
+            return False
+
+    def _rpc_call(self, method: str, params: Dict, timeout: float = 10) -> Optional[Dict]:
+        """
+        Request/Response über den WebSocket
+
+        Returns: Ergebnis oder None bei Fehler/Timeout (wie bei HTTP)
+        Raises: RPCUnavailable wenn der Socket nicht bereit ist
+        """
+        if not self._ws_authenticated:
+            raise RPCUnavailable()
+
+        with self._rpc_lock:
+            call_id = self._rpc_next_id
+            self._rpc_next_id += 1
+            call = {"event": threading.Event(), "reply": None}
+            self._rpc_pending[call_id] = call
+
+        if not self._send_ws({"action": "rpc", "id": call_id, "method": method, "params": params}):
+            with self._rpc_lock:
+                self._rpc_pending.pop(call_id, None)
+            raise RPCUnavailable()
+
+        call["event"].wait(timeout)
+        with self._rpc_lock:
+            self._rpc_pending.pop(call_id, None)
+
+        reply = call["reply"]
+        if reply is None:
+            print(f"RPC {method}: keine Antwort")
+            return None
+
+        if reply.get("type") == "rpc_error":
+            print(f"RPC {method} fehlgeschlagen: {reply.get('status')} {reply.get('detail')}")
+            return None
+
+        return reply.get("result")
+
+    def _resolve_rpc(self, reply: Dict):
+        """Antwort vom Server dem wartenden Aufruf zuordnen"""
+        with self._rpc_lock:
+            call = self._rpc_pending.get(reply.get("id"))
+        if call:
+            call["reply"] = reply
+            call["event"].set()
+
+    def _fail_pending_rpcs(self):
+        """Bei Verbindungsabbruch alle wartenden Aufrufe freigeben"""
+        with self._rpc_lock:
+            calls = list(self._rpc_pending.values())
+        for call in calls:
+            call["event"].set()
+
+    def subscribe(self, topics: List[str]) -> bool:
+        """Topics abonnieren, z. B. room:3, teacher:1 oder active-rooms"""
+        return self._send_ws({"action": "subscribe", "topics": topics})
+
+    def unsubscribe(self, topics: List[str]) -> bool:
+        """Topics abbestellen"""
+        return self._send_ws({"action": "unsubscribe", "topics": topics})
+
+    def set_presence(self, room_id: Optional[int], puzzle_id: Optional[int] = None) -> bool:
+        """Dem Server melden, in welchem Raum und an welchem Rätsel dieses Board ist"""
+        self._presence = {"room_id": room_id, "puzzle_id": puzzle_id}
+        if not self._ws_authenticated:
+            return False
+        return self._send_ws({"action": "presence", **self._presence})
+
     def disconnect_websocket(self):
         """WebSocket-Verbindung schließen"""
         if self._ws:
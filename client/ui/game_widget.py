@@ -175,6 +175,7 @@ class GameWidget(QWidget):
         puzzle = self.puzzles[index]
         self.current_puzzle_index = index
         self.start_time = time.time()
+        self.api_client.set_presence(self.session.get("room_id"), puzzle.get("id"))
 
         # Fortschritt aktualisieren
         self.progress_label.setText(f"Frage {index + 1} von {len(self.puzzles)}")
@@ -67,6 +67,7 @@ class H5PGameWidget(QWidget):
 
     def show_puzzle_selection(self):
         """Zeigt Puzzle-Auswahlmenü"""
+        self.api_client.set_presence(self.session.get("room_id"))
         # Content leeren
         while self.content_layout.count():
             child = self.content_layout.takeAt(0)
@@ -322,6 +323,7 @@ class H5PGameWidget(QWidget):
 
         puzzle = self.puzzles[self.current_puzzle_index]
         self.start_time = time.time()
+        self.api_client.set_presence(self.session.get("room_id"), puzzle.get("id"))
 
         # Header
         header_layout = QHBoxLayout()
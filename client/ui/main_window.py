@@ -57,7 +57,8 @@ class MainWindow(QMainWindow):
             self.refresh_button.setText("✨")
             QTimer.singleShot(500, lambda: self.refresh_button.setText(original_text))
 
-        self.load_rooms()
+        # Liste kommt schon fertig vom WebSocket, nicht nochmal laden
+        self.load_rooms(rooms)
 
     def init_ui(self):
         """UI initialisieren"""
@@ -180,8 +181,8 @@ class MainWindow(QMainWindow):
             self.refresh_button.setText("🔄")
         ))
 
-    def load_rooms(self):
-        """Lädt Räume"""
+    def load_rooms(self, rooms=None):
+        """Lädt Räume (oder zeigt eine bereits geladene Liste an)"""
         layout = self.content_container.layout()
 
         while layout.count():
@@ -208,7 +209,8 @@ class MainWindow(QMainWindow):
         load_btn.clicked.connect(self.load_quiz_json)
         layout.addWidget(load_btn)
 
-        rooms = self.api_client.get_available_rooms()
+        if rooms is None:
+            rooms = self.api_client.get_available_rooms()
 
         if not rooms:
             no_rooms = QLabel("Keine Räume verfügbar.\nBitte wende dich an deinen Lehrer.")
@@ -381,11 +383,15 @@ class MainWindow(QMainWindow):
             print("Nutze Standard Game Widget")
             game_widget = GameWidget(self.api_client, session, puzzles, self)
 
+        # Presence setzen die Widgets selbst (Raum bzw. aktuelles Rätsel), hier nur beim Verlassen löschen
+        game_widget.session_completed.connect(lambda *_: self.api_client.set_presence(None))
+
         # Verbinde beide Signals
         game_widget.session_completed.connect(self.load_rooms)
 
         #  exit_requested Signal verbinden (nur H5P Widget hat das)
         if hasattr(game_widget, 'exit_requested'):
+            game_widget.exit_requested.connect(lambda *_: self.api_client.set_presence(None))
             game_widget.exit_requested.connect(self.load_rooms)
 
         layout.addWidget(game_widget)
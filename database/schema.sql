@@ -23,6 +23,7 @@ CREATE TABLE rooms (
     time_limit_minutes INT DEFAULT 60,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    puzzle_count INT NOT NULL DEFAULT 0,  -- Zähler, siehe server/counters.py
     FOREIGN KEY (teacher_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_teacher (teacher_id),
     INDEX idx_active (is_active)
@@ -67,6 +68,7 @@ CREATE TABLE game_sessions (
     completed_at TIMESTAMP NULL,
     total_score INT DEFAULT 0,
     status ENUM('in_progress', 'completed', 'abandoned') DEFAULT 'in_progress',
+    answered_count INT NOT NULL DEFAULT 0,  -- Zähler, siehe server/counters.py
     FOREIGN KEY (room_id) REFERENCES rooms(id) ON DELETE CASCADE,
     FOREIGN KEY (student_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_room_student (room_id, student_id),
@@ -83,8 +85,10 @@ CREATE TABLE puzzle_results (
     points_earned INT DEFAULT 0,
     time_taken_seconds INT,
     answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    idempotency_key VARCHAR(64) NULL,  -- vom Client erzeugt, Wiederholungen liefern das gespeicherte Ergebnis
     FOREIGN KEY (session_id) REFERENCES game_sessions(id) ON DELETE CASCADE,
     FOREIGN KEY (puzzle_id) REFERENCES puzzles(id) ON DELETE CASCADE,
+    UNIQUE KEY uq_puzzle_results_idempotency (session_id, puzzle_id, idempotency_key),
     INDEX idx_session (session_id),
     INDEX idx_puzzle (puzzle_id)
 ) ENGINE=InnoDB;
@@ -106,5 +110,8 @@ INSERT INTO puzzles (room_id, title, h5p_json, puzzle_type, order_index, points)
 (1, 'Was ist 5 + 3?', '{"question": "Was ist 5 + 3?", "options": ["6", "7", "8", "9"], "correct": 2}', 'multiple_choice', 1, 10),
 (1, 'Was ist 12 - 4?', '{"question": "Was ist 12 - 4?", "options": ["6", "7", "8", "9"], "correct": 2}', 'multiple_choice', 2, 10);
 
+-- Rätsel-Zähler der Beispiel-Räume setzen
+UPDATE rooms SET puzzle_count = (SELECT COUNT(*) FROM puzzles WHERE puzzles.room_id = rooms.id);
+
 -- Schüler dem Raum zuweisen
 INSERT INTO room_assignments (room_id, student_id) VALUES (1, 3);
\ No newline at end of file
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+Lasttest: simuliert N Boards gegen den echten FastAPI-Server
+
+Jedes Board meldet sich an, öffnet /ws/rooms, startet eine Session und
+beantwortet Rätsel mit realistischen Denkpausen. Ein Lehrer-Treiber ändert
+regelmäßig Räume, damit die Broadcast-Latenz (Fan-out) gemessen werden kann.
+
+Beispiele (aus dem Projektverzeichnis):
+    python loadtest/boards.py --boards 300 --duration 60
+    python loadtest/boards.py --boards 300 --workers 4 --backplane unix:/tmp/mb-lt.sock
+    python loadtest/boards.py --database-url mysql+pymysql://user:pw@localhost/multiboard_lt
+    python loadtest/boards.py --url http://10.0.0.5:8000 --boards 100   # laufender Server
+
+Ausgabe: Fan-out-Latenz (p50/p95/p99), Antworten/s, HTTP-Latenz pro Endpunkt
+und Speicher pro WebSocket-Verbindung (RSS des Server-Prozessbaums).
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = "loadtest-passwort"
+TEACHER_NAME = "lt_teacher"
+STUDENT_PREFIX = "lt_student_"
+# Markierung in der Raumbeschreibung: Sendezeitpunkt für die Fan-out-Messung
+STAMP_PREFIX = "lt-sent:"
+
+
+# ==================== STATISTIK ====================
+
+def percentile(values: List[float], p: float) -> float:
+    """Perzentil nach Nearest-Rank (values muss nicht sortiert sein)"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Stats:
+    """Sammelt alle Messwerte eines Laufs"""
+
+    def __init__(self):
+        self.http: Dict[str, List[float]] = {}
+        self.http_errors: Dict[str, int] = {}
+        self.fanout: List[float] = []
+        self.answers = 0
+        self.answer_started: Optional[float] = None
+        self.answer_stopped: Optional[float] = None
+        self.ws_connected = 0
+        self.ws_errors = 0
+        self.rss_idle: Optional[int] = None
+        self.rss_connected: Optional[int] = None
+
+    def record_http(self, name: str, seconds: float, ok: bool):
+        self.http.setdefault(name, []).append(seconds)
+        if not ok:
+            self.http_errors[name] = self.http_errors.get(name, 0) + 1
+
+    def report(self, boards: int) -> Dict:
+        all_http = [v for values in self.http.values() for v in values]
+        elapsed = (self.answer_stopped or time.monotonic()) - (self.answer_started or time.monotonic())
+
+        def summary(values: List[float]) -> Dict:
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2) if values else float("nan"),
+            }
+
+        report = {
+            "boards": boards,
+            "ws_connected": self.ws_connected,
+            "ws_errors": self.ws_errors,
+            "answers": self.answers,
+            "answers_per_sec": round(self.answers / elapsed, 2) if elapsed > 0 else 0.0,
+            "fanout": summary(self.fanout),
+            "http": summary(all_http),
+            "http_by_endpoint": {name: summary(values) for name, values in sorted(self.http.items())},
+            "http_errors": self.http_errors,
+        }
+        if self.rss_idle is not None and self.rss_connected is not None and self.ws_connected:
+            report["rss_idle_mb"] = round(self.rss_idle / 2 ** 20, 1)
+            report["rss_connected_mb"] = round(self.rss_connected / 2 ** 20, 1)
+            report["rss_per_socket_kb"] = round((self.rss_connected - self.rss_idle) / self.ws_connected / 1024, 1)
+        return report
+
+
+def print_report(report: Dict):
+    print()
+    print("=" * 64)
+    print(f"Boards: {report['boards']}   WebSockets verbunden: {report['ws_connected']}"
+          f"   WS-Fehler: {report['ws_errors']}")
+    print(f"Antworten: {report['answers']}   ({report['answers_per_sec']} / s)")
+    if "rss_per_socket_kb" in report:
+        print(f"Server-RSS: {report['rss_idle_mb']} MB leer -> {report['rss_connected_mb']} MB verbunden"
+              f"   (~{report['rss_per_socket_kb']} KB pro Socket)")
+
+    print()
+    print(f"{'':28} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = [("Fan-out (Broadcast)", report["fanout"]), ("HTTP gesamt", report["http"])]
+    rows += [(f"  {name}", values) for name, values in report["http_by_endpoint"].items()]
+    for name, s in rows:
+        print(f"{name:28} {s['count']:>7} {s['p50_ms']:>9} {s['p95_ms']:>9} {s['p99_ms']:>9} {s['max_ms']:>9}")
+
+    if report["http_errors"]:
+        print()
+        print("HTTP-Fehler: " + ", ".join(f"{k}={v}" for k, v in report["http_errors"].items()))
+    print("=" * 64)
+
+
+# ==================== SERVER + DATEN ====================
+
+def seed_database(database_url: str, boards: int, rooms: int, puzzles: int):
+    """Lehrer, Schüler, aktive Räume und Rätsel anlegen (vorhandene werden wiederverwendet)"""
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT_DIR)
+
+    from server.database import SessionLocal, init_db
+    from server.auth import get_password_hash
+    from server import models
+
+    init_db()
+    db = SessionLocal()
+    try:
+        # Ein Hash für alle, sonst dauert das Anlegen länger als der Test
+        password_hash = get_password_hash(PASSWORD)
+
+        teacher = db.query(models.User).filter(models.User.username == TEACHER_NAME).first()
+        if teacher is None:
+            teacher = models.User(username=TEACHER_NAME, password_hash=password_hash,
+                                  role="teacher", full_name="Lasttest Lehrer")
+            db.add(teacher)
+            db.flush()
+
+        existing = {name for (name,) in db.query(models.User.username).filter(
+            models.User.username.like(f"{STUDENT_PREFIX}%")
+        )}
+        db.add_all([
+            models.User(username=f"{STUDENT_PREFIX}{i}", password_hash=password_hash,
+                        role="student", full_name=f"Board {i}")
+            for i in range(boards) if f"{STUDENT_PREFIX}{i}" not in existing
+        ])
+
+        room_count = db.query(models.Room).filter(models.Room.teacher_id == teacher.id).count()
+        for r in range(room_count, rooms):
+            room = models.Room(name=f"Lasttest-Raum {r + 1}", teacher_id=teacher.id, is_active=True)
+            db.add(room)
+            db.flush()
+            for p in range(puzzles):
+                db.add(models.Puzzle(
+                    room_id=room.id,
+                    title=f"Frage {p + 1}",
+                    h5p_json=json.dumps({"question": f"Frage {p + 1}", "options": ["A", "B", "C", "D"],
+                                         "correct": p % 4}),
+                    puzzle_type="multiple_choice",
+                    order_index=p,
+                    points=10
+                ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def start_server(args, database_url: str) -> subprocess.Popen:
+    """uvicorn mit der echten App als eigenen Prozess starten"""
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONPATH=ROOT_DIR)
+    if args.backplane:
+        env["WS_BACKPLANE"] = args.backplane
+
+    command = [sys.executable, "-m", "uvicorn", "server.main:app",
+               "--host", "127.0.0.1", "--port", str(args.port),
+               "--workers", str(args.workers), "--log-level", "warning",
+               "--ws-ping-interval", "20", "--ws-ping-timeout", "60"]
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env,
+                            stdout=None if args.verbose else subprocess.DEVNULL)
+
+
+async def wait_for_server(url: str, timeout: float = 30):
+    async with httpx.AsyncClient(base_url=url) as client:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server unter {url} antwortet nicht")
+
+
+def process_tree_rss(pid: int) -> int:
+    """RSS (Bytes) eines Prozesses inklusive aller Kindprozesse (Linux /proc)"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, todo = 0, [pid]
+    while todo:
+        current = todo.pop()
+        todo.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+# ==================== BOARDS ====================
+
+async def timed(stats: Stats, name: str, request) -> Optional[httpx.Response]:
+    """HTTP-Aufruf messen, Fehler zählen statt abbrechen"""
+    started = time.monotonic()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        stats.record_http(name, time.monotonic() - started, ok=False)
+        return None
+    stats.record_http(name, time.monotonic() - started, ok=response.status_code < 400)
+    return response if response.status_code < 400 else None
+
+
+def think_time(mean: float) -> float:
+    """Lognormal verteilte Denkpause mit Mittelwert mean (rechtsschief wie echte Schüler)"""
+    sigma = 0.6
+    return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+
+class Board:
+    """Ein simuliertes Board (ein Schüler-Client)"""
+
+    def __init__(self, index: int, args, stats: Stats):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.http = httpx.AsyncClient(base_url=args.url, timeout=30)
+        self.token: Optional[str] = None
+        self.ws = None
+        self._receiver: Optional[asyncio.Task] = None
+
+    async def connect(self) -> bool:
+        """Login + WebSocket + Abo (Phase 1)"""
+        response = await timed(self.stats, "POST /api/auth/login", self.http.post(
+            "/api/auth/login", json={"username": f"{STUDENT_PREFIX}{self.index}", "password": PASSWORD}
+        ))
+        if response is None:
+            return False
+        self.token = response.json()["access_token"]
+        self.http.headers["Authorization"] = f"Bearer {self.token}"
+
+        ws_url = self.args.url.replace("http", "ws", 1) + "/ws/rooms"
+        try:
+            self.ws = await websockets.connect(ws_url, subprotocols=["multiboard.json"], max_size=2 ** 24)
+            await self.ws.send(json.dumps({"action": "auth", "token": self.token}))
+            await self.ws.send(json.dumps({"action": "subscribe", "topics": ["active-rooms"]}))
+        except Exception:
+            self.stats.ws_errors += 1
+            return False
+
+        self.stats.ws_connected += 1
+        self._receiver = asyncio.create_task(self._receive())
+        return True
+
+    async def _receive(self):
+        """Server-Nachrichten lesen: Heartbeat beantworten, Fan-out messen"""
+        try:
+            async for frame in self.ws:
+                data = json.loads(frame)
+                kind = data.get("type")
+                if kind == "ping":
+                    await self.ws.send("pong")
+                elif kind == "rooms_updated":
+                    description = (data.get("room") or {}).get("description") or ""
+                    if description.startswith(STAMP_PREFIX):
+                        self.stats.fanout.append(time.time() - float(description[len(STAMP_PREFIX):]))
+        except websockets.ConnectionClosed:
+            pass
+        except Exception:
+            self.stats.ws_errors += 1
+
+    async def play(self, stop_at: float):
+        """Raum wählen, Session starten, Rätsel beantworten (Phase 2)"""
+        while time.monotonic() < stop_at:
+            response = await timed(self.stats, "GET /api/game/available-rooms",
+                                   self.http.get("/api/game/available-rooms"))
+            if not response or not response.json():
+                await asyncio.sleep(1)
+                continue
+            room = random.choice(response.json())
+
+            response = await timed(self.stats, "POST /api/game/start-session",
+                                   self.http.post(f"/api/game/start-session/{room['id']}"))
+            if response is None:
+                await asyncio.sleep(1)
+                continue
+            session = response.json()
+
+            response = await timed(self.stats, "GET /api/game/session/puzzles",
+                                   self.http.get(f"/api/game/session/{session['id']}/puzzles"))
+            puzzles = response.json() if response else []
+
+            for puzzle in puzzles:
+                await asyncio.sleep(think_time(self.args.think))
+                if time.monotonic() >= stop_at:
+                    return
+
+                response = await timed(self.stats, "POST /api/game/submit-answer", self.http.post(
+                    "/api/game/submit-answer",
+                    json={"session_id": session["id"], "puzzle_id": puzzle["id"],
+                          "answer_json": {"selected": random.randrange(4)}, "time_taken_seconds": 5}
+                ))
+                if response is not None:
+                    self.stats.answers += 1
+
+            await timed(self.stats, "GET /api/game/session/progress",
+                        self.http.get(f"/api/game/session/{session['id']}/progress"))
+            await timed(self.stats, "POST /api/game/session/complete",
+                        self.http.post(f"/api/game/session/{session['id']}/complete"))
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._receiver:
+            self._receiver.cancel()
+        await self.http.aclose()
+
+
+async def teacher_driver(args, stats: Stats, stop_at: float):
+    """Ändert reihum Räume, jede Änderung trägt ihren Sendezeitpunkt für die Fan-out-Messung"""
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as http:
+        response = await http.post("/api/auth/login", json={"username": TEACHER_NAME, "password": PASSWORD})
+        response.raise_for_status()
+        http.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+        rooms = (await http.get("/api/admin/rooms")).json()
+        if not rooms:
+            return
+
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(args.broadcast_interval)
+            room = random.choice(rooms)
+            await timed(stats, "PUT /api/admin/rooms", http.put(f"/api/admin/rooms/{room['id']}", json={
+                "name": room["name"],
+                "description": f"{STAMP_PREFIX}{time.time()}",
+                "time_limit_minutes": room.get("time_limit_minutes", 60)
+            }))
+
+
+async def run(args, server_pid: Optional[int]) -> Dict:
+    stats = Stats()
+    await wait_for_server(args.url)
+
+    if server_pid:
+        stats.rss_idle = process_tree_rss(server_pid)
+
+    # Phase 1: alle Boards verbinden (gestaffelt, wie morgens beim Einschalten)
+    boards = [Board(i, args, stats) for i in range(args.boards)]
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(board: Board):
+        async with semaphore:
+            await board.connect()
+
+    started = time.monotonic()
+    await asyncio.gather(*(connect(board) for board in boards))
+    print(f"{stats.ws_connected}/{args.boards} Boards verbunden in {time.monotonic() - started:.1f} s")
+
+    await asyncio.sleep(1)  # Auth/Abo-Antworten abwarten
+    if server_pid:
+        stats.rss_connected = process_tree_rss(server_pid)
+
+    # Phase 2: spielen + Lehrer-Broadcasts
+    stats.answer_started = time.monotonic()
+    stop_at = stats.answer_started + args.duration
+    await asyncio.gather(
+        teacher_driver(args, stats, stop_at),
+        *(board.play(stop_at) for board in boards if board.ws is not None)
+    )
+    stats.answer_stopped = time.monotonic()
+
+    await asyncio.sleep(1)  # letzte Broadcasts einsammeln
+    await asyncio.gather(*(board.close() for board in boards), return_exceptions=True)
+    return stats.report(args.boards)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MultiBoard Lasttest (simulierte Boards)")
+    parser.add_argument("--boards", type=int, default=100, help="Anzahl simulierter Boards")
+    parser.add_argument("--duration", type=float, default=60, help="Spieldauer in Sekunden")
+    parser.add_argument("--think", type=float, default=8, help="Mittlere Denkpause pro Rätsel (s)")
+    parser.add_argument("--rooms", type=int, default=5, help="Anzahl aktiver Räume")
+    parser.add_argument("--puzzles", type=int, default=10, help="Rätsel pro Raum")
+    parser.add_argument("--broadcast-interval", type=float, default=1.0, help="Sekunden zwischen Raum-Änderungen")
+    parser.add_argument("--connect-concurrency", type=int, default=50, help="Gleichzeitige Verbindungsaufbauten")
+    parser.add_argument("--url", help="Bereits laufender Server (dann wird nichts gestartet/angelegt)")
+    parser.add_argument("--database-url", help="Standard: neue SQLite-Datei im Temp-Verzeichnis")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn-Worker")
+    parser.add_argument("--backplane", help="WS_BACKPLANE für mehrere Worker, z. B. unix:/tmp/mb-lt.sock")
+    parser.add_argument("--json", help="Ergebnis zusätzlich als JSON in diese Datei schreiben")
+    parser.add_argument("--verbose", action="store_true", help="Server-Ausgabe anzeigen")
+    args = parser.parse_args()
+
+    server = None
+    if args.url is None:
+        database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="multiboard-lt-"), "lt.db")
+        if args.database_url is None:
+            print("Hinweis: SQLite-Ergebnisse sind nicht repräsentativ, für echte Zahlen --database-url (MariaDB)")
+        print(f"Lege Testdaten an ({database_url}) ...")
+        seed_database(database_url, args.boards, args.rooms, args.puzzles)
+        server = start_server(args, database_url)
+        args.url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        report = asyncio.run(run(args, server.pid if server else None))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
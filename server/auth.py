@@ -2,35 +2,244 @@
 Authentifizierung und Autorisierung
 JWT-Token-basiert - Unterstützt HTTPBearer UND Header-basiert
 """
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from .database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import AsyncSessionLocal
 from . import models
+import asyncio
+import os
+import threading
+import time
 
 # Sicherheits-Konfiguration
 SECRET_KEY = "dein-geheimer-schluessel-hier-aendern-in-produktion"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 Stunden
 
+# Cache für angemeldete User (Token -> UserPrincipal), spart den User-SELECT pro Anfrage
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
+# bcrypt läuft in einem eigenen, begrenzten Thread-Pool (blockiert sonst den Event-Loop ~250 ms)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Höchstens so viele Logins gleichzeitig, der Rest wartet bis LOGIN_WAIT_TIMEOUT (dann 503)
+LOGIN_CONCURRENCY = int(os.getenv("LOGIN_CONCURRENCY", str(PASSWORD_HASH_WORKERS * 2)))
+LOGIN_WAIT_TIMEOUT = float(os.getenv("LOGIN_WAIT_TIMEOUT", "10"))
+# Massen-Import: Hashes parallel in Prozessen (alle Kerne), in Paketen pro Auftrag
+IMPORT_HASH_PROCESSES = int(os.getenv("IMPORT_HASH_PROCESSES", str(os.cpu_count() or 1)))
+IMPORT_HASH_CHUNK = 25
+
+# Internes WebSocket-Topic: User geändert/gelöscht -> Cache in allen Workern leeren
+AUTH_TOPIC = "_auth"
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 
+@dataclass(frozen=True)
+class UserPrincipal:
+    """Leichtgewichtiger angemeldeter User (ohne DB-Session, ohne Relationships)"""
+    id: int
+    username: str
+    role: str
+    full_name: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "UserPrincipal":
+        return cls(id=user.id, username=user.username, role=user.role, full_name=user.full_name)
+
+
+class PrincipalCache:
+    """
+    Begrenzter TTL/LRU-Cache: Token -> UserPrincipal
+
+    Einträge laufen nach AUTH_CACHE_TTL ab (spätestens mit dem Token).
+    invalidate_user() entfernt alle Tokens eines Users sofort.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (principal, läuft ab um (time.monotonic))
+        self._entries: "OrderedDict[str, Tuple[UserPrincipal, float]]" = OrderedDict()
+        self._tokens_of: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[UserPrincipal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._drop(token)
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token: str, principal: UserPrincipal, token_expires: Optional[float] = None):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl
+        if token_expires is not None:
+            expires_at = min(expires_at, time.monotonic() + token_expires - time.time())
+
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (principal, expires_at)
+            self._tokens_of.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_of.get(user_id, ())):
+                self._drop(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_of.clear()
+
+    def _drop(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_of.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_of[entry[0].id]
+
+
+principal_cache = PrincipalCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def invalidate_user(user_id: int):
+    """Nach Änderung/Löschen eines Users aufrufen (nur dieser Worker, siehe AUTH_TOPIC)"""
+    principal_cache.invalidate_user(user_id)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verifiziert Passwort gegen Hash"""
+    """Verifiziert Passwort gegen Hash (blockierend, siehe password_hasher)"""
     return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """Erstellt Passwort-Hash"""
+    """Erstellt Passwort-Hash (blockierend, siehe password_hasher)"""
     return pwd_context.hash(password)
 
 
+class PasswordHasher:
+    """
+    bcrypt im Thread-Pool statt im Event-Loop
+
+    bcrypt gibt den GIL während des Hashens frei, Threads reichen also.
+    Der Pool ist begrenzt, damit Logins nicht alle CPU-Kerne belegen.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        # Aufträge im Pool (laufend + wartend), nur im Event-Loop verändert
+        self._in_flight = 0
+
+    async def _run(self, func, *args):
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._in_flight -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.workers)
+        }
+
+
+class LoginLimiter:
+    """Begrenzt gleichzeitige Logins, damit eine ganze Klasse um 8:00 nicht alles blockiert"""
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self._active = 0
+        self._waiting = 0
+
+    async def __aenter__(self):
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Zu viele gleichzeitige Anmeldungen, bitte gleich nochmal versuchen",
+                headers={"Retry-After": "2"},
+            )
+        finally:
+            self._waiting -= 1
+        self._active += 1
+
+    async def __aexit__(self, *exc):
+        self._active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"limit": self.limit, "active": self._active, "waiting": self._waiting}
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS)
+login_limiter = LoginLimiter(LOGIN_CONCURRENCY, LOGIN_WAIT_TIMEOUT)
+
+# Prozess-Pool für Massen-Importe, wird erst beim ersten Import gestartet
+_import_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _hash_chunk(passwords: List[str]) -> List[str]:
+    """Läuft im Prozess-Pool (muss auf Modulebene stehen, damit es gepickelt werden kann)"""
+    return [pwd_context.hash(password) for password in passwords]
+
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """Viele Passwörter parallel über alle Kerne hashen (Reihenfolge bleibt erhalten)"""
+    global _import_pool
+    if _import_pool is None:
+        _import_pool = ProcessPoolExecutor(max_workers=IMPORT_HASH_PROCESSES)
+
+    loop = asyncio.get_running_loop()
+    chunks = [passwords[i:i + IMPORT_HASH_CHUNK] for i in range(0, len(passwords), IMPORT_HASH_CHUNK)]
+    results = await asyncio.gather(*(loop.run_in_executor(_import_pool, _hash_chunk, chunk) for chunk in chunks))
+    return [hashed for chunk in results for hashed in chunk]
+
+
+def shutdown_hash_pools():
+    """Pools beim Herunterfahren beenden"""
+    password_hasher.shutdown()
+    if _import_pool is not None:
+        _import_pool.shutdown(wait=False, cancel_futures=True)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Erstellt JWT Access Token"""
     to_encode = data.copy()
@@ -44,23 +253,68 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    """Authentifiziert Benutzer"""
-    user = db.query(models.User).filter(models.User.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    """Authentifiziert Benutzer (bcrypt läuft im Thread-Pool)"""
+    user = (await db.scalars(select(models.User).where(models.User.username == username))).first()
 
     if not user:
         return None
 
-    if not verify_password(password, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         return None
 
     return user
 
 
-async def get_current_user(
-        authorization: Optional[str] = Header(None),
-        db: Session = Depends(get_db)
-):
+def decode_access_token(token: str) -> int:
+    """
+    JWT prüfen und User-ID zurückgeben
+
+    Raises: JWTError bei ungültigem Token, ValueError ohne/mit kaputter "sub"
+    """
+    return _decode_token(token)[0]
+
+
+def _decode_token(token: str) -> Tuple[int, Optional[float]]:
+    """JWT prüfen, liefert (User-ID, Ablaufzeit als Unix-Zeit oder None)"""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id = payload.get("sub")
+    if user_id is None:
+        raise ValueError("Token ohne sub")
+    return int(user_id), payload.get("exp")
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """Ablaufzeit (Unix-Zeit) eines bereits geprüften Tokens, None wenn ohne exp"""
+    try:
+        return jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+
+
+async def get_user_by_token(token: str) -> Optional[UserPrincipal]:
+    """User zu einem Token holen (Cache, sonst DB), None wenn ungültig"""
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
+    try:
+        user_id, token_expires = _decode_token(token)
+    except (JWTError, ValueError):
+        return None
+
+    async with AsyncSessionLocal() as db:
+        user = await db.get(models.User, user_id)
+
+    if user is None:
+        return None
+
+    principal = UserPrincipal.from_user(user)
+    principal_cache.put(token, principal, token_expires)
+    return principal
+
+
+async def get_current_user(authorization: Optional[str] = Header(None)) -> UserPrincipal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Ungültige Authentifizierung",
@@ -75,27 +329,10 @@ async def get_current_user(
     if authorization.startswith("Bearer "):
         token = authorization.replace("Bearer ", "")
 
-    print(f"Auth-Token empfangen: {token[:20]}...")  # DEBUG
-
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-
-        user_id = int(user_id)
-        print(f"Token dekodiert: User-ID={user_id}")  # DEBUG
-
-    except JWTError as e:
-        print(f"JWT-Fehler: {e}")  # DEBUG
-        raise credentials_exception
-
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = await get_user_by_token(token)
     if user is None:
-        print(f"User mit ID {user_id} nicht gefunden")  # DEBUG
         raise credentials_exception
 
-    print(f"User authentifiziert: {user.username} (Role: {user.role})")  # DEBUG
     return user
 
 
@@ -0,0 +1,330 @@
+"""
+Pub/Sub-Backplane für WebSocket-Events
+Verteilt Events an alle Worker-Prozesse, jeder Worker liefert an seine eigenen Sockets aus
+
+Treiber (Umgebungsvariable WS_BACKPLANE):
+    leer / "memory"          -> nur dieser Prozess (Standard)
+    "unix:/pfad/zum.sock"    -> lokaler Broker über Unix-Socket (mehrere Worker auf einem Rechner)
+    "redis://host:6379/0"    -> Redis-kompatibler Server (mehrere Rechner, braucht Paket "redis")
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: kein Unix-Socket-Broker
+    fcntl = None
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+# Empfänger: (topics, message) -> None, message enthält bereits "versions" und "epoch"
+Handler = Callable[[List[str], Dict], None]
+
+# Maximale Größe einer Nachricht im Unix-Socket-Protokoll (H5P-Deltas können groß sein)
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+# Broker: so viel darf sich im Sendepuffer eines Workers stauen, danach wird er getrennt
+# (verbindet sich neu; Lücken erkennen die Clients an den Versionsnummern)
+MAX_PEER_BUFFER = 4 * MAX_FRAME_SIZE
+RECONNECT_DELAY = 0.5
+
+
+def new_epoch() -> str:
+    """
+    Kennung einer Zählerreihe
+
+    Versionen sind nur innerhalb einer Epoche fortlaufend. Neue Zähler
+    (Fallback ohne Broker, neuer Broker, geleertes Redis) beginnen wieder
+    bei 1 und bekommen deshalb eine neue Epoche, Clients laden dann neu.
+    """
+    return uuid.uuid4().hex[:16]
+
+
+def stamp_versions(counters: Dict[str, int], topics: List[str]) -> Dict[str, int]:
+    """Versionszähler der Topics hochzählen und die neuen Stände liefern"""
+    versions = {}
+    for topic in topics:
+        counters[topic] = counters.get(topic, 0) + 1
+        versions[topic] = counters[topic]
+    return versions
+
+
+class Backplane:
+    """Basisklasse: nimmt Events an und liefert sie an alle Worker aus"""
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    async def stop(self):
+        pass
+
+    async def publish(self, topics: List[str], message: Dict):
+        raise NotImplementedError
+
+    def _dispatch(self, topics: List[str], message: Dict, versions: Dict[str, int], epoch: Optional[str]):
+        """Event an den lokalen ConnectionManager weitergeben"""
+        if self._handler:
+            self._handler(topics, {**message, "versions": versions, "epoch": epoch})
+
+
+class InProcessBackplane(Backplane):
+    """Standard: nur ein Prozess, Events gehen direkt an die eigenen Sockets"""
+
+    def __init__(self):
+        super().__init__()
+        self._counters: Dict[str, int] = {}
+        self.epoch = new_epoch()
+
+    async def publish(self, topics: List[str], message: Dict):
+        self._dispatch(topics, message, stamp_versions(self._counters, topics), self.epoch)
+
+
+class UnixSocketBackplane(Backplane):
+    """
+    Lokaler Broker über einen Unix-Socket
+
+    Der erste Worker, der die Lock-Datei bekommt, startet den Broker.
+    Alle Worker (auch der Broker selbst) verbinden sich als Client.
+    Stirbt der Broker-Prozess, übernimmt ein anderer Worker. Dessen
+    Zähler beginnen neu, deshalb stempelt jeder Broker eine eigene Epoche.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        if fcntl is None:
+            raise RuntimeError("Unix-Socket-Backplane wird auf diesem System nicht unterstützt")
+
+        self.path = path
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: List[asyncio.StreamWriter] = []
+        self._broker_counters: Dict[str, int] = {}
+        self._broker_epoch = new_epoch()
+
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        # Fallback, solange keine Verbindung zum Broker besteht (eigene Zähler, eigene Epoche)
+        self._local = InProcessBackplane()
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        await self._local.start(handler)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+        if self._server:
+            self._server.close()
+            for peer in self._peers:
+                peer.close()
+        if self._lock_file:
+            self._lock_file.close()
+
+    async def publish(self, topics: List[str], message: Dict):
+        if self._writer is None or self._writer.is_closing():
+            await self._local.publish(topics, message)
+            return
+
+        try:
+            self._writer.write(json.dumps({"topics": topics, "message": message}).encode() + b"\n")
+            await self._writer.drain()
+        except (ConnectionError, RuntimeError):
+            await self._local.publish(topics, message)
+
+    # ---------- Broker ----------
+
+    def _try_become_broker(self) -> bool:
+        """Broker werden, falls noch keiner läuft (Lock über flock)"""
+        if self._server is not None:
+            return True
+
+        lock_file = open(self.path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Altlast eines abgestürzten Brokers
+        return True
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Broker: Events eines Workers stempeln und an alle Worker verteilen"""
+        self._peers.append(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                try:
+                    envelope = json.loads(line)
+                    topics = envelope["topics"]
+                except (ValueError, KeyError):
+                    continue
+
+                envelope["versions"] = stamp_versions(self._broker_counters, topics)
+                envelope["epoch"] = self._broker_epoch
+                frame = json.dumps(envelope).encode() + b"\n"
+
+                for peer in list(self._peers):
+                    try:
+                        if peer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+                            # Worker hängt: nicht endlos puffern, sondern trennen
+                            log.warning("Backplane-Broker: Worker liest nicht mehr mit, Verbindung getrennt")
+                            self._peers.remove(peer)
+                            peer.transport.abort()
+                            continue
+                        peer.write(frame)
+                    except Exception:
+                        if peer in self._peers:
+                            self._peers.remove(peer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if writer in self._peers:
+                self._peers.remove(writer)
+            writer.close()
+
+    # ---------- Client ----------
+
+    async def _run(self):
+        """Mit dem Broker verbunden bleiben und empfangene Events ausliefern"""
+        while True:
+            try:
+                if self._try_become_broker() and self._server is None:
+                    self._server = await asyncio.start_unix_server(
+                        self._handle_peer, path=self.path, limit=MAX_FRAME_SIZE
+                    )
+                    log.info("Backplane-Broker läuft auf %s", self.path)
+
+                reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_SIZE)
+
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    envelope = json.loads(line)
+                    self._dispatch(envelope["topics"], envelope["message"], envelope["versions"],
+                                   envelope.get("epoch"))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Backplane-Verbindung verloren: %s", e)
+
+            self._writer = None
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+class RedisBackplane(Backplane):
+    """
+    Redis-kompatibler Treiber (Redis, Valkey, KeyDB)
+
+    Versionen werden per Lua-Skript atomar zusammen mit dem PUBLISH
+    vergeben, damit die Reihenfolge bei allen Workern gleich ist. Die
+    Epoche liegt neben den Zählern in Redis: Gehen die Zähler verloren
+    (Neustart ohne Persistenz), ist auch sie weg und wird neu gesetzt.
+    """
+
+    CHANNEL = "multiboard:ws"
+    KEY_PREFIX = "multiboard:ws:version:"
+    EPOCH_KEY = "multiboard:ws:epoch"
+
+    # KEYS = Versionszähler + Epoche (zuletzt), ARGV[1] = Channel, ARGV[2] = Topics (JSON),
+    # ARGV[3] = Nachricht (JSON), ARGV[4] = Epoche, falls noch keine gesetzt ist
+    PUBLISH_SCRIPT = """
+local epoch = redis.call('GET', KEYS[#KEYS])
+if not epoch then
+    epoch = ARGV[4]
+    redis.call('SET', KEYS[#KEYS], epoch)
+end
+local versions = {}
+local topics = cjson.decode(ARGV[2])
+for i, topic in ipairs(topics) do
+    versions[topic] = redis.call('INCR', KEYS[i])
+end
+local envelope = '{"topics":' .. ARGV[2] .. ',"versions":' .. cjson.encode(versions) ..
+    ',"epoch":' .. cjson.encode(epoch) .. ',"message":' .. ARGV[3] .. '}'
+return redis.call('PUBLISH', ARGV[1], envelope)
+"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        if aioredis is None:
+            raise RuntimeError("Für WS_BACKPLANE=redis://... muss das Paket 'redis' installiert sein")
+
+        self.url = url
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(self.PUBLISH_SCRIPT)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self._redis.close()
+
+    async def publish(self, topics: List[str], message: Dict):
+        await self._script(
+            keys=[self.KEY_PREFIX + topic for topic in topics] + [self.EPOCH_KEY],
+            args=[self.CHANNEL, json.dumps(topics), json.dumps(message), new_epoch()]
+        )
+
+    async def _listen(self):
+        """Channel abonnieren und Events an die eigenen Sockets ausliefern"""
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    envelope = json.loads(item["data"])
+                    self._dispatch(envelope["topics"], envelope["message"], envelope["versions"],
+                                   envelope.get("epoch"))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Redis-Backplane-Fehler: %s", e)
+            finally:
+                await pubsub.close()
+
+            await asyncio.sleep(RECONNECT_DELAY)
+
+
+def create_backplane(url: Optional[str]) -> Backplane:
+    """Backplane passend zur Konfiguration erstellen"""
+    if not url or url == "memory":
+        return InProcessBackplane()
+
+    if url.startswith("unix:"):
+        path = url[len("unix:"):]
+        if path.startswith("//"):
+            path = path[2:]
+        return UnixSocketBackplane(path)
+
+    if url.startswith(("redis://", "rediss://")):
+        return RedisBackplane(url)
+
+    raise ValueError(f"Unbekanntes WS_BACKPLANE: {url}")
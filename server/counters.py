@@ -0,0 +1,88 @@
+"""
+Zähler für den Fortschritt (statt COUNT(*) bei jeder Abfrage)
+
+    GameSession.answered_count  Anzahl PuzzleResults der Session
+    Room.puzzle_count           Anzahl Rätsel im Raum
+
+Die Zähler werden bei jeder Änderung mitgepflegt (submit_answer,
+Admin-Rätsel-Routen, H5P-Upload). Der Reparatur-Job gleicht sie
+regelmäßig mit den echten Zahlen ab, falls doch einmal etwas danebengeht
+(z. B. Änderungen direkt in der DB).
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func, select, update
+
+from . import models
+from .database import AsyncSessionLocal
+
+log = logging.getLogger(__name__)
+
+# Abstand der Reparatur-Läufe in Sekunden (0 = nur beim Start)
+COUNTER_REPAIR_INTERVAL = float(os.getenv("COUNTER_REPAIR_INTERVAL", "3600"))
+
+
+def recount_sessions(session_ids: Optional[Iterable[int]] = None):
+    """UPDATE, das answered_count neu berechnet (nur abweichende Zeilen)"""
+    actual = select(func.count(models.PuzzleResult.id)).where(
+        models.PuzzleResult.session_id == models.GameSession.id
+    ).scalar_subquery()
+    statement = update(models.GameSession).where(models.GameSession.answered_count != actual)
+    if session_ids is not None:
+        statement = statement.where(models.GameSession.id.in_(list(session_ids)))
+    return statement.values(answered_count=actual).execution_options(synchronize_session=False)
+
+
+def recount_rooms(room_ids: Optional[Iterable[int]] = None):
+    """UPDATE, das puzzle_count neu berechnet (nur abweichende Zeilen)"""
+    actual = select(func.count(models.Puzzle.id)).where(
+        models.Puzzle.room_id == models.Room.id
+    ).scalar_subquery()
+    statement = update(models.Room).where(models.Room.puzzle_count != actual)
+    if room_ids is not None:
+        statement = statement.where(models.Room.id.in_(list(room_ids)))
+    return statement.values(puzzle_count=actual).execution_options(synchronize_session=False)
+
+
+async def repair_counters() -> Dict[str, int]:
+    """Alle Zähler prüfen und korrigieren, liefert die Anzahl korrigierter Zeilen"""
+    async with AsyncSessionLocal() as db:
+        sessions = (await db.execute(recount_sessions())).rowcount
+        rooms = (await db.execute(recount_rooms())).rowcount
+        await db.commit()
+
+    if sessions or rooms:
+        log.warning("Zähler korrigiert: %d Sessions, %d Räume", sessions, rooms)
+    return {"sessions": sessions, "rooms": rooms}
+
+
+class CounterRepairJob:
+    """Reparatur beim Start und danach alle COUNTER_REPAIR_INTERVAL Sekunden"""
+
+    def __init__(self, interval: float = COUNTER_REPAIR_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                await repair_counters()
+            except Exception:
+                log.exception("Zähler-Reparatur fehlgeschlagen")
+
+            if self.interval <= 0:
+                return
+            await asyncio.sleep(self.interval)
+
+
+repair_job = CounterRepairJob()
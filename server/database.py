@@ -1,28 +1,181 @@
 """
 Datenbank-Konfiguration und Session-Management
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from typing import Dict, List
 import os
+import time
 from dotenv import load_dotenv
 
+from .metrics import Counter, Gauge, Histogram
+
 load_dotenv()
 
 # Datenbank-URL - anpassen für deine MariaDB-Installation
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Pool-Größe pro Engine und Worker. Es gibt zwei Engines (sync + async), also
+# insgesamt bis zu Worker * 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) Verbindungen
+# -> muss unter max_connections von MariaDB bleiben
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))   # Sekunden Warten auf eine freie Verbindung
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))   # Verbindungen nach N Sekunden erneuern
+# SQLite: so lange auf eine Schreibsperre warten statt sofort "database is locked" (Millisekunden)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Grenzen des Wartezeit-Histogramms (Sekunden)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+POOL_WAIT = Histogram("db_pool_wait_seconds", "Wartezeit auf eine freie DB-Verbindung", ["pool"],
+                      buckets=POOL_WAIT_BUCKETS)
+POOL_TIMEOUTS = Counter("db_pool_timeouts", "Keine freie DB-Verbindung innerhalb DB_POOL_TIMEOUT", ["pool"])
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Belegte DB-Verbindungen", ["pool"])
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Verbindungen über DB_POOL_SIZE hinaus", ["pool"])
+POOL_SIZE = Gauge("db_pool_size", "Konfigurierte Pool-Größe", ["pool"])
+
+
+class _TimedCheckout:
+    """Misst, wie lange _do_get auf eine freie Verbindung wartet"""
+
+    pool_name: str
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.labels(self.pool_name).inc()
+            raise
+        finally:
+            POOL_WAIT.labels(self.pool_name).observe(time.perf_counter() - started)
+
+
+# Logger-Namen wie bei den Original-Pools ("sqlalchemy.pool...."), sonst landen Pool-Meldungen
+# unter "server.database" im App-Logger statt unter dem Log-Level von "sqlalchemy"
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pool_name = "sync"
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.QueuePool"
+
+
+class InstrumentedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pool_name = "async"
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.AsyncAdaptedQueuePool"
+
+
+def pool_options(url: str, poolclass: type) -> Dict:
+    """Pool-Einstellungen (nicht für SQLite im Speicher, das hat einen eigenen Pool)"""
+    if ":memory:" in url:
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_logging_name": poolclass.pool_name,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+# SQLite (z. B. für den Lasttest): Verbindungen werden zwischen Threads weitergereicht
+connect_args = {"check_same_thread": False} if DATABASE_URL and DATABASE_URL.startswith("sqlite") else {}
+
 # Engine erstellen
 engine = create_engine(
     DATABASE_URL,
+    connect_args=connect_args,
     pool_pre_ping=True,  # Prüft Verbindung vor Verwendung
-    pool_recycle=3600,   # Recycelt Verbindungen nach 1 Stunde
-    echo=False           # SQL-Logging (True für Debugging)
+    echo=False,          # SQL-Logging (True für Debugging)
+    **pool_options(DATABASE_URL, InstrumentedQueuePool)
 )
 
+
+
+def configure_sqlite(sync_engine):
+    """
+    SQLite-Datei für zwei Engines (sync + aiosqlite) gleichzeitig nutzbar machen
+
+    WAL: Leser blockieren Schreiber nicht mehr. busy_timeout: Schreiber warten
+    aufeinander, statt mit "database is locked" abzubrechen.
+    """
+    if sync_engine.dialect.name != "sqlite" or ":memory:" in str(sync_engine.url):
+        return
+
+    @event.listens_for(sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+
+configure_sqlite(engine)
+
 # Session-Factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def async_database_url(url: str) -> str:
+    """Passenden async-Treiber wählen (pymysql -> aiomysql, sqlite -> aiosqlite)"""
+    if url.startswith(("mysql+pymysql://", "mysql://", "mariadb+pymysql://", "mariadb://")):
+        return "mysql+aiomysql://" + url.split("://", 1)[1]
+    if url.startswith(("sqlite://", "sqlite+pysqlite://")):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+# Async-Engine für die heißen Routen (blockiert den Event-Loop nicht)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    **pool_options(ASYNC_DATABASE_URL, InstrumentedAsyncQueuePool)
+)
+
+configure_sqlite(async_engine.sync_engine)
+
+# expire_on_commit=False: Objekte bleiben nach commit lesbar (kein Lazy-Load im Event-Loop)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+
+def _instrumented_pools():
+    return [pool for pool in (engine.pool, async_engine.pool) if isinstance(pool, _TimedCheckout)]
+
+
+def pool_status() -> Dict[str, Dict]:
+    """Live-Zustand beider Pools (für /api/metrics)"""
+    result = {}
+    for pool in _instrumented_pools():
+        wait = POOL_WAIT.labels(pool.pool_name)
+        result[pool.pool_name] = {
+            "size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "timeouts": POOL_TIMEOUTS.labels(pool.pool_name).value,
+            "wait_seconds": {
+                "count": wait.count,
+                "sum": round(wait.sum, 6),
+                "buckets": {str(bound): count for bound, count in wait.cumulative()}
+            }
+        }
+    return result
+
+
+# Pool-Gauges werden erst beim Abruf von /metrics gelesen
+POOL_CHECKED_OUT.set_function(lambda: {(p.pool_name,): p.checkedout() for p in _instrumented_pools()})
+POOL_OVERFLOW.set_function(lambda: {(p.pool_name,): max(0, p.overflow()) for p in _instrumented_pools()})
+POOL_SIZE.set_function(lambda: {(p.pool_name,): p.size() for p in _instrumented_pools()})
+
+
 # Base-Klasse für Models
 Base = declarative_base()
 
@@ -38,9 +191,52 @@ def get_db():
         db.close()
 
 
-def init_db():
+async def get_async_db():
+    """
+    Dependency für FastAPI - liefert AsyncSession
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def init_db() -> List[str]:
     """
     Initialisiert Datenbank-Tabellen
-    Wird beim Server-Start aufgerufen
+    Wird beim Server-Start aufgerufen, liefert neu angelegte Spalten/Indizes
     """
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    return ensure_schema()
+
+
+def ensure_schema() -> List[str]:
+    """
+    Fehlende Spalten und Indizes in bestehenden Tabellen nachziehen
+
+    create_all() legt nur fehlende Tabellen an. Neue Spalten, die NULL
+    erlauben oder ein server_default haben (z. B. Zähler), werden hier per
+    ALTER TABLE ergänzt, neue Indizes per CREATE INDEX.
+    """
+    existing_tables = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not existing_tables.has_table(table.name):
+                continue
+
+            existing = {column["name"] for column in existing_tables.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or (column.server_default is None and not column.nullable):
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if not column.nullable:
+                    ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in existing_tables.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn, checkfirst=True)
+                    added.append(f"{table.name}.{index.name}")
+    return added
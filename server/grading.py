@@ -0,0 +1,147 @@
+"""
+Bewertung von Antworten mit zwischengespeicherten Lösungsschlüsseln
+
+Pro Rätsel wird der Schlüssel (Typ, Punkte, richtige Antwort) einmal aus
+der DB geladen und das JSON geparst; danach ist die Bewertung ein
+Dict-Zugriff. Änderungen an Rätseln (Admin, H5P-Upload) werfen den
+Eintrag über das interne Topic "_puzzles" auf allen Workern raus.
+"""
+import json
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+PUZZLE_TOPIC = "_puzzles"
+PUZZLE_CACHE_SIZE = int(os.getenv("PUZZLE_CACHE_SIZE", "5000"))
+
+# Rätsel-Typen mit automatischer Bewertung
+CHOICE_TYPES = ("multiple_choice", "h5p_multichoice")
+
+
+@dataclass(frozen=True)
+class GradingKey:
+    """Alles, was zum Bewerten einer Antwort nötig ist"""
+    puzzle_id: int
+    room_id: int
+    puzzle_type: str
+    points: int
+    correct_index: Optional[int]
+
+    @classmethod
+    def from_puzzle(cls, puzzle: models.Puzzle) -> "GradingKey":
+        correct_index = None
+        if puzzle.puzzle_type in CHOICE_TYPES:
+            # Verschiedene JSON-Formate unterstützen
+            data = json.loads(puzzle.h5p_json) if puzzle.h5p_json else {}
+            correct_index = int(data.get("correct", data.get("correct_index", -1)))
+
+        return cls(
+            puzzle_id=puzzle.id,
+            room_id=puzzle.room_id,
+            puzzle_type=puzzle.puzzle_type,
+            points=puzzle.points or 0,
+            correct_index=correct_index
+        )
+
+    def grade(self, answer: Dict) -> Tuple[bool, int]:
+        """(korrekt, Punkte) für eine Antwort"""
+        if self.correct_index is None:
+            return False, 0
+
+        is_correct = int(answer.get("selected", -1)) == self.correct_index
+        return is_correct, self.points if is_correct else 0
+
+
+class PuzzleCache:
+    """
+    LRU-Cache: Rätsel-ID -> GradingKey
+
+    Jede Invalidierung erhöht die Generation. Ein Eintrag wird nur
+    gespeichert, wenn sich die Generation seit Beginn des DB-Lesens nicht
+    geändert hat; ein langsamer Leser kann so keinen veralteten Stand
+    nach einer Änderung zurückschreiben.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.generation = 0
+        self._entries: "OrderedDict[int, GradingKey]" = OrderedDict()
+
+    def get(self, puzzle_id: int) -> Optional[GradingKey]:
+        key = self._entries.get(puzzle_id)
+        if key is not None:
+            self._entries.move_to_end(puzzle_id)
+        return key
+
+    def put(self, key: GradingKey, generation: int):
+        if self.max_size <= 0 or generation != self.generation:
+            return
+        self._entries[key.puzzle_id] = key
+        self._entries.move_to_end(key.puzzle_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, puzzle_ids: Iterable[int]):
+        self.generation += 1
+        for puzzle_id in puzzle_ids:
+            self._entries.pop(puzzle_id, None)
+
+    def invalidate_room(self, room_id: int):
+        self.generation += 1
+        for puzzle_id in [p for p, key in self._entries.items() if key.room_id == room_id]:
+            del self._entries[puzzle_id]
+
+    def apply(self, event: Dict):
+        """Invalidierung von der Backplane einspielen"""
+        if event.get("room_id") is not None:
+            self.invalidate_room(event["room_id"])
+        else:
+            self.invalidate(event.get("puzzle_ids", ()))
+
+    async def load(self, db: AsyncSession, puzzle_id: int) -> Optional[GradingKey]:
+        """Schlüssel aus dem Cache, sonst aus der DB (None = Rätsel existiert nicht)"""
+        key = self.get(puzzle_id)
+        if key is None:
+            generation = self.generation
+            puzzle = await db.get(models.Puzzle, puzzle_id)
+            if puzzle is None:
+                return None
+            key = GradingKey.from_puzzle(puzzle)
+            self.put(key, generation)
+        return key
+
+    async def load_many(self, db: AsyncSession, puzzle_ids: Iterable[int]) -> Dict[int, GradingKey]:
+        """Mehrere Schlüssel, fehlende mit einer Abfrage nachladen (unbekannte IDs fehlen im Ergebnis)"""
+        keys, missing = {}, set()
+        for puzzle_id in puzzle_ids:
+            key = self.get(puzzle_id)
+            if key is None:
+                missing.add(puzzle_id)
+            else:
+                keys[puzzle_id] = key
+
+        if missing:
+            generation = self.generation
+            puzzles = await db.scalars(select(models.Puzzle).where(models.Puzzle.id.in_(missing)))
+            for puzzle in puzzles:
+                key = GradingKey.from_puzzle(puzzle)
+                self.put(key, generation)
+                keys[key.puzzle_id] = key
+        return keys
+
+    def stats(self) -> Dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "generation": self.generation}
+
+
+puzzle_cache = PuzzleCache(PUZZLE_CACHE_SIZE)
+
+
+def puzzle_event(puzzle_ids: Iterable[int] = (), room_id: Optional[int] = None) -> Dict:
+    """Event für PUZZLE_TOPIC (ein Raum = alle seine Rätsel)"""
+    return {"op": "invalidate", "puzzle_ids": list(puzzle_ids), "room_id": room_id}
@@ -0,0 +1,446 @@
+"""
+Write-behind für Antworten (optional, ANSWER_WRITE_BEHIND=1)
+
+Antworten werden im Speicher bewertet, in ein lokales Journal geschrieben
+und sofort bestätigt. Ein Hintergrund-Task schreibt sie in kleinen Batches
+nach puzzle_results / game_sessions (ein INSERT, ein UPDATE pro Session,
+ein Commit). So fängt der Server den Ansturm am Ende einer Runde ab, ohne
+Commit-Latenz pro Anfrage.
+
+Haltbarkeit:
+    - Jede bestätigte Antwort steht bereits im Journal (OS-Cache): ein
+      Absturz des Prozesses verliert nichts.
+    - Spätestens alle ANSWER_FLUSH_INTERVAL Sekunden wird das Journal per
+      fsync auf die Platte gebracht: bei Stromausfall gehen höchstens die
+      Antworten dieses Intervalls verloren.
+
+Journal: pro Prozess Segmente "answers-<pid>-<ns>.jsonl" plus eine
+gesperrte Datei "worker-<pid>.lock". Segmente toter Prozesse werden beim
+Start per Umbenennen übernommen (nur ein Worker gewinnt) und nachgetragen.
+Das Nachtragen ist über (session_id, puzzle_id, idempotency_key) doppelt
+sicher: bereits gespeicherte Antworten werden übersprungen.
+
+Fortschritt und Abschluss lesen DB und Puffer passend zueinander
+(read_consistent), die Punkte stimmen also auch vor dem Flush.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: offene Lock-Dateien lassen sich dort nicht löschen
+    fcntl = None
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+from .database import AsyncSessionLocal
+
+log = logging.getLogger(__name__)
+
+ANSWER_WRITE_BEHIND = os.getenv("ANSWER_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+ANSWER_FLUSH_INTERVAL = float(os.getenv("ANSWER_FLUSH_INTERVAL", "0.5"))   # Sekunden
+ANSWER_FLUSH_BATCH = int(os.getenv("ANSWER_FLUSH_BATCH", "500"))           # früher flushen ab so vielen
+ANSWER_JOURNAL_DIR = os.getenv(
+    "ANSWER_JOURNAL_DIR", os.path.join(os.path.dirname(__file__), "data", "answer-journal")
+)
+SESSION_OWNER_CACHE_SIZE = 10000
+# Versuche, DB und Puffer ohne Anhalten des Flushes konsistent zu lesen
+CONSISTENT_READ_RETRIES = 5
+
+
+def _owner_dead(lock_path: str) -> bool:
+    """Lebt der Prozess, der diese Lock-Datei hält, nicht mehr?"""
+    if fcntl is not None:
+        try:
+            fd = os.open(lock_path, os.O_RDWR)
+        except FileNotFoundError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+
+    try:
+        os.remove(lock_path)
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False
+
+
+class AnswerJournal:
+    """Append-only Journal in Segmenten pro Prozess"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.pid = os.getpid()
+        self._lock_file = None
+        self._file = None
+        self._path: Optional[str] = None
+        self._records = 0
+
+    def _segment_path(self) -> str:
+        return os.path.join(self.directory, f"answers-{self.pid}-{time.time_ns()}.jsonl")
+
+    def open(self) -> List[str]:
+        """Lock nehmen, verwaiste Segmente übernehmen, neues Segment öffnen"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.directory, f"worker-{self.pid}.lock")
+        claimed = self._claim_orphans()
+
+        self._lock_file = open(lock_path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        self._open_segment()
+        return claimed
+
+    def _claim_orphans(self) -> List[str]:
+        """
+        Segmente beendeter Prozesse übernehmen
+
+        Eigene PID zählt auch: das ist ein früherer Prozess mit derselben
+        PID (z. B. PID 1 im Container), dieser hier hat noch nichts geschrieben.
+        """
+        owners: Dict[int, bool] = {self.pid: True}
+        claimed = []
+        for path in sorted(glob.glob(os.path.join(self.directory, "answers-*.jsonl"))):
+            try:
+                owner = int(os.path.basename(path).split("-")[1])
+            except (IndexError, ValueError):
+                continue
+            if owner not in owners:
+                owners[owner] = _owner_dead(os.path.join(self.directory, f"worker-{owner}.lock"))
+            if not owners[owner]:
+                continue
+
+            target = self._segment_path()
+            try:
+                os.rename(path, target)  # atomar: nur ein Worker bekommt das Segment
+            except FileNotFoundError:
+                continue
+            claimed.append(target)
+
+        for owner, dead in owners.items():
+            if dead and owner != self.pid:
+                try:
+                    os.remove(os.path.join(self.directory, f"worker-{owner}.lock"))
+                except OSError:
+                    pass
+        return claimed
+
+    def _open_segment(self):
+        self._path = self._segment_path()
+        self._file = open(self._path, "a", encoding="utf-8")
+        self._records = 0
+
+    def append(self, record: Dict):
+        """Eine Antwort anhängen (landet sofort im OS-Cache)"""
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self._records += 1
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def rotate(self) -> Optional[str]:
+        """Aktuelles Segment schließen und neues beginnen; liefert das alte, falls nicht leer"""
+        if self._records == 0:
+            return None
+        old_file, old_path = self._file, self._path
+        self._open_segment()
+        old_file.close()
+        return old_path
+
+    @staticmethod
+    def sync(path: str):
+        """Segment auf die Platte bringen (blockiert, im Thread aufrufen)"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def read(path: str) -> List[Dict]:
+        """Segment lesen; eine abgeschnittene letzte Zeile (Absturz) wird ignoriert"""
+        records = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    log.warning("Unvollständiger Journal-Eintrag in %s übersprungen", path)
+        return records
+
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self._file is not None:
+            path, empty = self._path, self._records == 0
+            self._file.close()
+            self._file = None
+            if empty:
+                self.remove(path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self.remove(self._lock_file.name)
+            self._lock_file = None
+
+
+async def write_answers(records: List[Dict]) -> int:
+    """
+    Antworten gesammelt speichern, liefert die Anzahl neu eingefügter
+
+    Übersprungen werden bereits gespeicherte (gleicher idempotency_key) und
+    Antworten zu inzwischen gelöschten Sessions/Rätseln.
+    """
+    async with AsyncSessionLocal() as db:
+        session_ids = {record["session_id"] for record in records}
+        keys = {record["idempotency_key"] for record in records}
+        live_sessions = set(await db.scalars(
+            select(models.GameSession.id).where(models.GameSession.id.in_(session_ids))
+        ))
+        live_puzzles = set(await db.scalars(
+            select(models.Puzzle.id).where(models.Puzzle.id.in_({record["puzzle_id"] for record in records}))
+        ))
+        stored: Set[Tuple] = set((await db.execute(
+            select(models.PuzzleResult.session_id, models.PuzzleResult.puzzle_id,
+                   models.PuzzleResult.idempotency_key)
+            .where(models.PuzzleResult.session_id.in_(session_ids),
+                   models.PuzzleResult.idempotency_key.in_(keys))
+        )).all())
+
+        rows, totals = [], {}
+        for record in records:
+            key = (record["session_id"], record["puzzle_id"], record["idempotency_key"])
+            if key in stored:
+                continue
+            if record["session_id"] not in live_sessions or record["puzzle_id"] not in live_puzzles:
+                log.warning("Antwort verworfen, Session %s/Rätsel %s existiert nicht mehr",
+                            record["session_id"], record["puzzle_id"])
+                continue
+            stored.add(key)
+            rows.append({**record, "answered_at": datetime.fromisoformat(record["answered_at"])})
+            session_total = totals.setdefault(record["session_id"], [0, 0])
+            session_total[0] += record["points_earned"]
+            session_total[1] += 1
+
+        if rows:
+            await db.execute(insert(models.PuzzleResult), rows)
+            for session_id, (points, count) in totals.items():
+                await db.execute(update(models.GameSession).where(models.GameSession.id == session_id).values(
+                    total_score=models.GameSession.total_score + points,
+                    answered_count=models.GameSession.answered_count + count
+                ))
+            await db.commit()
+        return len(rows)
+
+
+class AnswerWriteBehind:
+    """Puffer + Journal + Hintergrund-Flush"""
+
+    def __init__(self, directory: str = ANSWER_JOURNAL_DIR, interval: float = ANSWER_FLUSH_INTERVAL,
+                 batch_size: int = ANSWER_FLUSH_BATCH):
+        self.enabled = False
+        self.interval = interval
+        self.batch_size = batch_size
+        self.journal = AnswerJournal(directory)
+        # Noch nicht gespeicherte Antworten und die Segmente, in denen sie stehen
+        self._pending: List[Dict] = []
+        self._segments: List[str] = []
+        # (session_id, puzzle_id, idempotency_key) -> Eintrag, für Wiederholungen vor dem Flush
+        self._pending_keys: Dict[Tuple, Dict] = {}
+        # session_id -> (student_id, room_id), ändert sich für eine Session nie
+        self._session_owners: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # Zählt vor und nach jedem DB-Schreiben hoch: ungerade = Flush schreibt gerade
+        self.flush_generation = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.failures = 0
+
+    async def start(self):
+        claimed = self.journal.open()
+        for path in claimed:
+            self._segments.append(path)
+            self._pending.extend(AnswerJournal.read(path))
+        if claimed:
+            log.info("Journal: %d Antworten aus %d Segmenten übernommen", len(self._pending), len(claimed))
+
+        self.enabled = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Beim Herunterfahren: alles Gepufferte noch speichern"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        if not self._pending:
+            self.journal.close()
+        else:
+            log.error("Write-behind: %d Antworten nicht gespeichert, bleiben im Journal", len(self._pending))
+
+    async def session_owner(self, db: AsyncSession, session_id: int) -> Optional[Tuple[int, int]]:
+        """(student_id, room_id) einer Session, nach dem ersten Mal ohne DB"""
+        owner = self._session_owners.get(session_id)
+        if owner is None:
+            session = await db.get(models.GameSession, session_id)
+            if session is None:
+                return None
+            owner = self._session_owners[session_id] = (session.student_id, session.room_id)
+            while len(self._session_owners) > SESSION_OWNER_CACHE_SIZE:
+                self._session_owners.popitem(last=False)
+        return owner
+
+    def pending_answer(self, session_id: int, puzzle_id: int, idempotency_key: Optional[str]) -> Optional[Dict]:
+        """Noch nicht gespeicherte Antwort mit diesem Schlüssel"""
+        if not idempotency_key:
+            return None
+        return self._pending_keys.get((session_id, puzzle_id, idempotency_key))
+
+    def submit(self, session_id: int, puzzle_id: int, answer_json: Dict, is_correct: bool, points_earned: int,
+               time_taken_seconds: int, idempotency_key: Optional[str]) -> Dict:
+        """Bewertete Antwort ins Journal und in den Puffer (ohne Schlüssel bekommt sie einen)"""
+        record = {
+            "session_id": session_id,
+            "puzzle_id": puzzle_id,
+            "answer_json": json.dumps(answer_json),
+            "is_correct": is_correct,
+            "points_earned": points_earned,
+            "time_taken_seconds": time_taken_seconds,
+            "idempotency_key": idempotency_key or uuid.uuid4().hex,
+            "answered_at": datetime.utcnow().isoformat()
+        }
+        self.journal.append(record)
+        self._pending.append(record)
+        self._pending_keys[(session_id, puzzle_id, record["idempotency_key"])] = record
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return record
+
+    def pending_totals(self, session_id: int) -> Tuple[int, int]:
+        """(Punkte, Antworten) einer Session, die noch nicht in der DB stehen"""
+        points = count = 0
+        for record in self._pending:
+            if record["session_id"] == session_id:
+                points += record["points_earned"]
+                count += 1
+        return points, count
+
+    async def stable_generation(self) -> int:
+        """Aktuelle Flush-Generation, sobald gerade kein Flush schreibt"""
+        await self._idle.wait()
+        return self.flush_generation
+
+    async def read_consistent(self, session_id: int, read: Callable[[], Awaitable[Any]]) -> Tuple[Any, Tuple[int, int]]:
+        """
+        read() (DB-Zugriff) und pending_totals(session_id) passend zueinander
+
+        Jede Antwort steht danach entweder im Ergebnis von read() oder in
+        den Summen, nie in beiden oder keinem. Ohne Lock über die Abfrage:
+        ändert sich die Generation währenddessen, wird neu gelesen.
+        """
+        for _ in range(CONSISTENT_READ_RETRIES):
+            generation = await self.stable_generation()
+            value = await read()
+            if generation == self.flush_generation:
+                return value, self.pending_totals(session_id)
+
+        # Flush läuft ständig dazwischen: ausnahmsweise kurz anhalten
+        async with self._flush_lock:
+            value = await read()
+            return value, self.pending_totals(session_id)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Puffer in die DB schreiben; bei Fehler bleibt alles für den nächsten Versuch"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        segment = self.journal.rotate() if self.journal.is_open else None
+        if segment:
+            self._segments.append(segment)
+            # fsync im Thread: der Event-Loop wartet nicht auf die Platte
+            await asyncio.to_thread(AnswerJournal.sync, segment)
+        if not self._pending:
+            return
+
+        records, self._pending = self._pending, []
+        segments, self._segments = self._segments, []
+        self.flush_generation += 1
+        self._idle.clear()
+        try:
+            try:
+                written = await write_answers(records)
+            except BaseException as e:
+                self._pending = records + self._pending
+                self._segments = segments + self._segments
+                if not isinstance(e, Exception):
+                    raise  # z. B. CancelledError: Puffer ist wiederhergestellt
+                self.failures += 1
+                log.exception("Write-behind: %d Antworten nicht gespeichert, neuer Versuch folgt", len(records))
+                return
+
+            for path in segments:
+                AnswerJournal.remove(path)
+            for record in records:
+                self._pending_keys.pop(
+                    (record["session_id"], record["puzzle_id"], record["idempotency_key"]), None
+                )
+            self.flushed += written
+            log.debug("Write-behind: %d Antworten gespeichert (%d übersprungen)", written, len(records) - written)
+        finally:
+            # Puffer und Schlüssel sind wieder konsistent mit der DB
+            self.flush_generation += 1
+            self._idle.set()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "segments": len(self._segments),
+            "flushed": self.flushed,
+            "failures": self.failures
+        }
+
+
+write_behind = AnswerWriteBehind()
@@ -0,0 +1,134 @@
+"""
+Logging für den Server
+
+Alle Module loggen über logging.getLogger(__name__) (Logger "server.*").
+Geschrieben wird in einem eigenen Thread (QueueHandler/QueueListener),
+der Event-Loop wartet also nie auf stdout.
+
+Umgebungsvariablen:
+    LOG_LEVEL         DEBUG / INFO (Standard) / WARNING / ERROR
+    LOG_FORMAT        "text" (Standard) oder "json" (eine JSON-Zeile pro Eintrag)
+    LOG_DEBUG_SAMPLE  Anteil der DEBUG-Zeilen, die geschrieben werden (0.0-1.0, Standard 1.0)
+    LOG_QUEUE_SIZE    Puffer in Einträgen; ist er voll, wird verworfen statt zu blockieren
+
+Pro-Anfrage-Zeilen sind DEBUG und mit %-Platzhaltern geschrieben: bei INFO
+kostet ein Aufruf nur die Level-Prüfung, formatiert wird nichts.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1.0"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Attribute jedes LogRecords; alles andere kam über extra={...}
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Eine JSON-Zeile pro Eintrag, Felder aus extra={...} kommen mit"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Lesbare Zeile, Felder aus extra={...} als key=value angehängt"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = [f"{key}={value}" for key, value in vars(record).items()
+                  if key not in _RECORD_FIELDS and not key.startswith("_")]
+        return f"{line} [{' '.join(fields)}]" if fields else line
+
+
+class DebugSampler(logging.Filter):
+    """Lässt nur einen Anteil der DEBUG-Einträge durch (INFO und höher immer)"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, der bei voller Queue verwirft statt zu blockieren"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[DroppingQueueHandler] = None
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Logger "server" an den Hintergrund-Writer hängen (mehrfacher Aufruf ist harmlos)"""
+    global _handler, _listener
+    if _handler is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger("server")
+    logger.setLevel(level)
+    logger.addHandler(_handler)
+    logger.propagate = False
+
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Restliche Einträge schreiben und den Writer-Thread beenden"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def logging_stats() -> Dict:
+    """Für /api/metrics"""
+    return {
+        "level": logging.getLevelName(logging.getLogger("server").getEffectiveLevel()),
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0
+    }
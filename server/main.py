@@ -3,9 +3,11 @@ FastAPI Server - Hauptdatei
 Startet den Server und registriert alle Routen
 """
 from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 import sys
 
@@ -13,15 +15,27 @@ sys.path.append('..')
 
 import sys
 import os
+import logging
 
 # Parent-Verzeichnis zum Path hinzufügen für absolute Imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from server.database import get_db, init_db
-from server.auth import authenticate_user, create_access_token, get_password_hash, ACCESS_TOKEN_EXPIRE_MINUTES
-from server import models
+from server.database import get_db, get_async_db, init_db, engine, async_engine, pool_status
+from server.auth import (authenticate_user, create_access_token, password_hasher, login_limiter,
+                         shutdown_hash_pools, ACCESS_TOKEN_EXPIRE_MINUTES)
+from server import models, counters
 from shared.models import LoginRequest, TokenResponse, User, UserCreate
-from server.routes import admin, game, websocket, h5p
+from server.routes import admin, game, websocket, h5p, dashboard
+from server.metrics import REGISTRY, Gauge, MetricsMiddleware
+from server.querystats import SQL_QUERY_STATS, QueryStatsMiddleware, instrument_engine
+from server.log import setup_logging, shutdown_logging, logging_stats
+from server.grading import puzzle_cache
+from server.room_lists import room_list_cache
+from server.ingest import ANSWER_WRITE_BEHIND, write_behind
+
+# Logging vor allem anderen einrichten (Writer-Thread, LOG_LEVEL/LOG_FORMAT)
+setup_logging()
+log = logging.getLogger("server.main")  # fester Name, auch bei Start als main.py
 
 # FastAPI App erstellen
 app = FastAPI(
@@ -39,12 +53,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Metriken pro Route (zuletzt hinzugefügt = äußerste Middleware, misst also auch CORS)
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+# SQL-Abfragen pro Anfrage zählen (nur zur Analyse, SQL_QUERY_STATS=1)
+if SQL_QUERY_STATS:
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
+    app.add_middleware(QueryStatsMiddleware)
+
 # Statische Dateien für Admin-Panel (absoluter Pfad)
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static", "admin")
 if os.path.exists(STATIC_DIR):
     app.mount("/admin", StaticFiles(directory=STATIC_DIR, html=True), name="admin")
 else:
-    print("⚠️  Admin-Panel nicht gefunden (static/admin fehlt)")
+    log.warning("Admin-Panel nicht gefunden (static/admin fehlt)")
 
 # H5P Content verfügbar machen
 H5P_CONTENT_DIR = os.path.join(os.path.dirname(__file__), "static", "h5p-content")
@@ -61,14 +84,36 @@ app.include_router(admin.router)
 app.include_router(game.router)
 app.include_router(websocket.router)
 app.include_router(h5p.router)
+app.include_router(dashboard.router)
 
 
 @app.on_event("startup")
 async def startup_event():
     # Startet server + Datenbank
-    print("Server startet...")
-    init_db()
-    print("Datenbank initialisiert")
+    log.info("Server startet...")
+    added = init_db()
+    if added:
+        log.info("Spalten ergänzt: %s", ", ".join(added))
+    log.info("Datenbank initialisiert")
+    # Fortschritts-Zähler abgleichen (beim Start, danach periodisch)
+    await counters.repair_job.start()
+    if ANSWER_WRITE_BEHIND:
+        await write_behind.start()
+    await websocket.manager.start()
+    await dashboard.aggregator.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Noch gesammelte WebSocket-Events rausschicken, Backplane trennen
+    await dashboard.aggregator.stop()
+    await counters.repair_job.stop()
+    await websocket.manager.stop()
+    # Gepufferte Antworten speichern, solange die DB-Verbindung noch steht
+    await write_behind.stop()
+    shutdown_hash_pools()
+    await async_engine.dispose()
+    shutdown_logging()
 
 
 @app.get("/")
@@ -86,10 +131,11 @@ async def root():
 @app.post("/api/auth/login", response_model=TokenResponse)
 async def login(
         credentials: LoginRequest,
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Login-Endpunkt"""
-    user = authenticate_user(db, credentials.username, credentials.password)
+    async with login_limiter:
+        user = await authenticate_user(db, credentials.username, credentials.password)
 
     if not user:
         raise HTTPException(
@@ -128,7 +174,7 @@ async def register(
         )
 
     # Passwort hashen
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
 
     # User erstellen - OHNE is_active/is_approved
     db_user = models.User(
@@ -152,6 +198,32 @@ async def health_check():
     return {"status": "healthy", "service": "school-puzzle-game"}
 
 
+PASSWORD_HASH_QUEUE = Gauge("password_hash_in_flight", "bcrypt-Aufträge im Thread-Pool (laufend + wartend)")
+PASSWORD_HASH_QUEUE.set_function(lambda: password_hasher.stats()["in_flight"])
+LOGIN_WAITING = Gauge("login_waiting", "Logins, die auf einen freien Platz warten")
+LOGIN_WAITING.set_function(lambda: login_limiter.stats()["waiting"])
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Metriken im Prometheus-Textformat (pro Worker)"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/metrics")
+async def metrics():
+    """Betriebskennzahlen (Warteschlangen, Auslastung)"""
+    return {
+        "password_hash": password_hasher.stats(),
+        "login": login_limiter.stats(),
+        "db_pool": pool_status(),
+        "logging": logging_stats(),
+        "puzzle_cache": puzzle_cache.stats(),
+        "room_lists": room_list_cache.stats(),
+        "write_behind": write_behind.stats()
+    }
+
+
 
 from pydantic import BaseModel, Field
 class TeacherRegistration(BaseModel):
@@ -171,5 +243,8 @@ if __name__ == "__main__":
         host="127.0.0.1",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        # Protokoll-Pings (WebSocket-Ping-Frames) zusätzlich zum App-Heartbeat
+        ws_ping_interval=websocket.WS_PING_INTERVAL,
+        ws_ping_timeout=websocket.WS_IDLE_TIMEOUT
     )
\ No newline at end of file
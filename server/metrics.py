@@ -0,0 +1,294 @@
+"""
+Metriken im Prometheus-Textformat (GET /metrics)
+Counter, Gauge und Histogram ohne externe Abhängigkeiten
+
+Werte gelten pro Worker-Prozess. Updates sind bewusst ohne Lock: ein
+seltener verlorener Zähler-Schritt ist billiger als ein Lock pro Anfrage.
+"""
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# Standard-Grenzen für Latenzen (Sekunden)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Basisklasse: Name, Hilfetext, Label-Namen, Werte pro Label-Kombination"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values) -> object:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: erwartet Labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """(Suffix, Labels, Wert) für die Textausgabe"""
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    """Nur steigender Zähler (Name bekommt die Endung _total)"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, *args, **kwargs):
+        if not name.endswith("_total"):
+            name += "_total"
+        super().__init__(name, *args, **kwargs)
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for key, child in self._children.items():
+            yield "", _format_labels(self.labelnames, key), child.value
+
+
+class Gauge(Metric):
+    """
+    Momentanwert
+
+    Mit set_function wird der Wert erst beim Abruf von /metrics berechnet
+    (z. B. Anzahl Verbindungen), es entstehen keine Kosten im Hot Path.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], Union[float, Dict[LabelValues, float]]]):
+        """function liefert einen Wert oder {Label-Tupel: Wert}"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            result = self._function()
+            values = result if isinstance(result, dict) else {(): result}
+            for key, value in values.items():
+                yield "", _format_labels(self.labelnames, key), value
+            return
+
+        for key, child in self._children.items():
+            yield "", _format_labels(self.labelnames, key), child.value
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "buckets", "sum", "count")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        self.buckets: List[int] = [0] * (len(upper_bounds) + 1)  # letzter Eintrag = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.buckets[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """(Obergrenze, Anzahl <= Obergrenze) inklusive +Inf"""
+        total, result = 0, []
+        for bound, count in zip(self.upper_bounds + (float("inf"),), self.buckets):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Histogram(Metric):
+    """Verteilung (z. B. Latenzen) in festen Buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional["Registry"] = None):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.upper_bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self, *labelvalues) -> "_Timer":
+        """with histogram.time(): ... misst die Dauer des Blocks"""
+        return _Timer(self.labels(*labelvalues))
+
+    def samples(self):
+        for key, child in self._children.items():
+            for bound, count in child.cumulative():
+                yield "_bucket", _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"'), count
+            yield "_sum", _format_labels(self.labelnames, key), child.sum
+            yield "_count", _format_labels(self.labelnames, key), child.count
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child: _HistogramValue):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+
+
+class Registry:
+    """Alle Metriken eines Prozesses"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metrik {metric.name} existiert bereits")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Textformat 0.0.4 (Prometheus)"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for suffix, labels, value in metric.samples():
+                    lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+            except Exception:
+                log.exception("Metrik %s fehlgeschlagen", metric.name)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ==================== HTTP ====================
+
+HTTP_REQUESTS = Counter(
+    "http_requests", "HTTP-Anfragen nach Route und Status", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Dauer der HTTP-Anfragen", ["method", "route"]
+)
+
+
+class MetricsMiddleware:
+    """
+    Reines ASGI-Middleware (kein BaseHTTPMiddleware, kein Extra-Task pro Anfrage)
+
+    Als Label dient das Routen-Template (/api/game/session/{session_id}/progress),
+    nicht der konkrete Pfad, damit die Anzahl der Zeitreihen begrenzt bleibt.
+    """
+
+    def __init__(self, app, routes: List):
+        self.app = app
+        self.routes = routes  # live-Liste app.routes (Router werden später ergänzt)
+        self._templates: Dict[object, str] = {}
+
+    def _route_template(self, scope: Dict) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "<unmatched>"
+
+        template = self._templates.get(endpoint)
+        if template is None:
+            # Routen über endpoint, Mounts (statische Dateien) über app
+            self._templates = {
+                getattr(route, "endpoint", getattr(route, "app", None)): route.path for route in self.routes
+            }
+            template = self._templates.get(endpoint, "<unmatched>")
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # scope wurde vom Router um "endpoint" ergänzt
+            route = self._route_template(scope)
+            method = scope["method"]
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, status_code).inc()
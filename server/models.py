@@ -1,7 +1,7 @@
 """
 SQLAlchemy Database Models
 """
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -36,6 +36,8 @@ class Room(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=False)
+    # Zähler, wird bei jeder Rätsel-Änderung mitgepflegt (siehe server/counters.py)
+    puzzle_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relationships
     teacher = relationship("User", back_populates="rooms")
@@ -90,6 +92,8 @@ class GameSession(Base):
     completed_at = Column(DateTime, nullable=True)
     total_score = Column(Integer, default=0)
     status = Column(Enum('in_progress', 'completed', 'abandoned'), default='in_progress', index=True)
+    # Anzahl PuzzleResults, wird beim Einreichen mitgezählt (siehe server/counters.py)
+    answered_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Relationships
     room = relationship("Room", back_populates="game_sessions")
@@ -108,6 +112,13 @@ class PuzzleResult(Base):
     points_earned = Column(Integer, default=0)
     time_taken_seconds = Column(Integer)
     answered_at = Column(DateTime, default=datetime.utcnow)
+    # Vom Client erzeugter Schlüssel: Wiederholte Anfragen liefern das gespeicherte Ergebnis
+    idempotency_key = Column(String(64), nullable=True)
+
+    # NULL-Schlüssel (alte Clients) kollidieren im Unique-Index nicht
+    __table_args__ = (
+        Index("uq_puzzle_results_idempotency", "session_id", "puzzle_id", "idempotency_key", unique=True),
+    )
 
     # Relationships
     session = relationship("GameSession", back_populates="results")
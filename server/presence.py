@@ -0,0 +1,134 @@
+"""
+Presence: wer ist verbunden, in welchem Raum, an welchem Rätsel
+
+Jeder Worker meldet Änderungen seiner eigenen Verbindungen über das interne
+Topic "_presence" (Backplane). Alle Worker halten damit denselben Index,
+egal auf welchem Worker eine HTTP-Anfrage landet.
+
+Jeder Worker meldet sich außerdem regelmäßig ("alive"). Wer länger als
+PRESENCE_WORKER_TIMEOUT nichts von sich hören lässt (abgestürzt, kein
+"worker_down" mehr), verliert seine Einträge.
+"""
+import os
+import socket
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+PRESENCE_TOPIC = "_presence"
+# Sekunden ohne Lebenszeichen, nach denen ein Worker als tot gilt
+PRESENCE_WORKER_TIMEOUT = float(os.getenv("PRESENCE_WORKER_TIMEOUT", "90"))
+
+# Eindeutige Kennung dieses Worker-Prozesses
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class PresenceIndex:
+    """
+    Verbindung <-> User <-> Raum <-> Rätsel
+
+    Schlüssel ist "<worker>/<verbindung>". Alle Änderungen und die
+    Abfrage pro Raum sind O(1) bzw. O(Verbindungen im Raum).
+    """
+
+    def __init__(self):
+        # Schlüssel -> Eintrag (user_id, username, role, room_id, puzzle_id, ...)
+        self.entries: Dict[str, Dict] = {}
+        self.by_room: Dict[int, Set[str]] = {}
+        self.by_user: Dict[int, Set[str]] = {}
+        self.by_worker: Dict[str, Set[str]] = {}
+        # Worker -> letztes Lebenszeichen (time.monotonic, lokal gemessen)
+        self.worker_seen: Dict[str, float] = {}
+
+    def set(self, key: str, entry: Dict):
+        """Eintrag anlegen oder ersetzen (Indizes werden nachgezogen)"""
+        self.remove(key)
+        self.entries[key] = entry
+
+        if entry.get("room_id") is not None:
+            self.by_room.setdefault(entry["room_id"], set()).add(key)
+        if entry.get("user_id") is not None:
+            self.by_user.setdefault(entry["user_id"], set()).add(key)
+        self.by_worker.setdefault(entry.get("worker"), set()).add(key)
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        self._discard(self.by_room, entry.get("room_id"), key)
+        self._discard(self.by_user, entry.get("user_id"), key)
+        self._discard(self.by_worker, entry.get("worker"), key)
+
+    def remove_worker(self, worker: str):
+        """Alle Verbindungen eines (beendeten) Workers entfernen"""
+        self.worker_seen.pop(worker, None)
+        for key in list(self.by_worker.get(worker, ())):
+            self.remove(key)
+
+    def expire_workers(self, timeout: float = PRESENCE_WORKER_TIMEOUT, own: str = WORKER_ID) -> List[str]:
+        """Einträge von Workern ohne Lebenszeichen seit timeout Sekunden entfernen"""
+        now = time.monotonic()
+        expired = [w for w, seen in self.worker_seen.items() if w != own and now - seen > timeout]
+        for worker in expired:
+            self.remove_worker(worker)
+        return expired
+
+    @staticmethod
+    def _discard(index: Dict, value, key: str):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def apply(self, event: Dict):
+        """Presence-Event von der Backplane einspielen"""
+        op = event.get("op")
+        if op == "set":
+            self.worker_seen[event["entry"].get("worker")] = time.monotonic()
+            self.set(event["key"], event["entry"])
+        elif op == "remove":
+            self.remove(event["key"])
+        elif op == "alive":
+            self.worker_seen[event["worker"]] = time.monotonic()
+        elif op == "worker_down":
+            self.remove_worker(event["worker"])
+
+    def room_snapshot(self, room_id: int) -> Dict:
+        """Wer ist gerade in diesem Raum (für GET /rooms/{id}/presence)"""
+        connections = [self.entries[key] for key in self.by_room.get(room_id, ())]
+        puzzles: Dict[int, int] = {}
+        for entry in connections:
+            if entry.get("puzzle_id") is not None:
+                puzzles[entry["puzzle_id"]] = puzzles.get(entry["puzzle_id"], 0) + 1
+
+        return {
+            "room_id": room_id,
+            "generated_at": datetime.utcnow().isoformat(),
+            "connections": len(connections),
+            "users": len({entry["user_id"] for entry in connections}),
+            "workers": sorted({entry["worker"] for entry in connections}),
+            "puzzles": [{"puzzle_id": p, "connections": n} for p, n in sorted(puzzles.items())],
+            "entries": sorted(connections, key=lambda entry: entry["since"])
+        }
+
+    def local_entries(self, worker: str = WORKER_ID) -> List[tuple]:
+        """Eigene Einträge (zum erneuten Melden an neue Worker)"""
+        return [(key, self.entries[key]) for key in self.by_worker.get(worker, ())]
+
+
+def presence_entry(user, room_id: Optional[int] = None, puzzle_id: Optional[int] = None,
+                   since: Optional[str] = None) -> Dict:
+    """Eintrag für einen angemeldeten User bauen"""
+    return {
+        "user_id": user.id,
+        "username": user.username,
+        "full_name": user.full_name,
+        "role": user.role,
+        "room_id": room_id,
+        "puzzle_id": puzzle_id,
+        "worker": WORKER_ID,
+        "since": since or datetime.utcnow().isoformat(),
+        "updated_at": datetime.utcnow().isoformat()
+    }
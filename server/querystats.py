@@ -0,0 +1,131 @@
+"""
+SQL-Abfragen pro Anfrage zählen (opt-in, SQL_QUERY_STATS=1)
+
+Zählt Abfragen und DB-Zeit je HTTP-Anfrage, hängt sie als Header an
+(X-DB-Query-Count, X-DB-Time-Ms) und warnt bei verdächtig vielen oder
+wiederholten gleichen Abfragen (typisches N+1-Muster).
+
+Für Tests/Benchmarks:
+    with assert_max_queries(3):
+        ...  # wirft AssertionError bei mehr als 3 Abfragen
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+SQL_QUERY_STATS = os.getenv("SQL_QUERY_STATS", "0").lower() in ("1", "true", "yes")
+# Ab so vielen Abfragen pro Anfrage wird gewarnt
+SQL_QUERY_WARN = int(os.getenv("SQL_QUERY_WARN", "20"))
+# Ab so vielen Wiederholungen derselben Abfrage wird N+1 gemeldet
+SQL_REPEAT_WARN = int(os.getenv("SQL_REPEAT_WARN", "5"))
+
+
+class QueryStats:
+    """Abfragen und DB-Zeit einer Anfrage (bzw. eines assert_max_queries-Blocks)"""
+
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # SQL-Text -> Anzahl (für die N+1-Erkennung)
+        self.statements: Dict[str, int] = {}
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int = SQL_REPEAT_WARN) -> List[str]:
+        """Abfragen, die mindestens threshold-mal ausgeführt wurden"""
+        return [statement for statement, n in self.statements.items() if n >= threshold]
+
+
+# Alle aktiven Zähler dieses Kontexts (Anfrage + evtl. verschachtelte Test-Blöcke)
+_current: ContextVar[tuple] = ContextVar("query_stats", default=())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Startzeit am ExecutionContext (lebt nur für diese Ausführung): schlägt die Abfrage fehl,
+    # bleibt nichts an der gepoolten Verbindung hängen
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    active = _current.get()
+    if active:
+        started = getattr(context, "_query_start", None)
+        elapsed = time.perf_counter() - started if started is not None else 0.0
+        for stats in active:
+            stats.record(statement, elapsed)
+
+
+def instrument_engine(engine: Engine):
+    """Zähl-Hooks an eine (sync) Engine hängen; für AsyncEngine: engine.sync_engine"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Alle Abfragen im Block zählen (auch in aufgerufenen Coroutinen)"""
+    stats = QueryStats()
+    token = _current.set(_current.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def assert_max_queries(budget: int) -> Iterator[QueryStats]:
+    """Test-Helfer: schlägt fehl, wenn der Block mehr als budget Abfragen braucht"""
+    with track_queries() as stats:
+        yield stats
+    if stats.count > budget:
+        details = "\n".join(f"  {n}x {sql}" for sql, n in sorted(stats.statements.items(), key=lambda i: -i[1]))
+        raise AssertionError(f"{stats.count} SQL-Abfragen, erlaubt sind {budget}:\n{details}")
+
+
+class QueryStatsMiddleware:
+    """ASGI-Middleware: Abfragen pro HTTP-Anfrage zählen und als Header zurückgeben"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-db-query-count", str(stats.count).encode()))
+                    headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.2f}".encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+        self._warn(scope, stats)
+
+    @staticmethod
+    def _warn(scope, stats: QueryStats):
+        path = f"{scope['method']} {scope['path']}"
+        if stats.count >= SQL_QUERY_WARN:
+            log.warning("%s: %d SQL-Abfragen (%.1f ms)", path, stats.count, stats.seconds * 1000)
+        for statement in stats.repeated():
+            log.warning("%s: mögliches N+1, %dx: %s", path, stats.statements[statement], statement[:200])
@@ -0,0 +1,140 @@
+"""
+Zwischengespeicherte Raumlisten für GET /api/game/available-rooms
+
+Boards laden die Liste bei jedem WebSocket-Event neu. Pro Zielgruppe
+("students" = aktive Räume, "teacher:<id>" = eigene Räume, "admin" = alle)
+liegt die Antwort deshalb fertig serialisiert als JSON-Bytes im Speicher.
+
+Invalidiert wird über die rooms_updated-Events, die die Admin-Routen
+ohnehin verschicken: sofort im publizierenden Worker, auf allen anderen
+per Listener auf dem internen Topic "_rooms". ROOM_LIST_CACHE_TTL ist nur das
+Sicherheitsnetz, falls ein Event verloren geht (0 = Cache aus).
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import select
+
+from . import models
+from .database import AsyncSessionLocal
+from shared.models import Room
+
+ROOM_LIST_CACHE_TTL = float(os.getenv("ROOM_LIST_CACHE_TTL", "60"))
+
+STUDENT_AUDIENCE = "students"
+ADMIN_AUDIENCE = "admin"
+
+
+def audience_for(user: models.User) -> Optional[str]:
+    """Zielgruppe eines Users (None = sieht keine Räume)"""
+    if user.role == "admin":
+        return ADMIN_AUDIENCE
+    if user.role == "teacher":
+        return f"teacher:{user.id}"
+    if user.role == "student":
+        return STUDENT_AUDIENCE
+    return None
+
+
+def rooms_query(audience: str):
+    """SELECT für die Räume einer Zielgruppe"""
+    query = select(models.Room)
+    if audience == STUDENT_AUDIENCE:
+        return query.where(models.Room.is_active == True)
+    if audience.startswith("teacher:"):
+        return query.where(models.Room.teacher_id == int(audience.partition(":")[2]))
+    return query
+
+
+def encode_rooms(rooms) -> bytes:
+    """Wie FastAPIs JSONResponse serialisieren, nur einmal statt pro Anfrage"""
+    data = [Room.model_validate(room).model_dump(mode="json") for room in rooms]
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RoomListCache:
+    """
+    Zielgruppe -> (JSON-Bytes, Zeitpunkt)
+
+    Wie beim PuzzleCache schützt eine Generation vor veralteten Einträgen:
+    Eine Liste wird nur gespeichert, wenn seit Beginn der Abfrage nichts
+    invalidiert wurde. Gleichzeitige Anfragen derselben Zielgruppe teilen
+    sich eine DB-Abfrage (nach einer Invalidierung laden sonst alle Boards
+    gleichzeitig neu).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: Dict[str, Tuple[bytes, float]] = {}
+        self._loading: Dict[Tuple[str, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, audience: str) -> Optional[bytes]:
+        entry = self._entries.get(audience)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def put(self, audience: str, body: bytes, generation: int):
+        if self.ttl <= 0 or generation != self.generation:
+            return
+        self._entries[audience] = (body, time.monotonic())
+
+    def invalidate(self, teacher_id: Optional[int] = None):
+        """Schüler-/Admin-Liste und die Liste des Lehrers verwerfen (None = alle Lehrer)"""
+        self.generation += 1
+        self._entries.pop(STUDENT_AUDIENCE, None)
+        self._entries.pop(ADMIN_AUDIENCE, None)
+        if teacher_id is not None:
+            self._entries.pop(f"teacher:{teacher_id}", None)
+        else:
+            for audience in [a for a in self._entries if a.startswith("teacher:")]:
+                del self._entries[audience]
+
+    def apply(self, event: Dict):
+        """rooms_updated-Event einspielen (gelöschte Räume haben kein "room" mehr)"""
+        if event.get("type") != "rooms_updated":
+            return
+        room = event.get("room")
+        self.invalidate(room["teacher_id"] if room else None)
+
+    async def load(self, audience: str) -> bytes:
+        """JSON-Bytes aus dem Cache, sonst eine (geteilte) DB-Abfrage"""
+        body = self.get(audience)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        self.misses += 1
+        key = (audience, self.generation)
+        future = self._loading.get(key)
+        if future is None:
+            # Eigener Task: bricht ein wartender Client ab, läuft die Abfrage für die anderen weiter
+            future = asyncio.ensure_future(self._build(audience, self.generation))
+            self._loading[key] = future
+            future.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _build(self, audience: str, generation: int) -> bytes:
+        async with AsyncSessionLocal() as db:
+            rooms = (await db.scalars(rooms_query(audience))).all()
+        body = encode_rooms(rooms)
+        self.put(audience, body, generation)
+        return body
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "ttl": self.ttl,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+room_list_cache = RoomListCache(ROOM_LIST_CACHE_TTL)
@@ -1,22 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from typing import List
+import csv
+import io
 import json
+import logging
+import os
 import sys
 
 sys.path.append('..')
 from ..database import get_db
-from ..auth import get_current_teacher
+from ..auth import get_current_teacher, hash_passwords
+from ..grading import puzzle_cache, puzzle_event, PUZZLE_TOPIC
+from ..counters import recount_sessions
 from .. import models
 from shared.models import Room, RoomCreate, Puzzle, PuzzleCreate, User
-from .websocket import manager
+from .websocket import manager, publish_user_changed, room_topics, rooms_updated_event
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
 from pathlib import Path
 import shutil
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
+log = logging.getLogger(__name__)
+
+# Obergrenze für einen Schüler-Import (Zeilen pro Datei)
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "5000"))
+# Zeilen pro INSERT-Statement
+IMPORT_BATCH_SIZE = 500
 
 
 # Eigenes Response-Model für Puzzle, um den Fehler beim Erstellen zu verhindern
@@ -36,6 +49,13 @@ class PuzzleResponse(BaseModel):
         from_attributes = True
 
 
+async def invalidate_puzzles(puzzle_ids=(), room_id: Optional[int] = None):
+    """Lösungsschlüssel sofort hier und über die Backplane auf allen Workern verwerfen"""
+    event = puzzle_event(puzzle_ids, room_id)
+    puzzle_cache.apply(event)
+    await manager.publish([PUZZLE_TOPIC], event)
+
+
 # ==================== ROOMS ====================
 
 @router.get("/rooms", response_model=List[Room])
@@ -65,14 +85,12 @@ async def create_room(
     db.commit()
     db.refresh(db_room)
 
-    # WebSocket Broadcast an alle Clients
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "room_created",
-        "room_id": db_room.id,
-        "room_name": db_room.name
-    })
-    print(f" Broadcast gesendet: Raum '{db_room.name}' erstellt")
+    # WebSocket-Update an Lehrer-/Raum-Abonnenten
+    await manager.publish(
+        room_topics(db_room.id, db_room.teacher_id, db_room.is_active),
+        rooms_updated_event("room_created", db_room.id, room=db_room, room_name=db_room.name)
+    )
+    log.info("Raum erstellt: %s (ID %d)", db_room.name, db_room.id)
 
     return db_room
 
@@ -100,11 +118,10 @@ async def update_room(
     db.refresh(db_room)
 
     # Broadcast bei Update
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "room_updated",
-        "room_id": db_room.id
-    })
+    await manager.publish(
+        room_topics(db_room.id, db_room.teacher_id, db_room.is_active),
+        rooms_updated_event("room_updated", db_room.id, room=db_room)
+    )
 
     return db_room
 
@@ -124,15 +141,16 @@ async def delete_room(
     if not db_room:
         raise HTTPException(status_code=404, detail="Raum nicht gefunden")
 
+    was_active = db_room.is_active
     db.delete(db_room)
     db.commit()
+    await invalidate_puzzles(room_id=room_id)
 
     # Broadcast bei Löschen
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "room_deleted",
-        "room_id": room_id
-    })
+    await manager.publish(
+        room_topics(room_id, current_user.id, was_active),
+        rooms_updated_event("room_deleted", room_id)
+    )
 
     return {"message": "Raum gelöscht"}
 
@@ -154,17 +172,39 @@ async def activate_room(
 
     db_room.is_active = not db_room.is_active
     db.commit()
+    db.refresh(db_room)
 
-    # Broadcast bei Aktivierung
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "room_activated" if db_room.is_active else "room_deactivated",
-        "room_id": room_id
-    })
+    # Broadcast bei Aktivierung (Schüler-Liste ändert sich in beide Richtungen)
+    await manager.publish(
+        room_topics(room_id, current_user.id, is_active=True),
+        rooms_updated_event(
+            "room_activated" if db_room.is_active else "room_deactivated",
+            room_id,
+            room=db_room
+        )
+    )
 
     return {"is_active": db_room.is_active}
 
 
+@router.get("/rooms/{room_id}/presence")
+async def get_room_presence(
+        room_id: int,
+        current_user: models.User = Depends(get_current_teacher),
+        db: Session = Depends(get_db)
+):
+    """Wer ist gerade mit welchem Board in diesem Raum (alle Worker)"""
+    db_room = db.query(models.Room.id).filter(
+        models.Room.id == room_id,
+        models.Room.teacher_id == current_user.id
+    ).first()
+
+    if not db_room:
+        raise HTTPException(status_code=404, detail="Raum nicht gefunden")
+
+    return manager.presence.room_snapshot(room_id)
+
+
 # ==================== PUZZLES ====================
 
 @router.get("/rooms/{room_id}/puzzles", response_model=List[PuzzleResponse])
@@ -221,15 +261,16 @@ async def create_puzzle(
     )
 
     db.add(db_puzzle)
+    db_room.puzzle_count = models.Room.puzzle_count + 1
     db.commit()
     db.refresh(db_puzzle)
+    await invalidate_puzzles([db_puzzle.id])
 
     # Broadcast bei Puzzle-Erstellung
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "puzzle_added",
-        "room_id": puzzle.room_id
-    })
+    await manager.publish(
+        room_topics(db_room.id, db_room.teacher_id, db_room.is_active),
+        rooms_updated_event("puzzle_added", db_room.id, room=db_room, puzzle=db_puzzle)
+    )
 
     return db_puzzle
 
@@ -250,11 +291,32 @@ async def update_puzzle(
     if not db_puzzle:
         raise HTTPException(status_code=404, detail="Rätsel nicht gefunden")
 
+    old_room_id = db_puzzle.room_id
+
     for key, value in puzzle.dict().items():
+        if key == "h5p_json" and value is not None:
+            value = json.dumps(value)  # Als String speichern (wie beim Erstellen)
         setattr(db_puzzle, key, value)
 
+    # Rätsel in anderen Raum verschoben: Zähler beider Räume anpassen
+    if db_puzzle.room_id != old_room_id:
+        db.query(models.Room).filter(models.Room.id == old_room_id).update(
+            {models.Room.puzzle_count: models.Room.puzzle_count - 1}, synchronize_session=False
+        )
+        db.query(models.Room).filter(models.Room.id == db_puzzle.room_id).update(
+            {models.Room.puzzle_count: models.Room.puzzle_count + 1}, synchronize_session=False
+        )
+
     db.commit()
     db.refresh(db_puzzle)
+    await invalidate_puzzles([puzzle_id])
+
+    db_room = db_puzzle.room
+    await manager.publish(
+        room_topics(db_room.id, db_room.teacher_id, db_room.is_active),
+        rooms_updated_event("puzzle_updated", db_room.id, room=db_room, puzzle=db_puzzle)
+    )
+
     return db_puzzle
 
 
@@ -270,21 +332,20 @@ async def delete_puzzle(
     from pathlib import Path
     import shutil
 
-    # Puzzle MIT Room-Beziehung laden
-    puzzle = db.query(models.Puzzle).filter(
+    # Puzzle MIT Room in einer Abfrage laden (Room für Berechtigungsprüfung)
+    row = db.query(models.Puzzle, models.Room).outerjoin(
+        models.Room, models.Room.id == models.Puzzle.room_id
+    ).filter(
         models.Puzzle.id == puzzle_id
     ).first()
 
-    if not puzzle:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Puzzle nicht gefunden"
         )
 
-    # Room separat laden für Berechtigungsprüfung
-    room = db.query(models.Room).filter(
-        models.Room.id == puzzle.room_id
-    ).first()
+    puzzle, room = row
 
     if not room:
         raise HTTPException(
@@ -300,6 +361,9 @@ async def delete_puzzle(
         )
 
     # 🔥 FIX: Zuerst alle PuzzleResults löschen die auf dieses Puzzle verweisen
+    affected_sessions = [session_id for (session_id,) in db.query(models.PuzzleResult.session_id).filter(
+        models.PuzzleResult.puzzle_id == puzzle_id
+    ).distinct()]
     db.query(models.PuzzleResult).filter(
         models.PuzzleResult.puzzle_id == puzzle_id
     ).delete()
@@ -314,21 +378,24 @@ async def delete_puzzle(
 
             if content_path.exists():
                 shutil.rmtree(content_path)
-                print(f"H5P Content gelöscht: {content_path}")
+                log.info("H5P-Content gelöscht: %s", content_path)
         except Exception as e:
-            print(f" Fehler beim Löschen von H5P Content: {e}")
+            log.warning("Fehler beim Löschen von H5P-Content: %s", e)
             # Trotzdem weitermachen und Puzzle aus DB löschen
 
-    # Puzzle aus Datenbank löschen
+    # Puzzle aus Datenbank löschen, Zähler von Raum und betroffenen Sessions nachziehen
     db.delete(puzzle)
+    room.puzzle_count = models.Room.puzzle_count - 1
+    if affected_sessions:
+        db.execute(recount_sessions(affected_sessions))
     db.commit()
+    await invalidate_puzzles([puzzle_id])
 
     # Broadcast
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "puzzle_deleted",
-        "room_id": puzzle.room_id
-    })
+    await manager.publish(
+        room_topics(room.id, room.teacher_id, room.is_active),
+        rooms_updated_event("puzzle_deleted", room.id, room=room, puzzle_id=puzzle_id)
+    )
 
     return {
         "success": True,
@@ -379,11 +446,10 @@ async def assign_student_to_room(
     db.commit()
 
     # Broadcast bei Student-Zuweisung
-    await manager.broadcast({
-        "type": "rooms_updated",
-        "action": "student_assigned",
-        "room_id": room_id
-    })
+    await manager.publish(
+        room_topics(room_id, current_user.id, db_room.is_active),
+        rooms_updated_event("student_assigned", room_id, room=db_room, student_id=student_id)
+    )
 
     return {"message": "Schüler zugewiesen"}
 
@@ -400,6 +466,125 @@ async def get_students(
     return students
 
 
+# ==================== SCHÜLER-IMPORT ====================
+
+def parse_student_file(filename: str, content: bytes) -> List[Tuple[int, Dict[str, Any]]]:
+    """
+    CSV- oder JSON-Datei in (Zeilennummer, Zeile) umwandeln
+
+    CSV: Kopfzeile mit username, password, full_name (Trenner , oder ;)
+    JSON: Liste von Objekten oder {"students": [...]}
+    """
+    text = content.decode("utf-8-sig")
+
+    if filename.lower().endswith(".json") or text.lstrip().startswith(("[", "{")):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("students", [])
+        if not isinstance(data, list):
+            raise ValueError("JSON muss eine Liste von Schülern enthalten")
+        return [(number, row if isinstance(row, dict) else {}) for number, row in enumerate(data, start=1)]
+
+    try:
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    # Zeilennummern wie im Tabellenprogramm (Kopfzeile = 1)
+    return [
+        (number, {(key or "").strip().lower(): value for key, value in row.items()})
+        for number, row in enumerate(reader, start=2)
+    ]
+
+
+def validate_student_row(row: Dict[str, Any]) -> Optional[str]:
+    """Fehlermeldung für eine Zeile oder None"""
+    username = str(row.get("username") or "").strip()
+    password = str(row.get("password") or "")
+
+    if not 3 <= len(username) <= 100:
+        return "Benutzername muss 3-100 Zeichen lang sein"
+    if not password:
+        return "Passwort fehlt"
+    if len(str(row.get("full_name") or "")) > 200:
+        return "Name zu lang (max. 200 Zeichen)"
+    return None
+
+
+@router.post("/students/import")
+async def import_students(
+        file: UploadFile = File(...),
+        current_user: models.User = Depends(get_current_teacher),
+        db: Session = Depends(get_db)
+):
+    """
+    Viele Schüler auf einmal anlegen (CSV oder JSON)
+
+    Passwörter werden parallel in einem Prozess-Pool gehasht, alle gültigen
+    Zeilen landen in EINER Transaktion. Fehlerhafte Zeilen werden übersprungen
+    und mit Zeilennummer zurückgemeldet.
+    """
+    try:
+        rows = parse_student_file(file.filename or "", await file.read())
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Datei konnte nicht gelesen werden: {e}")
+
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"Maximal {IMPORT_MAX_ROWS} Schüler pro Import")
+
+    errors = []
+    valid: List[Dict[str, Any]] = []
+    seen = set()
+    for number, row in rows:
+        error = validate_student_row(row)
+        username = str(row.get("username") or "").strip()
+        if error is None and username in seen:
+            error = "Benutzername doppelt in der Datei"
+        if error:
+            errors.append({"row": number, "username": username or None, "error": error})
+            continue
+
+        seen.add(username)
+        valid.append({"row": number, "username": username, "password": str(row["password"]),
+                      "full_name": str(row.get("full_name") or "").strip() or None})
+
+    # Bereits vergebene Benutzernamen (eine Abfrage pro Paket statt pro Zeile)
+    usernames = [entry["username"] for entry in valid]
+    existing = set()
+    for i in range(0, len(usernames), IMPORT_BATCH_SIZE):
+        existing.update(name for (name,) in db.query(models.User.username).filter(
+            models.User.username.in_(usernames[i:i + IMPORT_BATCH_SIZE])
+        ))
+
+    for entry in valid:
+        if entry["username"] in existing:
+            errors.append({"row": entry["row"], "username": entry["username"], "error": "Benutzername bereits vergeben"})
+    valid = [entry for entry in valid if entry["username"] not in existing]
+
+    hashes = await hash_passwords([entry["password"] for entry in valid])
+    users = [
+        {"username": entry["username"], "password_hash": password_hash,
+         "role": "student", "full_name": entry["full_name"], "created_at": datetime.utcnow()}
+        for entry, password_hash in zip(valid, hashes)
+    ]
+
+    try:
+        for i in range(0, len(users), IMPORT_BATCH_SIZE):
+            db.execute(insert(models.User), users[i:i + IMPORT_BATCH_SIZE])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        log.error("Schüler-Import fehlgeschlagen: %s", e)
+        raise HTTPException(status_code=500, detail="Import fehlgeschlagen, es wurde nichts angelegt")
+
+    log.info("Schüler-Import: %d angelegt, %d Fehler", len(users), len(errors))
+    return {
+        "created": len(users),
+        "failed": len(errors),
+        "errors": sorted(errors, key=lambda error: error["row"])
+    }
+
+
 # ==================== TEACHERS ====================
 
 @router.get("/teachers", response_model=List[User])
@@ -461,4 +646,7 @@ async def approve_teacher(
 
     db.commit()
 
+    # Angemeldete Sessions des Lehrers mit neuem Stand laden
+    await publish_user_changed(teacher_id)
+
     return {"message": message, "approved": approve}
\ No newline at end of file
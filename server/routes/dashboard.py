@@ -0,0 +1,294 @@
+"""
+Live-Dashboard für Lehrer
+Aggregiert Antworten pro Raum im Speicher und schickt periodisch kompakte Snapshots
+über den WebSocket (Topic "dashboard:{room_id}")
+"""
+from fastapi import APIRouter, Depends, HTTPException, WebSocket
+from sqlalchemy import func, case, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import asyncio
+import os
+import time
+
+from ..database import get_async_db, AsyncSessionLocal
+from ..auth import get_current_teacher
+from .. import models
+from .websocket import manager
+
+router = APIRouter(prefix="/api/admin", tags=["dashboard"])
+
+# Wie oft Snapshots verschickt werden (Sekunden)
+DASHBOARD_INTERVAL = float(os.getenv("DASHBOARD_INTERVAL", "2"))
+# Beim ersten Abo werden Sessions der letzten N Stunden aus der DB geladen
+DASHBOARD_SEED_HOURS = float(os.getenv("DASHBOARD_SEED_HOURS", "8"))
+# Räume ohne Beobachter werden nach so vielen Sekunden vergessen (nächstes Abo lädt neu)
+DASHBOARD_IDLE_SECONDS = float(os.getenv("DASHBOARD_IDLE_SECONDS", "60"))
+# Obergrenze für gehaltene Räume pro Worker (unbeobachtete fliegen zuerst raus)
+DASHBOARD_MAX_ROOMS = int(os.getenv("DASHBOARD_MAX_ROOMS", "500"))
+
+# Internes Topic: Antwort-Events aller Worker
+DASHBOARD_EVENTS_TOPIC = "_dashboard"
+
+
+def dashboard_topic(room_id: int) -> str:
+    return f"dashboard:{room_id}"
+
+
+class RoomStats:
+    """Laufende Kennzahlen eines Raums"""
+
+    def __init__(self, room_id: int):
+        self.room_id = room_id
+        # puzzle_id -> {"answers": n, "correct": n}
+        self.puzzles: Dict[int, Dict[str, int]] = {}
+        # student_id -> {"name", "score", "answered", "correct", "completed"}
+        self.students: Dict[int, Dict] = {}
+        self.dirty = True
+        self.last_used = time.monotonic()
+        # Events, die während des Vorbefüllens ankommen (None = fertig geladen)
+        self.backlog: Optional[List[Dict]] = []
+        self.loading: Optional[asyncio.Future] = None
+
+    def student(self, student_id: int, name: Optional[str] = None) -> Dict:
+        student = self.students.get(student_id)
+        if student is None:
+            student = {"name": name, "score": 0, "answered": 0, "correct": 0, "completed": False}
+            self.students[student_id] = student
+        elif name:
+            student["name"] = name
+        return student
+
+    def add_answer(self, student_id: int, name: Optional[str], puzzle_id: int, is_correct: bool, points: int):
+        puzzle = self.puzzles.setdefault(puzzle_id, {"answers": 0, "correct": 0})
+        puzzle["answers"] += 1
+        puzzle["correct"] += int(is_correct)
+
+        student = self.student(student_id, name)
+        student["answered"] += 1
+        student["correct"] += int(is_correct)
+        student["score"] += points
+        self.dirty = True
+
+    def snapshot(self) -> Dict:
+        """Kompakter Zustand für das Dashboard"""
+        return {
+            "type": "dashboard",
+            "room_id": self.room_id,
+            "generated_at": datetime.utcnow().isoformat(),
+            "students_active": len(self.students),
+            "students_completed": sum(1 for s in self.students.values() if s["completed"]),
+            "puzzles": [
+                {
+                    "puzzle_id": puzzle_id,
+                    "answers": p["answers"],
+                    "correct": p["correct"],
+                    "correct_rate": round(p["correct"] / p["answers"], 3) if p["answers"] else 0.0
+                }
+                for puzzle_id, p in sorted(self.puzzles.items())
+            ],
+            "students": [
+                {"student_id": student_id, **s}
+                for student_id, s in sorted(self.students.items(), key=lambda item: -item[1]["score"])
+            ]
+        }
+
+
+class DashboardAggregator:
+    """
+    Hält RoomStats für alle Räume, die ein Lehrer gerade beobachtet
+
+    Räume werden beim ersten Abo aus der DB vorbefüllt, danach nur noch
+    über Events aktualisiert (kein Polling pro Schüler). Ohne Beobachter
+    werden sie nach DASHBOARD_IDLE_SECONDS verworfen, damit alte Stunden
+    nicht ewig im Speicher bleiben.
+    """
+
+    def __init__(self):
+        self.rooms: Dict[int, RoomStats] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def apply(self, event: Dict):
+        """Event von der Backplane einspielen (läuft in jedem Worker)"""
+        stats = self.rooms.get(event.get("room_id"))
+        if stats is None:
+            return  # Raum wird gerade von niemandem beobachtet
+        if stats.backlog is not None:
+            stats.backlog.append(event)  # wird nach dem Vorbefüllen eingespielt
+            return
+        self._apply(stats, event)
+
+    @staticmethod
+    def _apply(stats: RoomStats, event: Dict):
+        kind = event.get("type")
+        if kind == "answer":
+            stats.add_answer(
+                event["student_id"], event.get("student_name"),
+                event["puzzle_id"], event["is_correct"], event["points"]
+            )
+        elif kind == "answers":
+            for answer in event["answers"]:
+                stats.add_answer(
+                    event["student_id"], event.get("student_name"),
+                    answer["puzzle_id"], answer["is_correct"], answer["points"]
+                )
+        elif kind == "session_started":
+            stats.student(event["student_id"], event.get("student_name"))
+            stats.dirty = True
+        elif kind == "session_completed":
+            stats.student(event["student_id"])["completed"] = True
+            stats.dirty = True
+
+    async def ensure_room(self, room_id: int) -> RoomStats:
+        """Kennzahlen eines Raums holen, beim ersten Mal aus der DB laden (gleichzeitige Aufrufer warten mit)"""
+        stats = self.rooms.get(room_id)
+        if stats is None:
+            stats = self.rooms[room_id] = RoomStats(room_id)
+            stats.loading = asyncio.ensure_future(self._seed(stats))
+            self._evict()
+
+        await asyncio.shield(stats.loading)
+        stats.last_used = time.monotonic()
+        return stats
+
+    def _evict(self):
+        """Über DASHBOARD_MAX_ROOMS: am längsten unbenutzte Räume ohne Beobachter verwerfen"""
+        if len(self.rooms) <= DASHBOARD_MAX_ROOMS:
+            return
+        idle = sorted(
+            (stats.last_used, room_id) for room_id, stats in self.rooms.items()
+            if stats.backlog is None and not manager.has_subscribers(dashboard_topic(room_id))
+        )
+        for _, room_id in idle[:len(self.rooms) - DASHBOARD_MAX_ROOMS]:
+            del self.rooms[room_id]
+
+    async def _seed(self, stats: RoomStats):
+        """Aktuellen Stand der letzten Stunden aus der DB aggregieren"""
+        room_id = stats.room_id
+        since = datetime.utcnow() - timedelta(hours=DASHBOARD_SEED_HOURS)
+
+        try:
+            async with AsyncSessionLocal() as db:
+                sessions = (await db.execute(
+                    select(models.GameSession.student_id, models.GameSession.status,
+                           models.User.full_name, models.User.username)
+                    .join(models.User, models.User.id == models.GameSession.student_id)
+                    .where(models.GameSession.room_id == room_id, models.GameSession.started_at >= since)
+                )).all()
+
+                rows = (await db.execute(
+                    select(
+                        models.GameSession.student_id,
+                        models.PuzzleResult.puzzle_id,
+                        func.count(models.PuzzleResult.id),
+                        func.sum(case((models.PuzzleResult.is_correct == True, 1), else_=0)),
+                        func.sum(models.PuzzleResult.points_earned)
+                    )
+                    .join(models.GameSession, models.GameSession.id == models.PuzzleResult.session_id)
+                    .where(models.GameSession.room_id == room_id, models.GameSession.started_at >= since)
+                    .group_by(models.GameSession.student_id, models.PuzzleResult.puzzle_id)
+                )).all()
+        except BaseException:
+            if self.rooms.get(room_id) is stats:
+                del self.rooms[room_id]
+            raise
+
+        for student_id, session_status, full_name, username in sessions:
+            student = stats.student(student_id, full_name or username)
+            student["completed"] = student["completed"] or session_status == "completed"
+
+        for student_id, puzzle_id, answers, correct, points in rows:
+            correct = int(correct or 0)
+            puzzle = stats.puzzles.setdefault(puzzle_id, {"answers": 0, "correct": 0})
+            puzzle["answers"] += answers
+            puzzle["correct"] += correct
+
+            student = stats.student(student_id)
+            student["answered"] += answers
+            student["correct"] += correct
+            student["score"] += int(points or 0)
+
+        backlog, stats.backlog = stats.backlog, None
+        for event in backlog:
+            self._apply(stats, event)
+
+    async def start(self):
+        manager.add_listener(DASHBOARD_EVENTS_TOPIC, self.apply)
+        self._task = asyncio.create_task(self._push_snapshots())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _push_snapshots(self):
+        """Geänderte Räume periodisch an ihre Lehrer schicken"""
+        while True:
+            await asyncio.sleep(DASHBOARD_INTERVAL)
+
+            now = time.monotonic()
+            for room_id, stats in list(self.rooms.items()):
+                topic = dashboard_topic(room_id)
+                if stats.backlog is not None:
+                    continue  # wird noch geladen
+                if not manager.has_subscribers(topic):
+                    if now - stats.last_used > DASHBOARD_IDLE_SECONDS:
+                        del self.rooms[room_id]
+                    continue
+                stats.last_used = now
+                if not stats.dirty:
+                    continue
+                stats.dirty = False
+                manager.send_local(topic, stats.snapshot())
+
+
+aggregator = DashboardAggregator()
+
+
+async def publish_dashboard_event(event: Dict):
+    """Event an die Aggregatoren aller Worker schicken"""
+    await manager.publish([DASHBOARD_EVENTS_TOPIC], event)
+
+
+# ==================== TOPIC-ZUGRIFF ====================
+
+async def _teacher_owns_room(user, topic: str) -> bool:
+    """Nur der Lehrer des Raums (oder ein Admin) darf dessen Dashboard abonnieren"""
+    if user is None or user.role not in ("teacher", "admin"):
+        return False
+
+    room_id = int(topic.partition(":")[2])
+    async with AsyncSessionLocal() as db:
+        query = select(models.Room.id).where(models.Room.id == room_id)
+        if user.role != "admin":
+            query = query.where(models.Room.teacher_id == user.id)
+        return (await db.scalar(query)) is not None
+
+
+async def _initial_snapshot(websocket: WebSocket, topic: str) -> Dict:
+    """Neuer Beobachter bekommt sofort den aktuellen Stand"""
+    room_id = int(topic.partition(":")[2])
+    return (await aggregator.ensure_room(room_id)).snapshot()
+
+
+manager.register_topic("dashboard", _teacher_owns_room, _initial_snapshot)
+
+
+# ==================== HTTP ====================
+
+@router.get("/rooms/{room_id}/dashboard")
+async def get_room_dashboard(
+        room_id: int,
+        current_user: models.User = Depends(get_current_teacher),
+        db: AsyncSession = Depends(get_async_db)
+):
+    """Aktueller Dashboard-Snapshot eines Raums (z. B. für das Admin-Panel)"""
+    db_room = await db.scalar(select(models.Room.id).where(
+        models.Room.id == room_id,
+        models.Room.teacher_id == current_user.id
+    ))
+
+    if not db_room:
+        raise HTTPException(status_code=404, detail="Raum nicht gefunden")
+
+    return (await aggregator.ensure_room(room_id)).snapshot()
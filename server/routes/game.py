@@ -2,90 +2,95 @@
 Spiel-Endpunkte für Schüler
 Räume betreten, Rätsel lösen, Fortschritt speichern
 """
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List
 import json
+import logging
+import os
 import sys
 
 sys.path.append('..')
 
-from ..database import get_db
+from ..database import get_async_db, AsyncSessionLocal
 from ..auth import get_current_user
+from ..grading import puzzle_cache
+from ..ingest import write_behind
+from ..room_lists import room_list_cache, audience_for
 from .. import models
-from shared.models import Room, Puzzle, GameSession, PuzzleResult, PuzzleResultCreate, RoomProgress
+from shared.models import (Room, Puzzle, GameSession, PuzzleResult, PuzzleResultCreate, RoomProgress,
+                           AnswerBatchItem, AnswerBatchResponse)
+from .websocket import manager
+from .dashboard import publish_dashboard_event
 
 router = APIRouter(prefix="/api/game", tags=["game"])
+log = logging.getLogger(__name__)
 
+# Maximale Anzahl Antworten pro POST /submit-answers
+MAX_ANSWER_BATCH = int(os.getenv("MAX_ANSWER_BATCH", "500"))
 
-@router.get("/available-rooms", response_model=List[Room])
-async def get_available_rooms(
-        current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    """Verfügbare Räume für User abrufen"""
 
-    print(f" User: {current_user.username}, Role: {current_user.role}, ID: {current_user.id}")
+async def get_own_session(db: AsyncSession, current_user: models.User, session_id: int,
+                          refresh: bool = False) -> models.GameSession:
+    """Session des angemeldeten Schülers laden, sonst 404 (refresh: bereits geladenes Objekt neu lesen)"""
+    session = (await db.scalars(select(models.GameSession).where(
+        models.GameSession.id == session_id,
+        models.GameSession.student_id == current_user.id
+    ).execution_options(populate_existing=refresh))).first()
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+    return session
 
-    # Admin sieht ALLE Räume
-    if current_user.role == "admin":
-        rooms = db.query(models.Room).all()
-        print(f" Admin sieht alle Räume: {len(rooms)} gefunden")
-        return rooms
 
-    # Lehrer sehen alle ihre Räume
-    elif current_user.role == "teacher":
-        rooms = db.query(models.Room).filter(
-            models.Room.teacher_id == current_user.id
-        ).all()
-        print(f"📋 Lehrer sieht eigene Räume: {len(rooms)} gefunden")
-        return rooms
+@router.get("/available-rooms", response_model=List[Room])
+async def get_available_rooms(
+        current_user: models.User = Depends(get_current_user)
+):
+    """
+    Verfügbare Räume für User abrufen
 
-    elif current_user.role == "student":
-        rooms = db.query(models.Room).filter(
-            models.Room.is_active == True
-        ).all()
-        print(f" Schüler sieht ALLE aktiven Räume: {len(rooms)} gefunden")
-        for room in rooms:
-            print(f"   - {room.name} (ID: {room.id})")
-        return rooms
+    Admin sieht alle Räume, Lehrer ihre eigenen, Schüler die aktiven.
+    Die Antwort kommt fertig serialisiert aus dem Cache (server/room_lists.py).
+    """
+    audience = audience_for(current_user)
+    if audience is None:
+        return []
 
-    # Fallback
-    return []
+    body = await room_list_cache.load(audience)
+    log.debug("%s (%s) lädt Raumliste, %d Bytes", current_user.username, audience, len(body))
+    return Response(content=body, media_type="application/json")
 
 
 @router.post("/start-session/{room_id}", response_model=GameSession)
 async def start_game_session(
         room_id: int,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Neue Spiel-Session starten"""
 
-    print(f" Session-Start: User={current_user.username}, Role={current_user.role}, Room={room_id}")
-
     # Raum muss existieren
-    room = db.query(models.Room).filter(models.Room.id == room_id).first()
+    room = await db.get(models.Room, room_id)
     if not room:
-        print(f" Raum {room_id} nicht gefunden")
         raise HTTPException(status_code=404, detail="Raum nicht gefunden")
 
     #  GEÄNDERT: Für Schüler nur prüfen ob Raum aktiv ist (KEINE Zuweisung mehr!)
     if current_user.role == "student":
         if not room.is_active:
-            print(f" Raum {room_id} ist nicht aktiv")
             raise HTTPException(status_code=403, detail="Raum ist nicht aktiv")
-        print(f"Raum ist aktiv, Schüler darf beitreten")
 
     # exestiert Session ?
-    existing_session = db.query(models.GameSession).filter(
+    existing_session = (await db.scalars(select(models.GameSession).where(
         models.GameSession.room_id == room_id,
         models.GameSession.student_id == current_user.id,
         models.GameSession.status == "in_progress"
-    ).first()
+    ).limit(1))).first()
 
     if existing_session:
-        print(f" Bestehende Session gefunden: {existing_session.id}")
+        log.debug("Session-Start: %s setzt Session %d fort", current_user.username, existing_session.id)
         return existing_session
 
     # Neue Session erstellen
@@ -94,10 +99,18 @@ async def start_game_session(
         student_id=current_user.id
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
-
-    print(f" Neue Session erstellt: ID={session.id}")
+    await db.commit()
+    await db.refresh(session)
+
+    log.debug("Session-Start: %s, Raum %d, neue Session %d", current_user.username, room_id, session.id)
+
+    await publish_dashboard_event({
+        "type": "session_started",
+        "room_id": room_id,
+        "session_id": session.id,
+        "student_id": current_user.id,
+        "student_name": current_user.full_name or current_user.username
+    })
     return session
 
 
@@ -105,25 +118,19 @@ async def start_game_session(
 async def get_session_puzzles(
         session_id: int,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Rätsel für eine Session abrufen"""
 
     # Session prüfen
-    session = db.query(models.GameSession).filter(
-        models.GameSession.id == session_id,
-        models.GameSession.student_id == current_user.id
-    ).first()
-
-    if not session:
-        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+    session = await get_own_session(db, current_user, session_id)
 
     # Rätsel laden
-    puzzles = db.query(models.Puzzle).filter(
+    puzzles = (await db.scalars(select(models.Puzzle).where(
         models.Puzzle.room_id == session.room_id
-    ).order_by(models.Puzzle.order_index).all()
+    ).order_by(models.Puzzle.order_index))).all()
 
-    print(f"{len(puzzles)} Rätsel für Session {session_id} geladen")
+    log.debug("%d Rätsel für Session %d geladen", len(puzzles), session_id)
     return puzzles
 
 
@@ -131,46 +138,60 @@ async def get_session_puzzles(
 async def submit_answer(
         result: PuzzleResultCreate,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Antwort einreichen und bewerten"""
+    return await store_answer(db, current_user, result)
 
-    # Session prüfen
-    session = db.query(models.GameSession).filter(
-        models.GameSession.id == result.session_id,
-        models.GameSession.student_id == current_user.id
-    ).first()
 
-    if not session:
-        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+async def find_stored_answer(db: AsyncSession, result: PuzzleResultCreate):
+    """Bereits gespeichertes Ergebnis mit demselben idempotency_key (oder None)"""
+    if not result.idempotency_key:
+        return None
+    return (await db.scalars(select(models.PuzzleResult).where(
+        models.PuzzleResult.session_id == result.session_id,
+        models.PuzzleResult.puzzle_id == result.puzzle_id,
+        models.PuzzleResult.idempotency_key == result.idempotency_key
+    ))).first()
 
-    # Rätsel laden
-    puzzle = db.query(models.Puzzle).filter(
-        models.Puzzle.id == result.puzzle_id
-    ).first()
 
-    if not puzzle:
-        raise HTTPException(status_code=404, detail="Rätsel nicht gefunden")
+def answer_response(db_result: models.PuzzleResult) -> models.PuzzleResult:
+    """answer_json für die Antwort wieder als dict"""
+    try:
+        db_result.answer_json = json.loads(db_result.answer_json) if db_result.answer_json else {}
+    except Exception:
+        db_result.answer_json = {}
+    return db_result
 
-    # Antwort bewerten
-    is_correct = False
-    points_earned = 0
 
-    # H5P-JSON parsen
-    h5p_data = json.loads(puzzle.h5p_json) if puzzle.h5p_json else {}
+async def store_answer(db: AsyncSession, current_user: models.User, result: PuzzleResultCreate) -> models.PuzzleResult:
+    """
+    Antwort bewerten und speichern (HTTP und WebSocket-RPC)
+
+    Mit idempotency_key liefert eine Wiederholung das gespeicherte Ergebnis,
+    ohne neu zu bewerten oder Punkte doppelt zu zählen.
+    """
+
+    if write_behind.enabled:
+        return await queue_answer(db, current_user, result)
+
+    # Session prüfen (auch bei Wiederholungen: nur eigene Ergebnisse)
+    session = await get_own_session(db, current_user, result.session_id)
 
-    # Multiple-Choice-Bewertung (unterstützt verschiedene Formate)
-    if puzzle.puzzle_type in ["multiple_choice", "h5p_multichoice"]:
-        # Verschiedene JSON-Formate unterstützen
-        correct_index = h5p_data.get("correct", h5p_data.get("correct_index", -1))
-        user_answer = result.answer_json.get("selected", -1)
+    stored = await find_stored_answer(db, result)
+    if stored:
+        return answer_response(stored)
 
-        is_correct = (int(correct_index) == int(user_answer))
+    # Lösungsschlüssel (Cache, nur beim ersten Mal aus der DB)
+    key = await puzzle_cache.load(db, result.puzzle_id)
 
-        if is_correct:
-            points_earned = puzzle.points
+    if not key:
+        raise HTTPException(status_code=404, detail="Rätsel nicht gefunden")
+
+    # Antwort bewerten
+    is_correct, points_earned = key.grade(result.answer_json)
 
-    print(f"Antwort: Puzzle={puzzle.id}, Korrekt={is_correct}, Punkte={points_earned}")
+    log.debug("Antwort: Puzzle=%d, Korrekt=%s, Punkte=%d", key.puzzle_id, is_correct, points_earned)
 
     # Ergebnis speichern
     db_result = models.PuzzleResult(
@@ -179,59 +200,295 @@ async def submit_answer(
         answer_json=json.dumps(result.answer_json),
         is_correct=is_correct,
         points_earned=points_earned,
-        time_taken_seconds=result.time_taken_seconds
+        time_taken_seconds=result.time_taken_seconds,
+        idempotency_key=result.idempotency_key
     )
 
     db.add(db_result)
 
-    # Session-Score aktualisieren
-    session.total_score += points_earned
+    # Score und Zähler atomar in SQL erhöhen: parallele Antworten überschreiben sich nicht
+    session.total_score = models.GameSession.total_score + points_earned
+    session.answered_count = models.GameSession.answered_count + 1
 
-    db.commit()
-    db.refresh(db_result)
-
-    # FIX: answer_json wieder als dict ausgeben
     try:
-        db_result.answer_json = json.loads(db_result.answer_json) if db_result.answer_json else {}
-    except Exception:
-        db_result.answer_json = {}
+        await db.commit()
+    except IntegrityError:
+        # Gleiche Antwort parallel eingereicht: die andere Anfrage hat gewonnen
+        await db.rollback()
+        stored = await find_stored_answer(db, result)
+        if stored is None:
+            raise
+        return answer_response(stored)
+
+    await db.refresh(db_result)
+
+    # Live-Dashboard des Lehrers aktualisieren
+    await publish_dashboard_event({
+        "type": "answer",
+        "room_id": session.room_id,
+        "session_id": session.id,
+        "student_id": current_user.id,
+        "student_name": current_user.full_name or current_user.username,
+        "puzzle_id": key.puzzle_id,
+        "is_correct": is_correct,
+        "points": points_earned
+    })
+
+    return answer_response(db_result)
+
+
+async def queue_answer(db: AsyncSession, current_user: models.User, result: PuzzleResultCreate) -> PuzzleResult:
+    """
+    Write-behind: bewerten, ins Journal schreiben, sofort bestätigen
+
+    Session-Besitzer und Lösungsschlüssel kommen aus Caches, geschrieben
+    wird im Hintergrund (siehe server/ingest.py). Wiederholungen liefern den
+    gepufferten Eintrag oder, nach dem Flush, die gespeicherte Zeile; sie
+    werden nie neu bewertet oder noch einmal ans Dashboard gemeldet.
+    """
+    owner = await write_behind.session_owner(db, result.session_id)
+    if owner is None or owner[0] != current_user.id:
+        raise HTTPException(status_code=404, detail="Session nicht gefunden")
 
-    return db_result
+    key = await puzzle_cache.load(db, result.puzzle_id)
+
+    while True:
+        record = write_behind.pending_answer(result.session_id, result.puzzle_id, result.idempotency_key)
+        if record is not None:
+            break  # Wiederholung vor dem Flush
+
+        if result.idempotency_key:
+            generation = await write_behind.stable_generation()
+            stored = await find_stored_answer(db, result)
+            if stored:
+                return answer_response(stored)
+            if generation != write_behind.flush_generation:
+                continue  # Flush lief während der Abfrage: neu prüfen
+            record = write_behind.pending_answer(result.session_id, result.puzzle_id, result.idempotency_key)
+            if record is not None:
+                break  # parallele Wiederholung war schneller
+
+        # Ab hier kein await bis submit: Prüfung und Einreihen sind atomar
+        if not key:
+            raise HTTPException(status_code=404, detail="Rätsel nicht gefunden")
+
+        is_correct, points_earned = key.grade(result.answer_json)
+        record = write_behind.submit(
+            result.session_id, result.puzzle_id, result.answer_json, is_correct, points_earned,
+            result.time_taken_seconds, result.idempotency_key
+        )
+
+        await publish_dashboard_event({
+            "type": "answer",
+            "room_id": owner[1],
+            "session_id": result.session_id,
+            "student_id": current_user.id,
+            "student_name": current_user.full_name or current_user.username,
+            "puzzle_id": result.puzzle_id,
+            "is_correct": is_correct,
+            "points": points_earned
+        })
+        break
+
+    return PuzzleResult(
+        session_id=record["session_id"],
+        puzzle_id=record["puzzle_id"],
+        answer_json=json.loads(record["answer_json"]),
+        time_taken_seconds=record["time_taken_seconds"],
+        idempotency_key=record["idempotency_key"],
+        is_correct=record["is_correct"],
+        points_earned=record["points_earned"],
+        answered_at=record["answered_at"]
+    )
+
+
+@router.post("/submit-answers", response_model=AnswerBatchResponse)
+async def submit_answers(
+        results: List[PuzzleResultCreate],
+        current_user: models.User = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
+):
+    """Mehrere Antworten auf einmal einreichen (z. B. nach Verbindungsabbruch)"""
+    return await store_answers(db, current_user, results)
+
+
+async def store_answers(db: AsyncSession, current_user: models.User,
+                        results: List[PuzzleResultCreate], retry: bool = True) -> AnswerBatchResponse:
+    """
+    Antworten gesammelt bewerten und speichern (HTTP und WebSocket-RPC)
+
+    Eine Abfrage für die Sessions, Lösungsschlüssel aus dem Cache, ein
+    INSERT für alle Ergebnisse, ein UPDATE pro Session, ein Commit.
+    Fehlerhafte Einträge werden übersprungen und einzeln gemeldet,
+    bereits gespeicherte (gleicher idempotency_key) als replayed.
+    Im Write-behind-Modus landen neue Antworten im Puffer statt in der DB,
+    gepufferte Wiederholungen gelten ebenfalls als replayed.
+    """
+    if len(results) > MAX_ANSWER_BATCH:
+        raise HTTPException(status_code=413, detail=f"Maximal {MAX_ANSWER_BATCH} Antworten pro Anfrage")
+
+    session_ids = {result.session_id for result in results}
+    sessions = {session.id: session for session in (await db.scalars(select(models.GameSession).where(
+        models.GameSession.id.in_(session_ids),
+        models.GameSession.student_id == current_user.id
+    )))} if session_ids else {}
+    keys = await puzzle_cache.load_many(db, {result.puzzle_id for result in results})
+
+    # Früher gespeicherte Antworten: (session_id, puzzle_id, idempotency_key) -> (korrekt, Punkte)
+    idempotency_keys = {result.idempotency_key for result in results if result.idempotency_key}
+    while True:
+        generation = await write_behind.stable_generation() if write_behind.enabled else None
+        stored: Dict[tuple, tuple] = {}
+        if sessions and idempotency_keys:
+            for row in await db.scalars(select(models.PuzzleResult).where(
+                models.PuzzleResult.session_id.in_(sessions),
+                models.PuzzleResult.idempotency_key.in_(idempotency_keys)
+            )):
+                stored[(row.session_id, row.puzzle_id, row.idempotency_key)] = (row.is_correct, row.points_earned)
+        # Write-behind: kein Flush während der Abfrage, sonst fehlen Antworten in DB und Puffer
+        if generation is None or generation == write_behind.flush_generation:
+            break
+
+    # Ab hier bis zum Einreihen kein await (Write-behind: Prüfung und submit atomar)
+    items: List[AnswerBatchItem] = []
+    rows: List[Dict] = []
+    # session_id -> [Punkte, Anzahl]
+    totals: Dict[int, List[int]] = {}
+
+    for index, result in enumerate(results):
+        item = AnswerBatchItem(index=index, status=200, session_id=result.session_id, puzzle_id=result.puzzle_id)
+        items.append(item)
+
+        key = keys.get(result.puzzle_id)
+        if result.session_id not in sessions:
+            item.status, item.detail = 404, "Session nicht gefunden"
+            continue
+
+        # Wiederholung (auch doppelt im selben Batch): gespeichertes Ergebnis, keine Punkte
+        replay_key = (result.session_id, result.puzzle_id, result.idempotency_key)
+        if result.idempotency_key and replay_key in stored:
+            item.is_correct, item.points_earned = stored[replay_key]
+            item.replayed = True
+            continue
+        pending = write_behind.pending_answer(*replay_key) if write_behind.enabled else None
+        if pending is not None:
+            item.is_correct, item.points_earned = pending["is_correct"], pending["points_earned"]
+            item.replayed = True
+            continue
+
+        if key is None:
+            item.status, item.detail = 404, "Rätsel nicht gefunden"
+            continue
+
+        try:
+            item.is_correct, item.points_earned = key.grade(result.answer_json)
+        except (TypeError, ValueError) as e:
+            item.status, item.detail = 422, f"Ungültige Antwort: {e}"
+            continue
+
+        if write_behind.enabled:
+            write_behind.submit(
+                result.session_id, result.puzzle_id, result.answer_json, item.is_correct, item.points_earned,
+                result.time_taken_seconds, result.idempotency_key
+            )
+            continue
+
+        rows.append({
+            "session_id": result.session_id,
+            "puzzle_id": result.puzzle_id,
+            "answer_json": json.dumps(result.answer_json),
+            "is_correct": item.is_correct,
+            "points_earned": item.points_earned,
+            "time_taken_seconds": result.time_taken_seconds,
+            "idempotency_key": result.idempotency_key
+        })
+        if result.idempotency_key:
+            stored[replay_key] = (item.is_correct, item.points_earned)
+        session_total = totals.setdefault(result.session_id, [0, 0])
+        session_total[0] += item.points_earned
+        session_total[1] += 1
+
+    if rows:
+        await db.execute(insert(models.PuzzleResult), rows)
+        for session_id, (points, count) in totals.items():
+            await db.execute(update(models.GameSession).where(models.GameSession.id == session_id).values(
+                total_score=models.GameSession.total_score + points,
+                answered_count=models.GameSession.answered_count + count
+            ))
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Parallel mit gleichen Schlüsseln eingereicht: neu laden, jetzt als Wiederholungen
+            await db.rollback()
+            if not retry:
+                raise
+            return await store_answers(db, current_user, results, retry=False)
+
+    # Live-Dashboard: ein Event pro Raum statt pro Antwort
+    accepted = [item for item in items if item.status == 200]
+    new_items = [item for item in accepted if not item.replayed]
+    by_room: Dict[int, List[Dict]] = {}
+    for item in new_items:
+        by_room.setdefault(sessions[item.session_id].room_id, []).append(
+            {"puzzle_id": item.puzzle_id, "is_correct": item.is_correct, "points": item.points_earned}
+        )
+    for room_id, answers in by_room.items():
+        await publish_dashboard_event({
+            "type": "answers",
+            "room_id": room_id,
+            "student_id": current_user.id,
+            "student_name": current_user.full_name or current_user.username,
+            "answers": answers
+        })
+
+    log.debug("Sammel-Antwort von %s: %d gespeichert, %d abgelehnt",
+              current_user.username, len(accepted), len(items) - len(accepted))
+
+    return AnswerBatchResponse(
+        accepted=len(accepted),
+        rejected=len(items) - len(accepted),
+        points_earned=sum(item.points_earned for item in new_items),
+        results=items
+    )
 
 
 @router.get("/session/{session_id}/progress", response_model=RoomProgress)
 async def get_session_progress(
         session_id: int,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Fortschritt einer Session abrufen"""
+    return await load_progress(db, current_user, session_id)
 
-    # Session prüfen
-    session = db.query(models.GameSession).filter(
-        models.GameSession.id == session_id,
-        models.GameSession.student_id == current_user.id
-    ).first()
 
-    if not session:
-        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+async def load_progress(db: AsyncSession, current_user: models.User, session_id: int) -> RoomProgress:
+    """Fortschritt berechnen (HTTP und WebSocket-RPC), inkl. noch gepufferter Antworten"""
 
-    # Anzahl gelöster Rätsel
-    completed_count = db.query(models.PuzzleResult).filter(
-        models.PuzzleResult.session_id == session_id
-    ).count()
+    async def read():
+        # Session und Rätsel-Anzahl des Raums: ein Zugriff über Primärschlüssel (Zähler statt COUNT)
+        return (await db.execute(
+            select(models.GameSession, models.Room.puzzle_count)
+            .join(models.Room, models.Room.id == models.GameSession.room_id)
+            .where(models.GameSession.id == session_id, models.GameSession.student_id == current_user.id)
+            .execution_options(populate_existing=True)
+        )).first()
 
-    # Gesamt-Rätsel im Raum
-    total_count = db.query(models.Puzzle).filter(
-        models.Puzzle.room_id == session.room_id
-    ).count()
+    if write_behind.enabled:
+        row, (pending_points, pending_count) = await write_behind.read_consistent(session_id, read)
+    else:
+        row, pending_points, pending_count = await read(), 0, 0
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+    session, total_count = row
 
     return RoomProgress(
         room_id=session.room_id,
         student_id=session.student_id,
-        completed_puzzles=completed_count,
+        completed_puzzles=session.answered_count + pending_count,
         total_puzzles=total_count,
-        current_score=session.total_score,
+        current_score=session.total_score + pending_points,
         status=session.status
     )
 
@@ -240,24 +497,77 @@ async def get_session_progress(
 async def complete_session(
         session_id: int,
         current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
     """Session als abgeschlossen markieren"""
-    from datetime import datetime
+    return await mark_completed(db, current_user, session_id)
 
-    session = db.query(models.GameSession).filter(
-        models.GameSession.id == session_id,
-        models.GameSession.student_id == current_user.id
-    ).first()
 
-    if not session:
-        raise HTTPException(status_code=404, detail="Session nicht gefunden")
+async def mark_completed(db: AsyncSession, current_user: models.User, session_id: int) -> dict:
+    """
+    Session abschließen (HTTP und WebSocket-RPC)
+
+    Im Write-behind-Modus werden gepufferte Antworten vorher gespeichert,
+    sonst fehlt die letzte Antwort der Runde im Endstand.
+    """
+    from datetime import datetime
+
+    if write_behind.enabled:
+        await write_behind.flush()
+        # Falls der Flush fehlgeschlagen ist (oder gerade Antworten nachkommen): Puffer mitzählen
+        session, (pending_points, _) = await write_behind.read_consistent(
+            session_id, lambda: get_own_session(db, current_user, session_id, refresh=True)
+        )
+    else:
+        session, pending_points = await get_own_session(db, current_user, session_id), 0
+    total_score = session.total_score + pending_points
 
     session.status = "completed"
     session.completed_at = datetime.utcnow()
 
-    db.commit()
+    await db.commit()
+
+    log.info("Session %d abgeschlossen: %d Punkte", session_id, total_score)
+
+    await publish_dashboard_event({
+        "type": "session_completed",
+        "room_id": session.room_id,
+        "session_id": session.id,
+        "student_id": current_user.id,
+        "total_score": total_score
+    })
+
+    return {"message": "Session abgeschlossen", "total_score": total_score}
+
+
+# ==================== WEBSOCKET-RPC ====================
+# Gleiche Logik wie die HTTP-Routen, aber über den bestehenden /ws/rooms-Socket
+# (kein TCP-Aufbau, kein JWT-Decode und kein User-Lookup pro Antwort)
+
+async def rpc_submit_answer(current_user: models.User, params: dict):
+    async with AsyncSessionLocal() as db:
+        db_result = await store_answer(db, current_user, PuzzleResultCreate(**params))
+        return PuzzleResult.model_validate(db_result).model_dump(mode="json")
+
+
+async def rpc_submit_answers(current_user: models.User, params: dict):
+    async with AsyncSessionLocal() as db:
+        answers = [PuzzleResultCreate(**answer) for answer in params["answers"]]
+        return (await store_answers(db, current_user, answers)).model_dump(mode="json")
+
+
+async def rpc_progress(current_user: models.User, params: dict):
+    async with AsyncSessionLocal() as db:
+        progress = await load_progress(db, current_user, int(params["session_id"]))
+        return progress.model_dump(mode="json")
+
+
+async def rpc_complete(current_user: models.User, params: dict):
+    async with AsyncSessionLocal() as db:
+        return await mark_completed(db, current_user, int(params["session_id"]))
 
-    print(f"Session {session_id} abgeschlossen: {session.total_score} Punkte")
 
-    return {"message": "Session abgeschlossen", "total_score": session.total_score}
+manager.register_rpc("submit-answer", rpc_submit_answer)
+manager.register_rpc("submit-answers", rpc_submit_answers)
+manager.register_rpc("progress", rpc_progress)
+manager.register_rpc("complete", rpc_complete)
@@ -6,6 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
 from sqlalchemy.orm import Session
 from pathlib import Path
 import json
+import logging
 import zipfile
 import shutil
 import uuid
@@ -14,8 +15,18 @@ from typing import Optional
 from server.database import get_db
 from server import models
 from server.auth import get_current_user
+from server.routes.websocket import manager, room_topics, rooms_updated_event
+from server.routes.admin import invalidate_puzzles
+from server.metrics import Histogram
+
+# Größe hochgeladener H5P-Pakete (Bytes, 100 KB .. 200 MB)
+H5P_UPLOAD_BYTES = Histogram(
+    "h5p_upload_bytes", "Größe hochgeladener H5P-Dateien",
+    buckets=(1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2e8)
+)
 
 router = APIRouter(prefix="/api/admin/h5p", tags=["h5p"])
+log = logging.getLogger(__name__)
 
 # Absoluter Pfad, einfacher fürs hochladen
 SCRIPT_DIR = Path(__file__).resolve().parent.parent  # server/routes/h5p.py -> server/
@@ -68,10 +79,7 @@ async def upload_h5p(
     content_id = str(uuid.uuid4())
     content_path = H5P_CONTENT_DIR / content_id
 
-    print(f" H5P Upload gestartet:")
-    print(f"   Datei: {file.filename}")
-    print(f"   Content ID: {content_id}")
-    print(f"   Ziel-Pfad: {content_path.absolute()}")
+    log.debug("H5P-Upload gestartet: %s -> %s", file.filename, content_path.absolute())
 
     try:
         # Verzeichnis erstellen
@@ -83,23 +91,22 @@ async def upload_h5p(
             content = await file.read()
             buffer.write(content)
 
-        print(f"   ✅ Datei gespeichert: {temp_h5p.absolute()}")
-        print(f"   Größe: {len(content)} bytes")
+        log.debug("H5P-Datei gespeichert: %s (%d bytes)", temp_h5p.absolute(), len(content))
+        H5P_UPLOAD_BYTES.observe(len(content))
 
         # .h5p entpacken (ist ein ZIP)
         with zipfile.ZipFile(temp_h5p, 'r') as zip_ref:
             zip_ref.extractall(content_path)
 
-        print(f"   ✅ Entpackt nach: {content_path.absolute()}")
 
         # Temp-Datei löschen
         temp_h5p.unlink()
 
-        # Entpackte Dateien auflisten (Debug)
-        extracted_files = list(content_path.rglob('*'))
-        print(f" Entpackte Dateien ({len(extracted_files)}):")
-        for f in extracted_files[:10]:  # Nur erste 10 zeigen
-            print(f"      - {f.relative_to(content_path)}")
+        # Entpackte Dateien auflisten (Debug, nur erste 10)
+        if log.isEnabledFor(logging.DEBUG):
+            extracted_files = list(content_path.rglob('*'))
+            log.debug("Entpackt nach %s: %d Dateien, u. a. %s", content_path.absolute(), len(extracted_files),
+                      [str(f.relative_to(content_path)) for f in extracted_files[:10]])
 
         # h5p.json lesen für Metadaten
         h5p_json_path = content_path / "h5p.json"
@@ -112,8 +119,6 @@ async def upload_h5p(
         with open(h5p_json_path, 'r', encoding='utf-8') as f:
             h5p_metadata = json.load(f)
 
-        print(f"h5p.json gelesen: {h5p_metadata.get('title', 'Unbenannt')}")
-
         # content.json lesen für die eigentlichen Inhalte
         content_json_path = content_path / "content" / "content.json"
         if not content_json_path.exists():
@@ -148,15 +153,25 @@ async def upload_h5p(
             puzzle_type=puzzle_type,
             points=10,
             time_limit_seconds=300,
-            order_index=len(room.puzzles)
+            order_index=room.puzzle_count  # Position am Ende
         )
 
         db.add(puzzle)
+        room.puzzle_count = models.Room.puzzle_count + 1
         db.commit()
         db.refresh(puzzle)
+        await invalidate_puzzles([puzzle.id])
 
-        print(f" Puzzle erstellt: ID={puzzle.id}, Typ={puzzle_type}")
-        print(f" Upload abgeschlossen!\n")
+        log.info("H5P-Rätsel erstellt: ID=%d, Typ=%s, Raum=%d, %d bytes", puzzle.id, puzzle_type, room_id, len(content))
+
+        # Broadcast darf den fertigen Upload nicht mehr kaputt machen
+        try:
+            await manager.publish(
+                room_topics(room.id, room.teacher_id, room.is_active),
+                rooms_updated_event("puzzle_added", room.id, room=room, puzzle=puzzle)
+            )
+        except Exception as e:
+            log.warning("Broadcast nach H5P-Upload fehlgeschlagen: %s", e)
 
         return {
             "success": True,
@@ -188,7 +203,7 @@ async def upload_h5p(
         # Cleanup bei Fehler
         if content_path.exists():
             shutil.rmtree(content_path)
-        print(f"   Fehler: {str(e)}")
+        log.warning("H5P-Upload fehlgeschlagen: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Fehler beim Verarbeiten der H5P-Datei: {str(e)}"
@@ -269,11 +284,19 @@ async def delete_h5p_content(
         content_path = H5P_CONTENT_DIR / puzzle.h5p_content_id
         if content_path.exists():
             shutil.rmtree(content_path)
-            print(f" H5P Content gelöscht: {content_path.absolute()}")
+            log.info("H5P-Content gelöscht: %s", content_path.absolute())
 
     # Puzzle aus DB löschen
+    room = puzzle.room
     db.delete(puzzle)
+    room.puzzle_count = models.Room.puzzle_count - 1
     db.commit()
+    await invalidate_puzzles([puzzle_id])
+
+    await manager.publish(
+        room_topics(room.id, room.teacher_id, room.is_active),
+        rooms_updated_event("puzzle_deleted", room.id, room=room, puzzle_id=puzzle_id)
+    )
 
     return {"success": True, "message": "H5P-Content gelöscht"}
 
@@ -1,9 +1,202 @@
 # server/routes/websocket.py
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List, Dict
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException
+from pydantic import ValidationError
+from typing import List, Dict, Set, Iterable, Optional, Any, Callable, Awaitable, Union
+import asyncio
+import inspect
 import json
+import logging
+import os
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from sqlalchemy import select
+
+from shared.models import Room, Puzzle
+from ..database import AsyncSessionLocal
+from .. import models
+from ..backplane import Backplane, InProcessBackplane, create_backplane
+from ..presence import PresenceIndex, PRESENCE_TOPIC, WORKER_ID, presence_entry
+from ..auth import get_user_by_token, invalidate_user, token_expiry, UserPrincipal, AUTH_TOPIC
+from ..grading import puzzle_cache, PUZZLE_TOPIC
+from ..room_lists import room_list_cache
+from ..metrics import Counter, Gauge, Histogram
 
 router = APIRouter()
+log = logging.getLogger(__name__)
+
+# Maximale Wartezeit für ein einzelnes Senden (Sekunden)
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Maximale Anzahl wartender Nachrichten pro Verbindung
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+# Zeitfenster, in dem Events zum selben Raum zusammengefasst werden (0 = aus)
+WS_COALESCE_MS = int(os.getenv("WS_COALESCE_MS", "150"))
+# Verteilung an andere Worker-Prozesse (siehe server/backplane.py)
+WS_BACKPLANE = os.getenv("WS_BACKPLANE", "memory")
+# Heartbeat: nach WS_PING_INTERVAL Sekunden Stille pingt der Server,
+# nach WS_IDLE_TIMEOUT Sekunden ohne Lebenszeichen wird die Verbindung getrennt
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+# RPC pro Verbindung: so viele laufen gleichzeitig (je eine DB-Session), so viele dürfen insgesamt offen sein
+WS_RPC_CONCURRENCY = int(os.getenv("WS_RPC_CONCURRENCY", "4"))
+WS_RPC_MAX_PENDING = int(os.getenv("WS_RPC_MAX_PENDING", "64"))
+
+WS_CONNECTIONS = Gauge("ws_connections", "Offene WebSocket-Verbindungen dieses Workers")
+WS_BROADCAST_SECONDS = Histogram(
+    "ws_broadcast_duration_seconds", "Verteilen eines Events an die eigenen Sockets (kodieren + einreihen)",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+WS_BROADCAST_RECIPIENTS = Histogram(
+    "ws_broadcast_recipients", "Empfänger pro Event",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+WS_EVICTIONS = Counter("ws_evictions", "Wegen Timeout/voller Queue getrennte Verbindungen", ["reason"])
+
+# Topics, die Clients abonnieren können
+ACTIVE_ROOMS_TOPIC = "active-rooms"
+# Clients ohne eigenes Abo (alte Clients) bekommen alle öffentlichen Events (aktive Räume).
+# Wird beim Verbinden gesetzt, nie per "subscribe" vom Client.
+WILDCARD_TOPIC = "*"
+# Internes Topic: jedes rooms_updated-Event (für Listener wie den Raumlisten-Cache)
+ROOM_EVENTS_TOPIC = "_rooms"
+# Topics mit diesem Präfix sind server-intern (nur Listener, nie an Sockets)
+INTERNAL_PREFIX = "_"
+
+
+# Ausgehandeltes Nachrichtenformat (Sec-WebSocket-Protocol).
+# Ohne Subprotokoll (z. B. Browser-Admin-Panel) bleibt es bei JSON-Text.
+JSON_SUBPROTOCOL = "multiboard.json"
+MSGPACK_SUBPROTOCOL = "multiboard.msgpack"
+
+# Fertig kodierte Nachricht: str = Text-Frame (JSON), bytes = Binär-Frame (MessagePack)
+Frame = Union[str, bytes]
+
+# RPC-Handler: (user, params) -> JSON-fähiges Ergebnis
+RpcHandler = Callable[[Any, Dict], Awaitable[Any]]
+# Listener für interne Events: (message) -> None
+Listener = Callable[[Dict], None]
+# Zugriffsprüfung für ein Topic: (user oder None, topic) -> erlaubt? (auch async)
+TopicGuard = Callable[[Any, str], Union[bool, Awaitable[bool]]]
+
+
+def room_topic(room_id: int) -> str:
+    return f"room:{room_id}"
+
+
+def teacher_topic(teacher_id: int) -> str:
+    return f"teacher:{teacher_id}"
+
+
+def room_topics(room_id: int, teacher_id: int, is_active: bool = False) -> List[str]:
+    """Alle Topics, die sich für Änderungen an einem Raum interessieren"""
+    topics = [room_topic(room_id), teacher_topic(teacher_id)]
+    if is_active:
+        topics.append(ACTIVE_ROOMS_TOPIC)
+    return topics
+
+
+def rooms_updated_event(action: str, room_id: int, room: Optional[Any] = None,
+                        puzzle: Optional[Any] = None, **extra) -> Dict:
+    """
+    rooms_updated-Event mit vollständigem Delta bauen
+
+    room/puzzle sind ORM-Objekte (oder None, z. B. nach dem Löschen).
+    Clients patchen damit ihre Raumliste, statt alles neu zu laden.
+    """
+    event = {
+        "type": "rooms_updated",
+        "action": action,
+        "room_id": room_id,
+        "room": Room.model_validate(room).model_dump(mode="json") if room is not None else None,
+    }
+    if puzzle is not None:
+        # Ohne h5p_json: darin steht die richtige Antwort, Events gehen auch an nicht angemeldete Boards
+        event["puzzle"] = Puzzle.model_validate(puzzle).model_dump(mode="json", exclude={"h5p_json"})
+    event.update(extra)
+    return event
+
+
+def merge_room_events(older: Dict, newer: Dict) -> Dict:
+    """
+    Zwei rooms_updated-Events zum selben Raum zusammenfassen
+
+    Der neueste Raum-Zustand gewinnt, Aktionen und Rätsel-Deltas
+    werden gesammelt.
+    """
+    merged = {k: v for k, v in newer.items() if k not in ("puzzle", "puzzle_id")}
+    merged["actions"] = older.get("actions", [older.get("action")]) + [newer.get("action")]
+
+    puzzles = {p["id"]: p for p in older.get("puzzles", [])}
+    deleted = list(older.get("deleted_puzzle_ids", []))
+    for event in (older, newer):
+        if event.get("puzzle"):
+            puzzles[event["puzzle"]["id"]] = event["puzzle"]
+        if event.get("action") == "puzzle_deleted" and event.get("puzzle_id") is not None:
+            puzzles.pop(event["puzzle_id"], None)
+            deleted.append(event["puzzle_id"])
+
+    if puzzles:
+        merged["puzzles"] = list(puzzles.values())
+    if deleted:
+        merged["deleted_puzzle_ids"] = deleted
+    return merged
+
+
+def encode_frame(message: Dict, binary: bool) -> Frame:
+    """Nachricht einmal kodieren, damit sie an viele Sockets gehen kann"""
+    if binary:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_frame(frame: Frame) -> Any:
+    """Eingehende Nachricht dekodieren (Text = JSON, Binär = MessagePack)"""
+    if isinstance(frame, bytes):
+        if msgpack is None:
+            raise ValueError("MessagePack nicht verfügbar")
+        return msgpack.unpackb(frame, raw=False)
+    return json.loads(frame)
+
+
+def is_valid_topic(topic: str) -> bool:
+    """Nur bekannte Topic-Formate zulassen"""
+    if topic in (ACTIVE_ROOMS_TOPIC, WILDCARD_TOPIC):
+        return True
+
+    prefix, _, ident = topic.partition(":")
+    return prefix in ("room", "teacher") and ident.isdigit()
+
+
+async def may_watch(user, topic: str) -> bool:
+    """
+    Zugriff auf ein gültiges Standard-Topic
+
+    teacher:<id> nur für diesen Lehrer, room:<id> für aktive Räume oder
+    den Lehrer des Raums. Admins dürfen alles, active-rooms jeder.
+    "*" setzt nur der Server beim Verbinden.
+    """
+    if topic == WILDCARD_TOPIC:
+        return False
+    if topic == ACTIVE_ROOMS_TOPIC:
+        return True
+    if user is not None and user.role == "admin":
+        return True
+
+    prefix, _, ident = topic.partition(":")
+    if prefix == "teacher":
+        return user is not None and user.id == int(ident)
+
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(models.Room.teacher_id, models.Room.is_active).where(models.Room.id == int(ident))
+        )).first()
+    if row is None:
+        return False
+    return bool(row.is_active) or (user is not None and user.id == row.teacher_id)
 
 
 class ConnectionManager:
@@ -12,38 +205,656 @@ class ConnectionManager:
     def __init__(self):
         # Liste aller aktiven WebSocket-Verbindungen
         self.active_connections: List[WebSocket] = []
+        # Pro Verbindung: Sende-Queue + Sender-Task
+        self._queues: Dict[WebSocket, asyncio.Queue] = {}
+        self._senders: Dict[WebSocket, asyncio.Task] = {}
+        # Verbindungen mit MessagePack-Framing (alle anderen: JSON-Text)
+        self._binary: Set[WebSocket] = set()
+        # Topic -> Abonnenten und Verbindung -> Topics
+        self.subscriptions: Dict[str, Set[WebSocket]] = {}
+        self._topics_of: Dict[WebSocket, Set[str]] = {}
+        # Versionszähler pro Topic (Clients erkennen damit Lücken)
+        self._versions: Dict[str, int] = {}
+        # Zählerreihe der Backplane, zu der _versions gehört (siehe backplane.new_epoch)
+        self.epoch: Optional[str] = None
+        # Noch nicht gesendete, zusammengefasste Events (Schlüssel -> Topics + Nachricht)
+        self._pending: Dict[str, Dict] = {}
+        # Verteilt Events an alle Worker (Standard: nur dieser Prozess)
+        self.backplane: Backplane = InProcessBackplane()
+        # Letztes Lebenszeichen pro Verbindung (time.monotonic)
+        self._last_seen: Dict[WebSocket, float] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # Fire-and-forget-Tasks (verzögerte Sends, Presence): Referenz halten, sonst räumt der GC sie ab
+        self._background: Set[asyncio.Task] = set()
+        # Angemeldeter User pro Verbindung (nach {"action": "auth"})
+        self.users: Dict[WebSocket, Any] = {}
+        # Request/Response über den Socket (siehe register_rpc)
+        self._rpc_methods: Dict[str, RpcHandler] = {}
+        # Laufende RPC-Tasks und Parallelitäts-Limit pro Verbindung
+        self._rpc_tasks: Dict[WebSocket, Set[asyncio.Task]] = {}
+        self._rpc_slots: Dict[WebSocket, asyncio.Semaphore] = {}
+        # Ablauf des JWT pro angemeldeter Verbindung (Unix-Zeit, None = läuft nicht ab)
+        self.auth_expires: Dict[WebSocket, Optional[float]] = {}
+        # Listener für (interne) Topics, z. B. Dashboard-Aggregation
+        self._listeners: Dict[str, List[Listener]] = {}
+        # Zusätzliche Topic-Arten mit Zugriffsprüfung (Präfix -> Guard/Callback)
+        self._topic_types: Dict[str, Dict[str, Any]] = {}
+        # Wer ist wo (über alle Worker, siehe server/presence.py)
+        self.presence = PresenceIndex()
+        self.add_listener(PRESENCE_TOPIC, self._on_presence)
+        # Geänderte/gelöschte User: Auth-Cache leeren, angemeldete Verbindungen neu laden
+        self.add_listener(AUTH_TOPIC, self._on_user_changed)
+        # Geänderte Rätsel aus dem Bewertungs-Cache aller Worker werfen
+        self.add_listener(PUZZLE_TOPIC, puzzle_cache.apply)
+        # Raumlisten für /api/game/available-rooms
+        self.add_listener(ROOM_EVENTS_TOPIC, room_list_cache.apply)
+
+    async def start(self):
+        """Backplane und Heartbeat starten (beim Server-Start aufrufen)"""
+        self.backplane = create_backplane(WS_BACKPLANE)
+        await self.backplane.start(self._deliver)
+        if WS_PING_INTERVAL > 0:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        # Andere Worker sollen ihre Verbindungen melden
+        await self._send_out([PRESENCE_TOPIC], {"op": "sync_request", "worker": WORKER_ID})
+
+    async def stop(self):
+        """Gesammelte Events senden, Heartbeat und Backplane stoppen"""
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        await self.flush_pending()
+        await self._send_out([PRESENCE_TOPIC], {"op": "worker_down", "worker": WORKER_ID})
+        await self.backplane.stop()
+
+    def touch(self, websocket: WebSocket):
+        """Lebenszeichen einer Verbindung vermerken (bei jeder empfangenen Nachricht)"""
+        if websocket in self._last_seen:
+            self._last_seen[websocket] = time.monotonic()
+
+    async def _heartbeat(self):
+        """
+        Stille Verbindungen anpingen und tote Verbindungen aufräumen
+
+        Der Client antwortet auf {"type": "ping"} mit "pong". Wer länger
+        als WS_IDLE_TIMEOUT nichts geschickt hat, fliegt raus. Nebenbei
+        meldet sich der Worker bei den anderen und vergisst die Presence
+        abgestürzter Worker.
+        """
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            await self._send_out([PRESENCE_TOPIC], {"op": "alive", "worker": WORKER_ID})
+            for worker in self.presence.expire_workers():
+                log.warning("Worker %s ohne Lebenszeichen, Presence entfernt", worker)
+            now = time.monotonic()
+
+            for connection, last_seen in list(self._last_seen.items()):
+                idle = now - last_seen
+                if idle > WS_IDLE_TIMEOUT:
+                    await self._evict(connection, "Heartbeat-Timeout")
+                elif idle >= WS_PING_INTERVAL:
+                    self._enqueue(connection, {"type": "ping"})
 
     async def connect(self, websocket: WebSocket):
-        """Neue Verbindung hinzufügen"""
-        await websocket.accept()  # Verbindung akzeptieren
+        """Neue Verbindung hinzufügen (Format per Subprotokoll aushandeln)"""
+        requested = websocket.scope.get("subprotocols", [])
+        if msgpack is not None and MSGPACK_SUBPROTOCOL in requested:
+            await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL)
+            self._binary.add(websocket)
+        elif JSON_SUBPROTOCOL in requested:
+            await websocket.accept(subprotocol=JSON_SUBPROTOCOL)
+        else:
+            await websocket.accept()  # Verbindung akzeptieren
         self.active_connections.append(websocket)
-        print(f"✅ Neuer Client verbunden. Gesamt: {len(self.active_connections)}")
+        self._queues[websocket] = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self._senders[websocket] = asyncio.create_task(self._sender(websocket))
+        self._topics_of[websocket] = set()
+        self._last_seen[websocket] = time.monotonic()
+        self._rpc_tasks[websocket] = set()
+        self._rpc_slots[websocket] = asyncio.Semaphore(WS_RPC_CONCURRENCY)
+        self.subscriptions.setdefault(WILDCARD_TOPIC, set()).add(websocket)
+        self._topics_of[websocket].add(WILDCARD_TOPIC)
+        log.debug("Client verbunden, gesamt: %d", len(self.active_connections))
 
     async def disconnect(self, websocket: WebSocket):
         """Verbindung entfernen"""
+        if websocket not in self._queues:
+            return
+
+        self._remove(websocket)
+        log.debug("Client getrennt, noch: %d", len(self.active_connections))
+
+    def _remove(self, websocket: WebSocket):
+        """Verbindung aus allen Strukturen entfernen und Sender stoppen"""
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
-        print(f"❌ Client getrennt. Noch: {len(self.active_connections)}")
+        self._queues.pop(websocket, None)
+        self._last_seen.pop(websocket, None)
+        self.users.pop(websocket, None)
+        self._binary.discard(websocket)
+        self.auth_expires.pop(websocket, None)
+        self._rpc_slots.pop(websocket, None)
+        for task in self._rpc_tasks.pop(websocket, ()):
+            if task is not asyncio.current_task():
+                task.cancel()
 
-    async def broadcast(self, message: Dict):
-        """Nachricht an ALLE verbundenen Clients senden"""
-        dead_connections = []
+        key = self._presence_key(websocket)
+        if key in self.presence.entries:
+            self._spawn(self._send_out([PRESENCE_TOPIC], {"op": "remove", "key": key}))
+
+        self.unsubscribe(websocket, list(self._topics_of.get(websocket, ())))
+        self._topics_of.pop(websocket, None)
+
+        sender = self._senders.pop(websocket, None)
+        if sender and sender is not asyncio.current_task():
+            sender.cancel()
+
+    async def _evict(self, websocket: WebSocket, reason: str):
+        """Tote oder zu langsame Verbindung rauswerfen"""
+        if websocket not in self._queues:
+            return
+
+        self._remove(websocket)
+        WS_EVICTIONS.labels(reason).inc()
+        log.info("Verbindung entfernt (%s), noch: %d", reason, len(self.active_connections))
+
+        try:
+            await asyncio.wait_for(websocket.close(code=1011), timeout=WS_SEND_TIMEOUT)
+        except Exception:
+            pass
+
+    async def _sender(self, websocket: WebSocket):
+        """Arbeitet die Sende-Queue einer Verbindung ab"""
+        queue = self._queues[websocket]
 
-        for connection in self.active_connections:
+        while True:
+            frame = await queue.get()
             try:
-                await connection.send_json(message)
+                if isinstance(frame, bytes):
+                    send = websocket.send_bytes(frame)
+                else:
+                    send = websocket.send_text(frame)
+                await asyncio.wait_for(send, timeout=WS_SEND_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                await self._evict(websocket, "Timeout beim Senden")
+                return
             except Exception as e:
-                print(f"Fehler beim Senden: {e}")
-                dead_connections.append(connection)
+                log.warning("Fehler beim Senden: %s", e)
+                await self._evict(websocket, "Sendefehler")
+                return
+
+    def _enqueue(self, websocket: WebSocket, message: Dict) -> bool:
+        """Nachricht im Format der Verbindung kodieren und einreihen"""
+        return self._enqueue_frame(websocket, encode_frame(message, websocket in self._binary))
+
+    def _enqueue_frame(self, websocket: WebSocket, frame: Frame) -> bool:
+        """Fertigen Frame in die Queue einer Verbindung legen (blockiert nie)"""
+        queue = self._queues.get(websocket)
+        if queue is None:
+            return False
+
+        try:
+            queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            # Client kommt nicht hinterher -> rauswerfen statt alle aufzuhalten
+            self._spawn(self._evict(websocket, "Sende-Queue voll"))
+            return False
+
+    async def subscribe(self, websocket: WebSocket, topics: Iterable[str]) -> List[str]:
+        """
+        Verbindung für Topics anmelden
+
+        Sobald ein Client eigene Topics abonniert, bekommt er nicht
+        mehr automatisch alles (Wildcard wird entfernt).
+        """
+        own_topics = self._topics_of.get(websocket)
+        if own_topics is None:
+            return []
+
+        accepted = [t for t in topics if isinstance(t, str) and await self._may_subscribe(websocket, t)]
+        if websocket not in self._queues:
+            return []  # während der Prüfung getrennt
+        if accepted and accepted != [WILDCARD_TOPIC]:
+            self.unsubscribe(websocket, [WILDCARD_TOPIC])
+
+        for topic in accepted:
+            self.subscriptions.setdefault(topic, set()).add(websocket)
+            own_topics.add(topic)
+
+        # Anfangszustände erst danach: beim Warten darf die Verbindung wegfallen (_enqueue prüft das)
+        for topic in accepted:
+            topic_type = self._topic_types.get(topic.partition(":")[0])
+            if topic_type and topic_type["initial_message"]:
+                try:
+                    message = topic_type["initial_message"](websocket, topic)
+                    if inspect.isawaitable(message):
+                        message = await message
+                except Exception as e:
+                    log.warning("Anfangszustand fehlgeschlagen (%s): %s", topic, e)
+                    continue
+                self._enqueue(websocket, message)
+
+        return accepted
+
+    def register_topic(self, prefix: str, guard: TopicGuard,
+                       initial_message: Optional[Callable[[WebSocket, str], Any]] = None):
+        """
+        Weitere Topic-Art "<prefix>:<id>" erlauben
+
+        guard entscheidet pro Verbindung, ob abonniert werden darf,
+        initial_message liefert den Anfangszustand für neue Abonnenten.
+        Beide dürfen async sein (z. B. für DB-Zugriffe).
+        """
+        self._topic_types[prefix] = {"guard": guard, "initial_message": initial_message}
+
+    async def _may_subscribe(self, websocket: WebSocket, topic: str) -> bool:
+        """Darf diese Verbindung das Topic abonnieren?"""
+        if is_valid_topic(topic):
+            try:
+                return await may_watch(self.users.get(websocket), topic)
+            except Exception as e:
+                log.warning("Topic-Prüfung fehlgeschlagen (%s): %s", topic, e)
+                return False
+
+        prefix, _, ident = topic.partition(":")
+        topic_type = self._topic_types.get(prefix)
+        if topic_type is None or not ident.isdigit():
+            return False
+
+        try:
+            allowed = topic_type["guard"](self.users.get(websocket), topic)
+            if inspect.isawaitable(allowed):
+                allowed = await allowed
+            return bool(allowed)
+        except Exception as e:
+            log.warning("Topic-Prüfung fehlgeschlagen (%s): %s", topic, e)
+            return False
 
-        # Tote Verbindungen aufräumen
-        for dead in dead_connections:
-            if dead in self.active_connections:
-                self.active_connections.remove(dead)
+    def add_listener(self, topic: str, listener: Listener):
+        """Callback für alle Events eines Topics (läuft in jedem Worker)"""
+        self._listeners.setdefault(topic, []).append(listener)
+
+    def has_subscribers(self, topic: str) -> bool:
+        return bool(self.subscriptions.get(topic))
+
+    def send_local(self, topic: str, message: Dict):
+        """
+        Nachricht nur an die Abonnenten dieses Workers schicken
+
+        Ohne Backplane, ohne Versionsnummer und ohne Wildcard-Empfänger
+        (z. B. für periodische Dashboard-Snapshots).
+        """
+        self._fan_out(self.subscriptions.get(topic, ()), message)
+
+    def unsubscribe(self, websocket: WebSocket, topics: Iterable[str]):
+        """Verbindung von Topics abmelden"""
+        own_topics = self._topics_of.get(websocket)
+        if own_topics is None:
+            return
+
+        for topic in topics:
+            own_topics.discard(topic)
+            subscribers = self.subscriptions.get(topic)
+            if subscribers is not None:
+                subscribers.discard(websocket)
+                if not subscribers:
+                    del self.subscriptions[topic]
+
+    @staticmethod
+    def _presence_key(websocket: WebSocket) -> str:
+        return f"{WORKER_ID}/{id(websocket)}"
+
+    async def set_presence(self, websocket: WebSocket, room_id: Optional[int] = None,
+                           puzzle_id: Optional[int] = None):
+        """Aufenthaltsort einer angemeldeten Verbindung an alle Worker melden"""
+        user = self.users.get(websocket)
+        if user is None or websocket not in self._queues:
+            return
+
+        key = self._presence_key(websocket)
+        previous = self.presence.entries.get(key)
+        entry = presence_entry(user, room_id, puzzle_id, since=previous["since"] if previous else None)
+        await self._send_out([PRESENCE_TOPIC], {"op": "set", "key": key, "entry": entry})
+
+    def _on_presence(self, event: Dict):
+        """Presence-Events anwenden, neuen Workern den eigenen Stand melden"""
+        if event.get("op") == "sync_request":
+            if event.get("worker") != WORKER_ID:
+                for key, entry in self.presence.local_entries():
+                    self._spawn(self._send_out([PRESENCE_TOPIC], {"op": "set", "key": key, "entry": entry}))
+            return
+
+        self.presence.apply(event)
+
+    def _on_user_changed(self, event: Dict):
+        """User geändert/gelöscht: Cache leeren, betroffene Verbindungen neu laden"""
+        user_id = event["user_id"]
+        invalidate_user(user_id)
+        sockets = [ws for ws, user in self.users.items() if user.id == user_id]
+        if sockets:
+            self._spawn(self._refresh_user(user_id, sockets))
+
+    async def _refresh_user(self, user_id: int, sockets: List[WebSocket]):
+        """
+        Angemeldete Verbindungen eines Users mit neuem Stand versehen
+
+        Gelöschte User verlieren die Anmeldung (RPC, Presence), danach
+        werden alle Topics neu geprüft und nicht mehr erlaubte abgemeldet.
+        """
+        async with AsyncSessionLocal() as db:
+            user = await db.get(models.User, user_id)
+        principal = UserPrincipal.from_user(user) if user is not None else None
+
+        for websocket in sockets:
+            current = self.users.get(websocket)
+            if current is None or current.id != user_id:
+                continue  # inzwischen getrennt oder neu angemeldet
+
+            key = self._presence_key(websocket)
+            previous = self.presence.entries.get(key)
+            if principal is None:
+                self.users.pop(websocket, None)
+                self.auth_expires.pop(websocket, None)
+                self._enqueue(websocket, {"type": "auth_error", "detail": "Benutzer existiert nicht mehr"})
+                if previous is not None:
+                    await self._send_out([PRESENCE_TOPIC], {"op": "remove", "key": key})
+            else:
+                self.users[websocket] = principal
+                if previous is not None:
+                    await self.set_presence(websocket, previous["room_id"], previous["puzzle_id"])
+
+            denied = [topic for topic in list(self._topics_of.get(websocket, ()))
+                      if topic != WILDCARD_TOPIC and not await self._may_subscribe(websocket, topic)]
+            if denied:
+                self.unsubscribe(websocket, denied)
+                self._enqueue(websocket, {"type": "unsubscribed", "topics": denied})
+
+    def register_rpc(self, method: str, handler: RpcHandler):
+        """RPC-Methode registrieren (z. B. von routes/game.py)"""
+        self._rpc_methods[method] = handler
+
+    def start_rpc(self, websocket: WebSocket, payload: Dict):
+        """
+        RPC als eigenen Task starten (die Empfangsschleife blockiert nicht)
+
+        Die Tasks werden pro Verbindung gehalten und beim Trennen
+        abgebrochen. Höchstens WS_RPC_CONCURRENCY laufen gleichzeitig,
+        ab WS_RPC_MAX_PENDING offenen Aufrufen wird mit 429 abgelehnt.
+        """
+        tasks = self._rpc_tasks.get(websocket)
+        if tasks is None:
+            return
+        if len(tasks) >= WS_RPC_MAX_PENDING:
+            self._enqueue(websocket, {"type": "rpc_error", "id": payload.get("id"), "status": 429,
+                                      "detail": "Zu viele offene RPC-Aufrufe"})
+            return
+
+        task = asyncio.create_task(self._run_rpc(websocket, payload))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _run_rpc(self, websocket: WebSocket, payload: Dict):
+        slots = self._rpc_slots.get(websocket)
+        if slots is None:
+            return
+        async with slots:
+            await self.handle_rpc(websocket, payload)
+
+    async def handle_rpc(self, websocket: WebSocket, payload: Dict):
+        """
+        RPC-Aufruf ausführen und Antwort über die Queue zurückschicken
+
+        {"action": "rpc", "id": 1, "method": "submit-answer", "params": {...}}
+        -> {"type": "rpc_result", "id": 1, "result": {...}}
+        -> {"type": "rpc_error", "id": 1, "status": 404, "detail": "..."}
+        """
+        call_id = payload.get("id")
+        user = self.users.get(websocket)
+        handler = self._rpc_methods.get(payload.get("method"))
+
+        try:
+            if user is None:
+                raise HTTPException(status_code=401, detail="Ungültige Authentifizierung")
+            expires = self.auth_expires.get(websocket)
+            if expires is not None and time.time() >= expires:
+                # Abgelaufenes JWT: Verbindung gilt ab jetzt als nicht angemeldet
+                self.users.pop(websocket, None)
+                self.auth_expires.pop(websocket, None)
+                raise HTTPException(status_code=401, detail="Token abgelaufen")
+            if handler is None:
+                raise HTTPException(status_code=404, detail="Unbekannte RPC-Methode")
+
+            result = await handler(user, payload.get("params") or {})
+            reply = {"type": "rpc_result", "id": call_id, "result": result}
+
+        except HTTPException as e:
+            reply = {"type": "rpc_error", "id": call_id, "status": e.status_code, "detail": e.detail}
+        except ValidationError as e:
+            reply = {"type": "rpc_error", "id": call_id, "status": 422, "detail": str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            reply = {"type": "rpc_error", "id": call_id, "status": 422, "detail": f"Ungültige Parameter: {e}"}
+        except Exception:
+            log.exception("RPC-Fehler (%s)", payload.get("method"))
+            reply = {"type": "rpc_error", "id": call_id, "status": 500, "detail": "Interner Fehler"}
+
+        self._enqueue(websocket, reply)
+
+    def current_versions(self, topics: Iterable[str]) -> Dict[str, int]:
+        """Aktuelle Versionsnummern der Topics"""
+        return {topic: self._versions.get(topic, 0) for topic in topics}
+
+    async def send_to(self, websocket: WebSocket, message: Dict):
+        """Nachricht an EINE Verbindung senden (über deren Queue)"""
+        self._enqueue(websocket, message)
+
+    async def broadcast(self, message: Dict):
+        """
+        Nachricht an ALLE verbundenen Clients senden
+
+        Legt die Nachricht nur in die Sende-Queues, die Auslieferung
+        passiert parallel in den Sender-Tasks. Der Aufrufer wartet also
+        nicht auf langsame Boards.
+        """
+        self._fan_out(self.active_connections, message)
+
+    async def publish(self, topics: Iterable[str], message: Dict):
+        """
+        Nachricht nur an die Abonnenten der Topics senden
+
+        rooms_updated-Events zum selben Raum werden WS_COALESCE_MS lang
+        gesammelt und dann als EINE Nachricht verschickt. Das Fenster
+        startet mit dem ersten Event, die Verzögerung ist also begrenzt.
+
+        Die Raumlisten dieses Workers werden sofort verworfen, damit ein
+        Reload direkt nach der Änderung nicht das Sammelfenster abwarten muss.
+        """
+        room_list_cache.apply(message)
+        key = self._coalesce_key(message)
+        if key is None or WS_COALESCE_MS <= 0:
+            await self._send_out(topics, message)
+            return
+
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = {"topics": list(topics), "message": message}
+            asyncio.get_running_loop().call_later(WS_COALESCE_MS / 1000, self._flush, key)
+        else:
+            pending["topics"] = list(dict.fromkeys(pending["topics"] + list(topics)))
+            pending["message"] = merge_room_events(pending["message"], message)
+
+    @staticmethod
+    def _coalesce_key(message: Dict) -> Optional[str]:
+        """Events zum selben Raum teilen sich einen Schlüssel"""
+        if message.get("type") == "rooms_updated" and message.get("room_id") is not None:
+            return room_topic(message["room_id"])
+        return None
+
+    def _flush(self, key: str):
+        """Gesammelte Events eines Schlüssels verschicken"""
+        pending = self._pending.pop(key, None)
+        if pending:
+            self._spawn(self._send_out(pending["topics"], pending["message"]))
+
+    async def flush_pending(self):
+        """Alle gesammelten und gerade laufenden Events verschicken (z. B. beim Herunterfahren)"""
+        for key in list(self._pending):
+            pending = self._pending.pop(key)
+            await self._send_out(pending["topics"], pending["message"])
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Hintergrund-Task starten und bis zum Ende festhalten"""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def _send_out(self, topics: Iterable[str], message: Dict):
+        """
+        Event über die Backplane an alle Worker (inkl. diesem) geben
+
+        "*" nur bei öffentlichen Events (aktive Räume): Wildcard-Sockets
+        sind oft nicht angemeldet und dürfen teacher:/inaktive room:-Events
+        nicht sehen. Interne Listener hängen an ROOM_EVENTS_TOPIC.
+        """
+        topics = list(topics)
+        if message.get("type") == "rooms_updated":
+            topics.append(ROOM_EVENTS_TOPIC)
+        if ACTIVE_ROOMS_TOPIC in topics:
+            topics.append(WILDCARD_TOPIC)
+        topics = list(dict.fromkeys(topics))
+        try:
+            await self.backplane.publish(topics, message)
+        except Exception as e:
+            log.error("Backplane-Publish fehlgeschlagen: %s", e)
+
+    def _deliver(self, topics: List[str], message: Dict):
+        """
+        Von der Backplane empfangenes Event an die eigenen Sockets verteilen
+
+        Jede Verbindung bekommt die Nachricht höchstens einmal, auch wenn
+        sie mehrere der Topics abonniert hat. Kosten: O(Abonnenten).
+
+        Die Backplane hat die fortlaufenden Versionsnummern pro Topic
+        bereits unter "versions" eingetragen, dazu ihre "epoch".
+        """
+        epoch = message.get("epoch")
+        if epoch != self.epoch:
+            # Neue Zählerreihe (Broker gewechselt, Fallback): alte Stände gelten nicht mehr
+            self.epoch = epoch
+            self._versions.clear()
+        self._versions.update(message.get("versions", {}))
+
+        for topic in topics:
+            for listener in self._listeners.get(topic, ()):
+                try:
+                    listener(message)
+                except Exception:
+                    log.exception("Listener-Fehler (%s)", topic)
+
+        with WS_BROADCAST_SECONDS.time():
+            recipients: Set[WebSocket] = set()
+            for topic in topics:
+                recipients.update(self.subscriptions.get(topic, ()))
+
+            self._fan_out(recipients, message)
+        if recipients:
+            WS_BROADCAST_RECIPIENTS.observe(len(recipients))
+
+    def _fan_out(self, connections: Iterable[WebSocket], message: Dict):
+        """Nachricht höchstens einmal pro Format kodieren und einreihen"""
+        frames: Dict[bool, Frame] = {}
+        for connection in list(connections):
+            binary = connection in self._binary
+            if binary not in frames:
+                frames[binary] = encode_frame(message, binary)
+            self._enqueue_frame(connection, frames[binary])
 
 
 # Globale Instanz (wird in main.py importiert!)
 manager = ConnectionManager()
+WS_CONNECTIONS.set_function(lambda: len(manager.active_connections))
+
+
+async def publish_user_changed(user_id: int):
+    """
+    Nach jedem Ändern/Löschen eines Users aufrufen
+
+    Leert den Auth-Cache und lädt angemeldete Verbindungen neu, in allen
+    Workern (auch diesem, die Backplane liefert lokal mit aus).
+    """
+    await manager.publish([AUTH_TOPIC], {"op": "invalidate", "user_id": user_id})
+
+
+async def handle_client_message(websocket: WebSocket, data: Frame):
+    """
+    Nachrichten vom Client verarbeiten (JSON-Text oder MessagePack)
+
+    {"action": "auth", "token": "<JWT>"}
+    {"action": "subscribe", "topics": ["room:1", "teacher:2", "active-rooms"]}  (teacher:/inaktive Räume erst nach auth)
+    {"action": "unsubscribe", "topics": ["room:1"]}
+    {"action": "rpc", "id": 1, "method": "submit-answer", "params": {...}}
+    {"action": "presence", "room_id": 3, "puzzle_id": 12}
+    """
+    try:
+        payload = decode_frame(data)
+    except ValueError:  # auch json.JSONDecodeError
+        return
+    except Exception as e:
+        log.debug("Ungültige Nachricht: %s", e)
+        return
+
+    if not isinstance(payload, dict):
+        return
+
+    action = payload.get("action")
+    topics = payload.get("topics") or []
+    if not isinstance(topics, list):
+        topics = [topics]
+
+    if action == "auth":
+        user = await get_user_by_token(str(payload.get("token", "")))
+        if user is None:
+            await manager.send_to(websocket, {"type": "auth_error", "detail": "Ungültige Authentifizierung"})
+            return
+
+        manager.users[websocket] = user
+        manager.auth_expires[websocket] = token_expiry(str(payload.get("token", "")))
+        await manager.send_to(websocket, {"type": "auth_ok", "user_id": user.id})
+        await manager.set_presence(websocket)
+
+    elif action == "presence":
+        if websocket not in manager.users:
+            await manager.send_to(websocket, {"type": "auth_error", "detail": "Ungültige Authentifizierung"})
+            return
+
+        try:
+            room_id = int(payload["room_id"]) if payload.get("room_id") is not None else None
+            puzzle_id = int(payload["puzzle_id"]) if payload.get("puzzle_id") is not None else None
+        except (TypeError, ValueError):
+            return
+        await manager.set_presence(websocket, room_id, puzzle_id)
+
+    elif action == "rpc":
+        manager.start_rpc(websocket, payload)
+
+    elif action == "subscribe":
+        accepted = await manager.subscribe(websocket, topics)
+        await manager.send_to(websocket, {
+            "type": "subscribed",
+            "topics": accepted,
+            "versions": manager.current_versions(accepted),
+            "epoch": manager.epoch
+        })
+    elif action == "unsubscribe":
+        manager.unsubscribe(websocket, topics)
+        await manager.send_to(websocket, {
+            "type": "unsubscribed",
+            "topics": topics
+        })
 
 
 @router.websocket("/ws/rooms")
@@ -54,19 +865,33 @@ async def websocket_rooms_endpoint(websocket: WebSocket):
     try:
         # Endlos-Schleife: warte auf Nachrichten vom Client
         while True:
-            # Client kann "ping" senden als Keep-Alive
-            data = await websocket.receive_text()
+            # Jede Nachricht (auch "pong" auf den Heartbeat) zählt als Lebenszeichen
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            manager.touch(websocket)
+
+            # Binär-Frames sind immer MessagePack
+            if frame.get("bytes") is not None:
+                await handle_client_message(websocket, frame["bytes"])
+                continue
+
+            data = frame.get("text") or ""
 
             # Optional: auf bestimmte Nachrichten reagieren
-            if data == "get_rooms":
-                await websocket.send_json({
+            if data in ("ping", "pong"):
+                continue
+            elif data == "get_rooms":
+                await manager.send_to(websocket, {
                     "type": "rooms_update_request",
                     "message": "Bitte Räume neu laden"
                 })
+            elif data.startswith("{"):
+                await handle_client_message(websocket, data)
 
     except WebSocketDisconnect:
         # Client hat Verbindung geschlossen
         await manager.disconnect(websocket)
     except Exception as e:
-        print(f"WebSocket Fehler: {e}")
-        await manager.disconnect(websocket)
\ No newline at end of file
+        log.warning("WebSocket-Fehler: %s", e)
+        await manager.disconnect(websocket)
@@ -91,10 +91,12 @@ class PuzzleResultCreate(BaseModel):
     puzzle_id: int
     answer_json: Dict[str, Any]
     time_taken_seconds: int
+    # Zufälliger Schlüssel pro Antwort (z. B. uuid4): gleiche Antwort erneut senden ist dann sicher
+    idempotency_key: Optional[str] = Field(None, max_length=64)
 
 
 class PuzzleResult(PuzzleResultCreate):
-    id: int
+    id: Optional[int] = None  # None: angenommen, aber noch nicht gespeichert (Write-behind)
     is_correct: bool
     points_earned: int
     answered_at: datetime
@@ -103,6 +105,25 @@ class PuzzleResult(PuzzleResultCreate):
         from_attributes = True
 
 
+class AnswerBatchItem(BaseModel):
+    """Ergebnis einer Antwort aus POST /api/game/submit-answers (gleiche Reihenfolge wie gesendet)"""
+    index: int
+    status: int  # 200 = gespeichert, sonst HTTP-Status des Fehlers
+    session_id: int
+    puzzle_id: int
+    is_correct: Optional[bool] = None
+    points_earned: Optional[int] = None
+    replayed: bool = False  # bereits früher mit demselben idempotency_key gespeichert
+    detail: Optional[str] = None
+
+
+class AnswerBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    points_earned: int  # nur neu gespeicherte Antworten
+    results: List[AnswerBatchItem]
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str